@@ -0,0 +1,186 @@
+from typing import Any, Callable, Dict, List, Tuple
+import logging
+import re
+
+import numpy as np
+import pandas as pd
+
+from .general_summary import _load_core_dataset, _apply_filters
+
+logger = logging.getLogger(__name__)
+
+SAT_COL = "ep07_18_en_general_cual_es_su_grado_de_satisfaccion_en_relacion"
+SATISFACTION_MAPPING = {
+    "Insatisfecho (a)": 1,
+    "Algo satisfecho (a)": 2,
+    "Satisfecho (a)": 3,
+    "Muy satisfecho (a)": 4,
+    "Extremadamente satisfecho (a)": 5,
+}
+GRUPO_DEFAULT = "programa"
+
+
+def _natural_key(valor: Any) -> tuple:
+    """Orden natural de etiquetas ("2023-2" < "2023-10" < "2024")."""
+    partes = re.split(r"(\d+)", str(valor))
+    return tuple((0, int(p)) if p.isdigit() else (1, p) for p in partes if p)
+
+
+def _labels(serie: pd.Series) -> pd.Series:
+    """Valores como texto, nulos como "NA" (mismas llaves que las distribuciones)."""
+    return serie.astype(object).where(serie.notna(), "NA").astype(str)
+
+
+def group_aggregates(df: pd.DataFrame, etiquetas: pd.Series,
+                     variables: List[str]) -> Tuple[pd.DataFrame, List[str], pd.Series]:
+    """
+    Agregados por grupo en una sola pasada agrupada.
+
+    Devuelve (por_grupo, numericas, conteos):
+      - por_grupo: índice = grupo; columnas n y, si existe la pregunta de
+        satisfacción, n_sat / satisfaccion_media / promotores / detractores,
+        más media_<var> por cada variable numérica
+      - numericas: variables con al menos un valor numérico
+      - conteos: Serie indexada por (variable, grupo, valor) con la frecuencia
+    """
+    medidas = pd.DataFrame({"grupo": etiquetas})
+    aggs: Dict[str, Any] = {"n": ("grupo", "size")}
+    if SAT_COL in df.columns:
+        sat = df[SAT_COL].map(SATISFACTION_MAPPING).astype(float)
+        medidas["sat"] = sat
+        medidas["promotor"] = sat >= 4
+        medidas["detractor"] = sat <= 2
+        aggs.update(
+            n_sat=("sat", "count"),
+            satisfaccion_media=("sat", "mean"),
+            promotores=("promotor", "sum"),
+            detractores=("detractor", "sum"),
+        )
+    numericas = []
+    for v in variables:
+        num = pd.to_numeric(df[v], errors="coerce")
+        if num.notna().any():
+            medidas[f"num_{v}"] = num
+            aggs[f"media_{v}"] = (f"num_{v}", "mean")
+            numericas.append(v)
+
+    por_grupo = medidas.groupby("grupo", sort=False).agg(**aggs)
+
+    conteos = pd.Series(dtype="int64")
+    if variables:
+        largo = _labels(df[variables])
+        largo.insert(0, "grupo", etiquetas)
+        conteos = (
+            largo.melt(id_vars="grupo", var_name="variable", value_name="valor")
+            .groupby(["variable", "grupo", "valor"], sort=True)
+            .size()
+        )
+    return por_grupo, numericas, conteos
+
+
+def grouped_result(por_grupo: pd.DataFrame, numericas: List[str], conteos: pd.Series,
+                   variables: List[str], orden: List[str]) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Filas por grupo (en `orden`) y distribuciones {variable: {grupo: {valor: conteo}}}
+    a partir de los agregados; común a pandas y DuckDB.
+    """
+    por_grupo = por_grupo.loc[orden]
+    con_sat = "n_sat" in por_grupo.columns
+    if con_sat:
+        por_grupo = por_grupo.assign(nps=np.where(
+            por_grupo["n_sat"] > 0,
+            (por_grupo["promotores"] - por_grupo["detractores"]) * 100.0
+            / por_grupo["n_sat"].where(por_grupo["n_sat"] > 0, 1),
+            np.nan,
+        ))
+
+    def _num(x: Any) -> float | None:
+        return None if pd.isna(x) else float(x)
+
+    filas: List[Dict[str, Any]] = []
+    for grupo, fila in por_grupo.iterrows():
+        punto: Dict[str, Any] = {"grupo": grupo, "n": int(fila["n"])}
+        if con_sat:
+            punto["satisfaccion_media"] = _num(fila["satisfaccion_media"])
+            punto["nps"] = _num(fila["nps"])
+        for v in numericas:
+            punto[f"media_{v}"] = _num(fila[f"media_{v}"])
+        filas.append(punto)
+
+    distribuciones: Dict[str, Any] = {}
+    for (variable, grupo, valor), conteo in conteos.items():
+        distribuciones.setdefault(variable, {}).setdefault(grupo, {})[valor] = int(conteo)
+    distribuciones = {
+        v: {g: distribuciones[v].get(g, {}) for g in orden}
+        for v in variables
+        if v in distribuciones
+    }
+    return filas, distribuciones
+
+
+def comparison_kpis(grupo: str, filas: List[Dict[str, Any]], numericas: List[str]) -> Dict[str, Any]:
+    """Grupos comparados y, por medida, el rango entre grupos y el grupo con el valor más alto."""
+    kpis: Dict[str, Any] = {
+        "grupo": grupo,
+        "grupos": [f["grupo"] for f in filas],
+        "n_grupos": len(filas),
+    }
+    for clave in ["satisfaccion_media", "nps", *[f"media_{v}" for v in numericas]]:
+        valores = [(f[clave], f["grupo"]) for f in filas if f.get(clave) is not None]
+        if len(valores) > 1:
+            mayor, menor = max(valores), min(valores)
+            kpis[f"rango_{clave}"] = float(mayor[0] - menor[0])
+            kpis[f"mayor_{clave}"] = mayor[1]
+    return kpis
+
+
+def comparison_group(opciones: Dict[str, Any] | None) -> str:
+    """Columna de agrupación: opciones["grupo"] (por defecto 'programa')."""
+    grupo = (opciones or {}).get("grupo") or GRUPO_DEFAULT
+    if not isinstance(grupo, str):
+        raise ValueError("'grupo' debe ser el nombre de una columna.")
+    return grupo
+
+
+def generate_group_comparison(poblacion: Dict[str, Any],
+                              distribuciones: List[str],
+                              df: pd.DataFrame | None = None,
+                              opciones: Dict[str, Any] | None = None,
+                              orden_key: Callable[[Any], Any] = _natural_key) -> Dict[str, Any]:
+    """
+    Comparación de grupos dentro de la población: las mismas medidas que la
+    tendencia (n, satisfacción, NPS, media de las variables numéricas) y las
+    tablas cruzadas de 'distribuciones' por cada valor de opciones["grupo"].
+
+    Devuelve:
+    {
+        "kpis": { "grupo", "grupos": [...], "n_grupos", "rango_...", "mayor_..." },
+        "tablas": { "grupos": [ {grupo, n, satisfaccion_media, nps, media_<var>...}, ... ] },
+        "distribuciones": { variable: { grupo: { valor: conteo } } }
+    }
+    """
+    dataset_name = poblacion.get("dataset")
+    if not dataset_name:
+        raise ValueError("La población no contiene el campo 'dataset'.")
+    grupo = comparison_group(opciones)
+
+    if df is None:
+        df = _load_core_dataset(dataset_name, poblacion=poblacion)
+        df = _apply_filters(df, poblacion)
+
+    if grupo not in df.columns:
+        raise ValueError(f"El dataset '{dataset_name}' no tiene la columna de grupo '{grupo}'.")
+
+    if "n" not in poblacion:
+        poblacion["n"] = len(df)
+
+    variables = [v for v in dict.fromkeys(distribuciones) if v in df.columns and v != grupo]
+    por_grupo, numericas, conteos = group_aggregates(df, _labels(df[grupo]), variables)
+    orden = sorted(por_grupo.index, key=orden_key)
+    filas, distribuciones_resultado = grouped_result(por_grupo, numericas, conteos, variables, orden)
+
+    return {
+        "kpis": comparison_kpis(grupo, filas, numericas),
+        "tablas": {"grupos": filas},
+        "distribuciones": distribuciones_resultado,
+    }
@@ -0,0 +1,142 @@
+from typing import Any, Dict, List
+import json
+import logging
+import os
+
+import pandas as pd
+
+from etl.db import make_engine
+from etl.profiles import load_column_profiles
+
+logger = logging.getLogger(__name__)
+
+
+def _requested_version(poblacion: Dict[str, Any]) -> str | None:
+    """Versión pedida explícitamente en la población (campo o filtro de igualdad)."""
+    if poblacion.get("version"):
+        return str(poblacion["version"])
+    filtro = (poblacion.get("filtros") or {}).get("version")
+    if isinstance(filtro, dict):
+        filtro = filtro.get("eq")
+    return str(filtro) if isinstance(filtro, (str, int, float)) else None
+
+
+def _top_shares(top_json: Any) -> Dict[str, float]:
+    """Convierte el JSON de top_valores en proporciones {valor: share}."""
+    try:
+        filas = json.loads(top_json) if isinstance(top_json, str) else []
+    except ValueError:
+        return {}
+    total = sum(f["total"] for f in filas)
+    return {f["valor"]: f["total"] / total for f in filas} if total else {}
+
+
+def _total_variation(a: Dict[str, float], b: Dict[str, float]) -> float:
+    """Distancia de variación total entre dos distribuciones de top valores (0–1)."""
+    claves = set(a) | set(b)
+    return 0.5 * sum(abs(a.get(k, 0.0) - b.get(k, 0.0)) for k in claves)
+
+
+def _build_drift_table(actual: pd.DataFrame, anterior: pd.DataFrame) -> List[Dict[str, Any]]:
+    cruce = actual.merge(anterior, on="columna", how="inner", suffixes=("", "_ant"))
+    filas: List[Dict[str, Any]] = []
+    for r in cruce.itertuples(index=False):
+        filas.append(
+            {
+                "columna": r.columna,
+                "delta_pct_nulos": round(float(r.pct_nulos - r.pct_nulos_ant), 2),
+                "delta_cardinalidad": int(r.cardinalidad - r.cardinalidad_ant),
+                "cambio_tipo": r.tipo_detectado != r.tipo_detectado_ant,
+                "distancia_top_valores": round(
+                    _total_variation(_top_shares(r.top_valores), _top_shares(r.top_valores_ant)), 3
+                ),
+            }
+        )
+    filas.sort(key=lambda f: (f["distancia_top_valores"], abs(f["delta_pct_nulos"])), reverse=True)
+    return filas
+
+
+def generate_data_quality(poblacion: Dict[str, Any],
+                          distribuciones: List[str]) -> Dict[str, Any]:
+    """
+    Analítica de calidad de datos.
+
+    No recorre el dataset: consulta los perfiles por columna que el ETL
+    precalcula en cada carga (etl.column_profiles) para el programa/versión
+    y los compara contra la versión cargada inmediatamente antes (drift).
+
+    Devuelve:
+      {
+        "kpis": { ... },
+        "tablas": { "perfil_columnas": [...], "drift": [...] },
+        "distribuciones": { variable: {valor: total, ...} }
+      }
+    """
+    dataset_name = poblacion.get("dataset")
+    if not dataset_name:
+        raise ValueError("La población no contiene el campo 'dataset'.")
+
+    schema = os.getenv("ETL_SCHEMA", "etl")
+    engine = make_engine()
+    with engine.connect() as conn:
+        perfiles = load_column_profiles(conn, dataset_name, poblacion.get("programa"), schema=schema)
+
+    if perfiles.empty:
+        logger.warning(f"No hay perfiles de columnas para {dataset_name}/{poblacion.get('programa')}")
+        return {"kpis": {"perfiles_disponibles": False}, "tablas": {}, "distribuciones": {}}
+
+    # Versiones ordenadas por fecha de cálculo (la última carga al final)
+    orden = (
+        perfiles.groupby("version")["calculado_en"].max().sort_values().index.tolist()
+    )
+    version = _requested_version(poblacion)
+    if version not in orden:
+        version = orden[-1]
+    pos = orden.index(version)
+    version_anterior = orden[pos - 1] if pos > 0 else None
+
+    actual = perfiles[perfiles["version"] == version]
+    kpis: Dict[str, Any] = {
+        "perfiles_disponibles": True,
+        "version": version,
+        "version_anterior": version_anterior,
+        "n_registros": int(actual["n_total"].max()) if not actual.empty else 0,
+        "n_columnas": int(len(actual)),
+        "pct_nulos_promedio": round(float(actual["pct_nulos"].mean()), 2) if not actual.empty else 0.0,
+        "columnas_mayoria_nulos": int((actual["pct_nulos"] > 50).sum()),
+        "columnas_vacias": int((actual["cardinalidad"] == 0).sum()),
+    }
+
+    tablas: Dict[str, Any] = {
+        "perfil_columnas": [
+            {
+                "columna": r.columna,
+                "tipo_detectado": r.tipo_detectado,
+                "pct_nulos": float(r.pct_nulos),
+                "cardinalidad": int(r.cardinalidad),
+                "pct_numerico": float(r.pct_numerico),
+            }
+            for r in actual.itertuples(index=False)
+        ]
+    }
+
+    if version_anterior is not None:
+        anterior = perfiles[perfiles["version"] == version_anterior]
+        cols_act, cols_ant = set(actual["columna"]), set(anterior["columna"])
+        kpis["columnas_nuevas"] = sorted(cols_act - cols_ant)
+        kpis["columnas_eliminadas"] = sorted(cols_ant - cols_act)
+        tablas["drift"] = _build_drift_table(actual, anterior)
+
+    distribuciones_resultado: Dict[str, Any] = {}
+    por_columna = actual.set_index("columna")
+    for variable in distribuciones:
+        if variable not in por_columna.index:
+            continue
+        top = json.loads(por_columna.at[variable, "top_valores"] or "[]")
+        distribuciones_resultado[variable] = {f["valor"]: int(f["total"]) for f in top}
+
+    return {
+        "kpis": kpis,
+        "tablas": tablas,
+        "distribuciones": distribuciones_resultado,
+    }
@@ -1,25 +1,42 @@
-from typing import Any, Dict, List
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
 import os
 import logging
+import threading
 
+import numpy as np
 import pandas as pd
 from sqlalchemy import text
 
 from etl.db import make_engine
+from etl.snapshots import read_snapshot, snapshot_watermarks
+from analytics.arrow_cache import ARROW_CACHE, load_slices
+from analytics.bootstrap import bootstrap_mean_ci, interval_options, nps_scores
+from analytics.frame_index import FrameIndex, compile_filter_mask
+from analytics.weighting import population_weights, weighted_composition, weighted_mean
+from analytics.watermark import current_watermark
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
 
-def _load_core_dataset(dataset_name: str, core_schema: str | None = None) -> pd.DataFrame:
-    """
-    Carga el dataset desde la base de datos del ETL, leyendo la tabla
-    core.<dataset_name> (o el schema que se indique).
+# Origen del core: "postgres" (SELECT * a core.<dataset>) o "parquet"
+# (snapshots de etl.snapshots, con proyección y pushdown de programa/version)
+CORE_READ_MODE = os.getenv("CORE_READ_MODE", "postgres").lower()
+# Lecturas acotadas por programa/version (snapshots o cache Arrow por slices)
+CORE_PUSHDOWN = CORE_READ_MODE == "parquet" or ARROW_CACHE
 
-    Usa la misma conexión que el módulo etl (PG_DSN, etc.).
-    """
-    schema = core_schema or os.getenv("CORE_SCHEMA", "core")
+# Cache por proceso de los frames core: (schema, dataset, modo, pushdown) -> (watermark, df, bytes).
+# Es heap de cada worker del pool: acotada en frames y en bytes. Con
+# ARROW_CACHE no se usa (los slices mapeados ya se comparten entre procesos)
+CORE_FRAME_CACHE_MAX = int(os.getenv("CORE_FRAME_CACHE_MAX", "1"))
+CORE_FRAME_CACHE_MAX_BYTES = int(os.getenv("CORE_FRAME_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+_CORE_FRAMES: "OrderedDict[tuple, tuple]" = OrderedDict()
+_FRAME_INDEXES: Dict[int, FrameIndex] = {}
+_CORE_LOCK = threading.Lock()
 
+
+def _read_core_dataset(dataset_name: str, schema: str) -> pd.DataFrame:
     engine = make_engine()
     query = text(f'SELECT * FROM "{schema}"."{dataset_name}"')
 
@@ -29,6 +46,128 @@ def _load_core_dataset(dataset_name: str, core_schema: str | None = None) -> pd.
     return df
 
 
+def _snapshot_pushdown(poblacion: Dict[str, Any] | None) -> Tuple[tuple | None, tuple | None]:
+    """
+    (programas, versiones) que se pueden empujar a la lectura de snapshots.
+    Siempre es un superconjunto de lo que deja pasar _apply_filters, que se
+    sigue aplicando después.
+    """
+    if not poblacion:
+        return None, None
+    programas = None
+    if poblacion.get("programa") is not None:
+        programas = (str(poblacion["programa"]),)
+
+    cond = (poblacion.get("filtros") or {}).get("version")
+    if isinstance(cond, dict) and len(cond) == 1:
+        cond = cond.get("eq", cond.get("in"))
+    versiones = None
+    if isinstance(cond, (str, int, float)) and not isinstance(cond, bool):
+        versiones = (str(cond),)
+    elif isinstance(cond, list):
+        versiones = tuple(sorted({str(v) for v in cond}))
+    return programas, versiones
+
+
+def _read_core_snapshot(dataset_name: str, programas: tuple | None, versiones: tuple | None,
+                        columns: tuple | None, core_schema: str = "core") -> pd.DataFrame | None:
+    with make_engine().connect() as conn:
+        marcas = snapshot_watermarks(conn, dataset_name, os.getenv("ETL_SCHEMA", "etl"), core_schema)
+    return read_snapshot(dataset_name, marcas, columns, programas, versiones)
+
+
+def _load_core_dataset(dataset_name: str, core_schema: str | None = None,
+                       poblacion: Dict[str, Any] | None = None,
+                       columns: List[str] | None = None) -> pd.DataFrame:
+    """
+    Carga el dataset desde la base de datos del ETL, leyendo la tabla
+    core.<dataset_name> (o el schema que se indique).
+
+    Usa la misma conexión que el módulo etl (PG_DSN, etc.).
+
+    Con CORE_READ_MODE=parquet lee los snapshots Parquet del core: solo los
+    archivos de los programas pedidos, descartando row groups por versión
+    (según `poblacion`) y proyectando `columns` (más las columnas de filtro).
+    Si no hay snapshots al día lee de Postgres.
+
+    Con ARROW_CACHE=true el dataset se materializa una vez por marca de agua
+    en slices Arrow IPC (ver analytics.arrow_cache) que todos los procesos
+    mapean en memoria en lugar de leer cada uno su copia.
+
+    Sin ARROW_CACHE el frame queda cacheado en el proceso mientras la marca
+    de agua del dataset no cambie, junto con su índice de filtros (ver
+    _apply_filters), dentro de CORE_FRAME_CACHE_MAX y CORE_FRAME_CACHE_MAX_BYTES.
+    En un trabajo del pool la marca es la que fijó la API para la llave de
+    la cache de resultados (ver analytics.watermark.pinned_watermark).
+    El frame devuelto es compartido: no se debe modificar en sitio.
+    """
+    schema = core_schema or os.getenv("CORE_SCHEMA", "core")
+    programas = versiones = cols = None
+    if CORE_PUSHDOWN:
+        programas, versiones = _snapshot_pushdown(poblacion)
+        if columns is not None:
+            necesarias = set(columns) | {"programa", "version"} | set((poblacion or {}).get("filtros") or {})
+            cols = tuple(sorted(necesarias))
+    key = (schema, dataset_name, CORE_READ_MODE, programas, versiones, cols)
+
+    def _read(programas=programas, versiones=versiones, cols=cols) -> pd.DataFrame:
+        if CORE_READ_MODE == "parquet":
+            try:
+                df = _read_core_snapshot(dataset_name, programas, versiones, cols, schema)
+                if df is not None:
+                    return df
+                logger.info(f"Sin snapshots vigentes de {dataset_name}; leyendo de Postgres")
+            except Exception as e:
+                logger.warning(f"No se pudieron leer los snapshots de {dataset_name}: {e}")
+        return _read_core_dataset(dataset_name, schema)
+
+    watermark = current_watermark(dataset_name)
+    if watermark is None:
+        return _read()
+
+    if ARROW_CACHE:
+        # cada llamada mapea los slices de nuevo (barato): guardar el frame
+        # retendría en el heap del worker lo que pandas no pudo dejar en el mmap
+        try:
+            return load_slices(dataset_name, watermark, programas, versiones, cols,
+                               reader=lambda: _read(None, None, None))
+        except Exception as e:
+            logger.warning(f"Cache Arrow no disponible para {dataset_name}: {e}")
+
+    with _CORE_LOCK:
+        hit = _CORE_FRAMES.get(key)
+        if hit and hit[0] == watermark:
+            _CORE_FRAMES.move_to_end(key)
+            return hit[1]
+
+    df = _read()
+    nbytes = int(df.memory_usage(index=True, deep=True).sum())
+    with _CORE_LOCK:
+        old = _CORE_FRAMES.pop(key, None)
+        if old is not None:
+            _FRAME_INDEXES.pop(id(old[1]), None)
+        if nbytes > CORE_FRAME_CACHE_MAX_BYTES:
+            logger.info(f"Frame de {dataset_name} ({nbytes} bytes) excede CORE_FRAME_CACHE_MAX_BYTES; sin cache")
+            return df
+        _CORE_FRAMES[key] = (watermark, df, nbytes)
+        _FRAME_INDEXES[id(df)] = FrameIndex(df)
+        total = sum(e[2] for e in _CORE_FRAMES.values())
+        while len(_CORE_FRAMES) > CORE_FRAME_CACHE_MAX or total > CORE_FRAME_CACHE_MAX_BYTES:
+            _, (_, evicted, evicted_bytes) = _CORE_FRAMES.popitem(last=False)
+            _FRAME_INDEXES.pop(id(evicted), None)
+            total -= evicted_bytes
+    return df
+
+
+def _frame_index(df: pd.DataFrame) -> FrameIndex:
+    """Índice del frame si es un core cacheado; si no, uno efímero."""
+    with _CORE_LOCK:
+        index = _FRAME_INDEXES.get(id(df))
+    if index is not None and index.df is df:
+        return index
+    return FrameIndex(df)
+
+
 def _apply_filters(df: pd.DataFrame, poblacion: Dict[str, Any]) -> pd.DataFrame:
     """
     Aplica 'programa' y 'filtros' de la población sobre el DataFrame.
@@ -37,92 +176,21 @@ def _apply_filters(df: pd.DataFrame, poblacion: Dict[str, Any]) -> pd.DataFrame:
       - valor simple:  {"sexo": "F"}       -> df[df["sexo"] == "F"]
       - lista:         {"sexo": ["F","M"]} -> df[df["sexo"].isin(["F","M"])]
       - dict:          {"anio": {"gte": 2020, "lte": 2024}}
+
+    Las columnas de año ('ano'/'year' en el nombre) se comparan como numéricas.
+    Todas las condiciones se evalúan a una sola máscara (AND) sobre el índice
+    de bitmaps del frame y el DataFrame se recorta una única vez.
     """
-    logger.info(f"Applying filters to dataframe. Available columns: {list(df.columns)}")
-    
-    # Filtro directo por programa si existe y la columna está en el DF
-    programa = poblacion.get("programa")
-    if programa is not None and "programa" in df.columns:
-        logger.info(f"Filtering by programa: {programa}")
-        df = df[df["programa"] == programa]
-
-    filtros = poblacion.get("filtros", {}) or {}
-    logger.info(f"Processing filters: {filtros}")
-    
-    for col, cond in filtros.items():
-        logger.info(f"Processing filter for column '{col}' with condition: {cond}")
-        if col not in df.columns:
-            logger.warning(f"Column '{col}' not found in dataframe. Available columns: {list(df.columns)}")
-            # Si la columna no existe, ignoramos ese filtro
-            continue
+    logger.info(f"Processing filters: programa={poblacion.get('programa')}, filtros={poblacion.get('filtros')}")
 
-        logger.info(f"Applying filter for column '{col}'")
-        serie = df[col]
-        
-        # Special handling for year columns - convert to numeric if needed
-        if 'ano' in col.lower() or 'year' in col.lower():
-            logger.info(f"Detected year column '{col}', converting to numeric")
-            # Convert to numeric, invalid parsing becomes NaN
-            serie_numeric = pd.to_numeric(serie, errors='coerce')
-            # Log data types and sample values for debugging
-            logger.info(f"Original series dtype: {serie.dtype}, sample values: {serie.head().tolist()}")
-            logger.info(f"Converted series dtype: {serie_numeric.dtype}, sample values: {serie_numeric.head().tolist()}")
-            # Count non-null values
-            logger.info(f"Non-null values after conversion: {serie_numeric.notna().sum()} out of {len(serie_numeric)}")
-            serie = serie_numeric
-
-        # 1) Valor simple -> igualdad
-        if isinstance(cond, (str, int, float, bool)):
-            logger.info(f"Applying simple equality filter: {col} == {cond}")
-            df = df[serie == cond]
-
-        # 2) Lista -> IN
-        elif isinstance(cond, list):
-            logger.info(f"Applying list filter: {col} IN {cond}")
-            df = df[serie.isin(cond)]
-
-        # 3) Dict de operadores
-        elif isinstance(cond, dict):
-            logger.info(f"Applying dict filter for {col}: {cond}")
-            if "eq" in cond:
-                logger.info(f"  - Equality: {col} == {cond['eq']}")
-                df = df[serie == cond["eq"]]
-            if "neq" in cond:
-                logger.info(f"  - Not equal: {col} != {cond['neq']}")
-                df = df[serie != cond["neq"]]
-            if "gte" in cond:
-                logger.info(f"  - Greater than or equal: {col} >= {cond['gte']}")
-                # For year comparisons, ensure we have valid numeric values
-                if 'ano' in col.lower() or 'year' in col.lower():
-                    logger.info(f"  - Applying numeric filter, excluding NaN values")
-                    df = df[serie >= cond["gte"]]
-                else:
-                    df = df[serie >= cond["gte"]]
-            if "lte" in cond:
-                logger.info(f"  - Less than or equal: {col} <= {cond['lte']}")
-                # For year comparisons, ensure we have valid numeric values  
-                if 'ano' in col.lower() or 'year' in col.lower():
-                    logger.info(f"  - Applying numeric filter, excluding NaN values")
-                    df = df[serie <= cond["lte"]]
-                else:
-                    df = df[serie <= cond["lte"]]
-            if "gt" in cond:
-                logger.info(f"  - Greater than: {col} > {cond['gt']}")
-                df = df[serie > cond["gt"]]
-            if "lt" in cond:
-                logger.info(f"  - Less than: {col} < {cond['lt']}")
-                df = df[serie < cond["lt"]]
-            if "in" in cond:
-                logger.info(f"  - In list: {col} IN {cond['in']}")
-                df = df[serie.isin(cond["in"])]
-        
-        logger.info(f"After applying filter for {col}, dataframe has {len(df)} rows")
+    mask = compile_filter_mask(_frame_index(df), poblacion)
+    df = df[mask]
 
     logger.info(f"Final filtered dataframe has {len(df)} rows")
     return df
 
 
-def _compute_nps(series: pd.Series) -> float:
+def _compute_nps(series: pd.Series, pesos: pd.Series | None = None) -> float:
     """
     Calcula NPS asumiendo escala 1–10 o 0–10.
 
@@ -131,12 +199,18 @@ def _compute_nps(series: pd.Series) -> float:
       - Neutros: 7–8
       - Promotores: 9–10
 
+    Con `pesos` (alineados por índice) cada respuesta cuenta con su peso.
     Devuelve NPS en porcentaje (ej. 47.0).
     """
     s = pd.to_numeric(series, errors="coerce").dropna()
     if s.empty:
         return 0.0
 
+    if pesos is not None:
+        w = pesos.loc[s.index].to_numpy(dtype=float)
+        total = w.sum()
+        return float((w[(s >= 9).to_numpy()].sum() - w[(s <= 6).to_numpy()].sum()) * 100.0 / total) if total else 0.0
+
     detractores = (s <= 6).sum()
     promotores = (s >= 9).sum()
     total = len(s)
@@ -144,7 +218,9 @@ def _compute_nps(series: pd.Series) -> float:
 
 
 def generate_general_summary(poblacion: Dict[str, Any],
-                             distribuciones: List[str]) -> Dict[str, Any]:
+                             distribuciones: List[str],
+                             df: pd.DataFrame | None = None,
+                             opciones: Dict[str, Any] | None = None) -> Dict[str, Any]:
     """
     Genera un resumen general de la población filtrada leyendo directamente
     de la base del ETL (schema core).
@@ -157,6 +233,14 @@ def generate_general_summary(poblacion: Dict[str, Any],
     `distribuciones` es una lista de nombres de columnas para las que se
     quiere la distribución (conteos por valor).
 
+    `df` permite pasar la población ya cargada y filtrada (modo batch); si
+    es None se carga y filtra aquí.
+
+    Con `opciones["intervalos"]` se agregan intervalos de confianza bootstrap
+    para satisfaccion_media y nps (ver analytics.bootstrap). Con
+    `opciones["ponderacion"]` los KPIs, sus intervalos y las tablas usan pesos de raking
+    (ver analytics.weighting).
+
     Devuelve un dict con:
     {
         "kpis": { ... },
@@ -169,21 +253,26 @@ def generate_general_summary(poblacion: Dict[str, Any],
         raise ValueError("La población no contiene el campo 'dataset'.")
 
     # 1) Cargar datos desde core.<dataset_name> y aplicar filtros
-    df = _load_core_dataset(dataset_name)
-    logger.info(f"Loaded dataset {dataset_name} with {len(df)} rows and columns: {list(df.columns)}")
-    
-    df = _apply_filters(df, poblacion)
-    logger.info(f"After filtering: {len(df)} rows remaining")
+    if df is None:
+        df = _load_core_dataset(dataset_name, poblacion=poblacion)
+        logger.info(f"Loaded dataset {dataset_name} with {len(df)} rows and columns: {list(df.columns)}")
+        
+        df = _apply_filters(df, poblacion)
+        logger.info(f"After filtering: {len(df)} rows remaining")
 
     # Actualizamos n en la población si no viene; esto se devuelve al cliente
     n = len(df)
     if "n" not in poblacion:
         poblacion["n"] = n
 
+    pesos, ponderacion = population_weights(df, poblacion, opciones)
+
     # 2) KPIs básicos
     kpis: Dict[str, Any] = {
         "total_registros": n
     }
+    if ponderacion:
+        kpis["ponderacion"] = ponderacion
 
     # Pregunta de satisfacción "estrella" si existe
     sat_col = "ep07_18_en_general_cual_es_su_grado_de_satisfaccion_en_relacion"
@@ -201,12 +290,28 @@ def generate_general_summary(poblacion: Dict[str, Any],
         }
         sat_vals = sat_series.map(satisfaction_mapping)
         if sat_vals.notna().any():
-            kpis["satisfaccion_media"] = float(sat_vals.mean(skipna=True))
-            # Para NPS con escala 1-5, ajustar criterios: 1-2=detractores, 3=neutros, 4-5=promotores
-            detractores = (sat_vals <= 2).sum()
-            promotores = (sat_vals >= 4).sum()
-            total = sat_vals.notna().sum()
-            kpis["nps"] = float((promotores - detractores) * 100.0 / total) if total else 0.0
+            kpis["satisfaccion_media"] = weighted_mean(
+                sat_vals, None if pesos is None else pesos.loc[sat_vals.index])
+            if pesos is None:
+                # Para NPS con escala 1-5, ajustar criterios: 1-2=detractores, 3=neutros, 4-5=promotores
+                detractores = (sat_vals <= 2).sum()
+                promotores = (sat_vals >= 4).sum()
+                total = sat_vals.notna().sum()
+                kpis["nps"] = float((promotores - detractores) * 100.0 / total) if total else 0.0
+            else:
+                validos = sat_vals.dropna()
+                w = pesos.loc[validos.index].to_numpy(dtype=float)
+                detractores = w[(validos <= 2).to_numpy()].sum()
+                promotores = w[(validos >= 4).to_numpy()].sum()
+                kpis["nps"] = float((promotores - detractores) * 100.0 / w.sum())
+
+            ic = interval_options(opciones)
+            if ic:
+                valores = sat_vals.to_numpy(dtype=float, na_value=np.nan)
+                # con ponderación el IC remuestrea con los mismos pesos que la media
+                w = None if pesos is None else pesos.loc[sat_vals.index].to_numpy(dtype=float)
+                kpis["satisfaccion_media_ic"] = bootstrap_mean_ci(valores, pesos=w, **ic)
+                kpis["nps_ic"] = bootstrap_mean_ci(nps_scores(valores, 2, 4), pesos=w, **ic)
     else:
         logger.info(f"Satisfaction column {sat_col} not found in columns: {list(df.columns)}")
 
@@ -217,38 +322,44 @@ def generate_general_summary(poblacion: Dict[str, Any],
     posgrado_col = "ig01_1_el_posgrado_que_usted_curso_es"
     if posgrado_col in df.columns:
         logger.info(f"Found posgrado column {posgrado_col}")
-        vc = df[posgrado_col].value_counts(dropna=False)
-        total_posgrados = vc.sum()
-        filas_posgrados = []
-        for nombre, conteo in vc.items():
-            if pd.isna(nombre):
-                nombre = "Sin especificar"
-            porcentaje = (conteo * 100.0 / total_posgrados) if total_posgrados else 0.0
-            filas_posgrados.append({
-                "posgrado": str(nombre),
-                "total": int(conteo),
-                "porcentaje": round(porcentaje, 1),
-            })
-        tablas["posgrados"] = filas_posgrados
+        if pesos is not None:
+            tablas["posgrados"] = weighted_composition(df[posgrado_col], "posgrado", "Sin especificar", pesos)
+        else:
+            vc = df[posgrado_col].value_counts(dropna=False)
+            total_posgrados = vc.sum()
+            filas_posgrados = []
+            for nombre, conteo in vc.items():
+                if pd.isna(nombre):
+                    nombre = "Sin especificar"
+                porcentaje = (conteo * 100.0 / total_posgrados) if total_posgrados else 0.0
+                filas_posgrados.append({
+                    "posgrado": str(nombre),
+                    "total": int(conteo),
+                    "porcentaje": round(porcentaje, 1),
+                })
+            tablas["posgrados"] = filas_posgrados
     else:
         logger.info("Posgrado column not found")
 
     # Tabla de programa (si existe la columna programa)
     if "programa" in df.columns:
         logger.info("Found programa column")
-        vc = df["programa"].value_counts(dropna=False)
-        total_programas = vc.sum()
-        filas_programas = []
-        for nombre, conteo in vc.items():
-            if pd.isna(nombre):
-                nombre = "Sin especificar"
-            porcentaje = (conteo * 100.0 / total_programas) if total_programas else 0.0
-            filas_programas.append({
-                "programa": str(nombre),
-                "total": int(conteo),
-                "porcentaje": round(porcentaje, 1),
-            })
-        tablas["programas"] = filas_programas
+        if pesos is not None:
+            tablas["programas"] = weighted_composition(df["programa"], "programa", "Sin especificar", pesos)
+        else:
+            vc = df["programa"].value_counts(dropna=False)
+            total_programas = vc.sum()
+            filas_programas = []
+            for nombre, conteo in vc.items():
+                if pd.isna(nombre):
+                    nombre = "Sin especificar"
+                porcentaje = (conteo * 100.0 / total_programas) if total_programas else 0.0
+                filas_programas.append({
+                    "programa": str(nombre),
+                    "total": int(conteo),
+                    "porcentaje": round(porcentaje, 1),
+                })
+            tablas["programas"] = filas_programas
 
     ## Aca se puede expandir mas tablas si se quiere
 
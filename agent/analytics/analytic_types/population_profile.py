@@ -3,24 +3,47 @@ from typing import Any, Dict, List
 import pandas as pd
 
 from .general_summary import _load_core_dataset, _apply_filters
+from analytics.catalog import QuestionCatalog, get_catalog
+from analytics.weighting import population_weights, weighted_composition
 
 
-def _first_existing_column(df: pd.DataFrame, candidates: List[str]) -> str | None:
-    """Devuelve el primer nombre de columna que exista en el DataFrame."""
+def _first_existing_column(
+    df: pd.DataFrame,
+    candidates: List[str],
+    catalog: QuestionCatalog | None = None,
+) -> str | None:
+    """
+    Devuelve el primer nombre de columna que exista en el DataFrame.
+    El catálogo se consulta primero; si no tiene el candidato se revisa
+    `df.columns` (el catálogo puede no cubrir todas las columnas de core).
+    """
+    if catalog is not None:
+        col = catalog.first_existing(candidates)
+        if col in df.columns:
+            return col
     for c in candidates:
         if c in df.columns:
             return c
     return None
 
 
-def _find_column_by_keywords(df: pd.DataFrame, keywords: List[str]) -> str | None:
+def _find_column_by_keywords(
+    df: pd.DataFrame,
+    keywords: List[str],
+    catalog: QuestionCatalog | None = None,
+) -> str | None:
     """
-    Busca una columna cuyo nombre contenga *todas* las palabras clave.
+    Busca una columna cuyo nombre contenga *todas* las palabras clave,
+    usando el índice invertido del catálogo de preguntas y, si no la
+    encuentra ahí, recorriendo `df.columns`.
     Ej.: keywords=["edad"] -> matchea "ig03_5_edad".
     """
-    cols = [c for c in df.columns]
-    for col in cols:
-        name = col.lower()
+    if catalog is not None:
+        col = catalog.find_by_keywords(keywords)
+        if col in df.columns:
+            return col
+    for col in df.columns:
+        name = str(col).lower()
         if all(kw.lower() in name for kw in keywords):
             return col
     return None
@@ -31,13 +54,18 @@ def _build_composition_table(
     column: str,
     label_key: str,
     top_n: int | None = None,
+    pesos: pd.Series | None = None,
 ) -> List[Dict[str, Any]]:
     """
     Construye una tabla de composición para una columna categórica.
 
     Devuelve una lista de filas con:
       { <label_key>: valor, "total": n, "porcentaje": % }
+    Con `pesos` el porcentaje es ponderado y se agrega "total_ponderado".
     """
+    if pesos is not None:
+        return weighted_composition(df[column], label_key, "Sin dato", pesos, top_n)
+
     vc = df[column].value_counts(dropna=False)
     if top_n is not None:
         vc = vc.head(top_n)
@@ -62,6 +90,8 @@ def _build_composition_table(
 def generate_population_profile(
     poblacion: Dict[str, Any],
     distribuciones: List[str],
+    df: pd.DataFrame | None = None,
+    opciones: Dict[str, Any] | None = None,
 ) -> Dict[str, Any]:
     """
     Analítica de perfil de población.
@@ -70,6 +100,9 @@ def generate_population_profile(
     demográficas / de contexto del ETL (las que en tu tabla tienen
     nombres tipo 'ig03_5_edad', 'ig01_3_sexo', 'ig02_2_ano_de_graduacion', etc.).
 
+    Con opciones["ponderacion"] las tablas de composición y los porcentajes
+    por sexo usan pesos de raking (analytics.weighting).
+
     Devuelve:
       {
         "kpis": { ... },
@@ -82,8 +115,10 @@ def generate_population_profile(
         raise ValueError("La población no contiene el campo 'dataset'.")
 
     # 1) Cargar datos desde la BD del ETL (schema core) y aplicar filtros
-    df = _load_core_dataset(dataset_name)
-    df = _apply_filters(df, poblacion)
+    #    (salvo que venga la población ya filtrada, p.ej. en modo batch)
+    if df is None:
+        df = _load_core_dataset(dataset_name, poblacion=poblacion)
+        df = _apply_filters(df, poblacion)
 
     n = len(df)
     if "n" not in poblacion:
@@ -93,42 +128,49 @@ def generate_population_profile(
         "total_registros": n,
     }
 
+    # Pesos de raking si el request pide ponderación (opciones["ponderacion"])
+    pesos, ponderacion = population_weights(df, poblacion, opciones)
+    if ponderacion:
+        kpis["ponderacion"] = ponderacion
+
     tablas: Dict[str, Any] = {}
 
     # 2) Detectar columnas relevantes usando candidatos + palabras clave
+    #    (resueltas contra el catálogo de preguntas generado por el ETL)
+    catalog = get_catalog(dataset_name, fallback_columns=df.columns)
 
     # Edad: buscar la columna específica de edad
-    edad_col = _first_existing_column(df, ["ipg03_5_edad"])
+    edad_col = _first_existing_column(df, ["ipg03_5_edad"], catalog)
     if not edad_col:
-        edad_col = _find_column_by_keywords(df, ["edad"])
+        edad_col = _find_column_by_keywords(df, ["edad"], catalog)
 
     # Sexo / género: buscar la columna específica de sexo
-    sexo_col = _first_existing_column(df, ["ipg01_3_sexo"])
+    sexo_col = _first_existing_column(df, ["ipg01_3_sexo"], catalog)
     if not sexo_col:
-        sexo_col = _find_column_by_keywords(df, ["sexo"])
+        sexo_col = _find_column_by_keywords(df, ["sexo"], catalog)
 
     # Programa / posgrado: primero 'programa' (columna creada por ETL),
     # y si no, la pregunta de "posgrado que usted cursó"
-    programa_col = _first_existing_column(df, ["programa"])
-    posgrado_col = _first_existing_column(df, ["ig01_1_el_posgrado_que_usted_curso_es"])
+    programa_col = _first_existing_column(df, ["programa"], catalog)
+    posgrado_col = _first_existing_column(df, ["ig01_1_el_posgrado_que_usted_curso_es"], catalog)
     if not programa_col and not posgrado_col:
-        posgrado_col = _find_column_by_keywords(df, ["posgrado", "curso"])
+        posgrado_col = _find_column_by_keywords(df, ["posgrado", "curso"], catalog)
 
     # Año de graduación: buscar la columna específica
-    anio_col = _first_existing_column(df, ["ig02_2_ano_de_graduacion"])
+    anio_col = _first_existing_column(df, ["ig02_2_ano_de_graduacion"], catalog)
     if not anio_col:
-        anio_col = _find_column_by_keywords(df, ["ano_de_graduacion", "año_de_graduacion"])
+        anio_col = _find_column_by_keywords(df, ["ano_de_graduacion", "año_de_graduacion"], catalog)
 
     # Provincia de residencia: buscar la columna específica
-    provincia_col = _first_existing_column(df, ["ipg04_6_provincia_de_residencia_actual"])
+    provincia_col = _first_existing_column(df, ["ipg04_6_provincia_de_residencia_actual"], catalog)
     if not provincia_col:
-        provincia_col = _find_column_by_keywords(df, ["provincia"])
+        provincia_col = _find_column_by_keywords(df, ["provincia"], catalog)
 
     # Estado civil: buscar la columna específica
-    estado_civil_col = _first_existing_column(df, ["ipg02_4_estado_civil"])
+    estado_civil_col = _first_existing_column(df, ["ipg02_4_estado_civil"], catalog)
 
     # Condición laboral: buscar la columna específica  
-    condicion_laboral_col = _first_existing_column(df, ["ipg05_7_cual_es_su_condicion_laboral_actual"])
+    condicion_laboral_col = _first_existing_column(df, ["ipg05_7_cual_es_su_condicion_laboral_actual"], catalog)
 
     # 3) KPIs de edad (datos categóricos)
     if edad_col and edad_col in df.columns:
@@ -147,7 +189,10 @@ def generate_population_profile(
         serie_sexo = df[sexo_col].dropna()
         n_sexo_validos = len(serie_sexo)
         if n_sexo_validos > 0:
-            vc_sexo = serie_sexo.value_counts()
+            if pesos is not None:
+                vc_sexo = pesos.loc[serie_sexo.index].groupby(serie_sexo).sum()
+            else:
+                vc_sexo = serie_sexo.value_counts()
             # Calcular porcentajes por género
             hombres = vc_sexo.get("Hombre", 0)
             mujeres = vc_sexo.get("Mujer", 0)
@@ -162,49 +207,49 @@ def generate_population_profile(
     # Programas (si existe la columna programa)
     if programa_col and programa_col in df.columns:
         tablas["programas"] = _build_composition_table(
-            df, programa_col, "programa"
+            df, programa_col, "programa", pesos=pesos
         )
 
     # Posgrados (tipos específicos de posgrado)
     if posgrado_col and posgrado_col in df.columns:
         tablas["posgrados"] = _build_composition_table(
-            df, posgrado_col, "posgrado"
+            df, posgrado_col, "posgrado", pesos=pesos
         )
 
     # Año de graduación
     if anio_col and anio_col in df.columns:
         tablas["anio_graduacion"] = _build_composition_table(
-            df, anio_col, "anio"
+            df, anio_col, "anio", pesos=pesos
         )
 
     # Sexo
     if sexo_col and sexo_col in df.columns:
         tablas["sexo"] = _build_composition_table(
-            df, sexo_col, "sexo"
+            df, sexo_col, "sexo", pesos=pesos
         )
 
     # Edad (categórica)
     if edad_col and edad_col in df.columns:
         tablas["edad"] = _build_composition_table(
-            df, edad_col, "grupo_edad"
+            df, edad_col, "grupo_edad", pesos=pesos
         )
 
     # Provincia
     if provincia_col and provincia_col in df.columns:
         tablas["provincia"] = _build_composition_table(
-            df, provincia_col, "provincia"
+            df, provincia_col, "provincia", pesos=pesos
         )
 
     # Estado civil
     if estado_civil_col and estado_civil_col in df.columns:
         tablas["estado_civil"] = _build_composition_table(
-            df, estado_civil_col, "estado_civil"
+            df, estado_civil_col, "estado_civil", pesos=pesos
         )
 
     # Condición laboral
     if condicion_laboral_col and condicion_laboral_col in df.columns:
         tablas["condicion_laboral"] = _build_composition_table(
-            df, condicion_laboral_col, "condicion_laboral"
+            df, condicion_laboral_col, "condicion_laboral", pesos=pesos
         )
 
     # 6) Distribuciones
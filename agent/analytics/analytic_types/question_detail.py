@@ -1,12 +1,37 @@
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Tuple
+import os
 
+import numpy as np
 import pandas as pd
 
+from analytics.bootstrap import bootstrap_mean_ci, interval_options, nps_scores
+from analytics.weighting import population_weights
 from .general_summary import _load_core_dataset, _apply_filters, _compute_nps
 
+# A partir de cuántas variables se usa el modo batería (matriz NumPy única)
+BATTERY_MIN_VARIABLES = int(os.getenv("QUESTION_BATTERY_MIN_VARIABLES", "8"))
+
+# Amplitud máxima (max - min) para tratar una escala entera como Likert
+LIKERT_MAX_SPAN = 10
+
+
+def _top_2_box(valores: np.ndarray) -> float | None:
+    """
+    % de respuestas válidas en los dos puntos más altos de la escala observada.
+    Solo aplica a escalas enteras tipo Likert (amplitud <= LIKERT_MAX_SPAN).
+    """
+    if valores.size == 0 or not np.all(valores == np.floor(valores)):
+        return None
+    lo, hi = valores.min(), valores.max()
+    if hi - lo > LIKERT_MAX_SPAN:
+        return None
+    return float((valores >= hi - 1).sum() * 100.0 / valores.size)
+
 
 def generate_question_detail(poblacion: Dict[str, Any],
-                             distribuciones: List[str]) -> Dict[str, Any]:
+                             distribuciones: List[str],
+                             df: pd.DataFrame | None = None,
+                             opciones: Dict[str, Any] | None = None) -> Dict[str, Any]:
     """
     Analítica de detalle para una o más preguntas / variables específicas.
 
@@ -15,6 +40,9 @@ def generate_question_detail(poblacion: Dict[str, Any],
     Args:
         poblacion (dict): Con campos 'dataset', 'programa', 'filtros', etc.
         distribuciones (list): Lista de nombres de columnas a analizar.
+        df (DataFrame, opcional): Población ya cargada y filtrada (modo batch).
+        opciones (dict, opcional): "intervalos" agrega IC bootstrap de media y NPS;
+            "ponderacion" calcula media, NPS y sus IC con pesos de raking.
 
     Returns:
         dict: Con análisis detallado de cada variable especificada.
@@ -34,13 +62,23 @@ def generate_question_detail(poblacion: Dict[str, Any],
         raise ValueError("La población no contiene el campo 'dataset'.")
 
     # 1) Cargar y filtrar datos desde la BD del ETL
-    df = _load_core_dataset(dataset_name)
-    df = _apply_filters(df, poblacion)
+    if df is None:
+        df = _load_core_dataset(dataset_name, poblacion=poblacion)
+        df = _apply_filters(df, poblacion)
 
     n_total = len(df)
     if "n" not in poblacion:
         poblacion["n"] = n_total
 
+    pesos, ponderacion = population_weights(df, poblacion, opciones)
+
+    presentes = [v for v in dict.fromkeys(distribuciones) if v in df.columns]
+    if len(presentes) >= BATTERY_MIN_VARIABLES:
+        all_kpis, all_tablas, distribuciones_resultado = _likert_battery(df, presentes, opciones, pesos)
+        return _detail_result(all_kpis, all_tablas, distribuciones_resultado, ponderacion)
+
+    ic = interval_options(opciones)
+
     # Process each variable in distribuciones
     all_kpis: Dict[str, Any] = {}
     all_tablas: Dict[str, Any] = {}
@@ -79,7 +117,10 @@ def generate_question_detail(poblacion: Dict[str, Any],
         if es_numerica and n_validos > 0:
             s = serie_valida.astype(float)
 
-            kpis["media"] = float(s.mean())
+            kpis["media"] = (
+                float(s.mean()) if pesos is None
+                else float(np.average(s.to_numpy(), weights=pesos.loc[s.index].to_numpy(dtype=float)))
+            )
             kpis["mediana"] = float(s.median())
             kpis["desviacion_estandar"] = float(s.std())
             kpis["min"] = float(s.min())
@@ -94,10 +135,18 @@ def generate_question_detail(poblacion: Dict[str, Any],
             ]
             all_tablas[f"{variable}_cuartiles"] = cuartiles
 
+            top2 = _top_2_box(s.to_numpy())
+            if top2 is not None:
+                kpis["top_2_box"] = top2
+
             # NPS solo si parece escala 0–10 o 1–10
             min_val, max_val = s.min(), s.max()
             if 0 <= min_val <= 1 and max_val <= 10:
-                kpis["nps"] = float(_compute_nps(s))
+                kpis["nps"] = float(_compute_nps(s, pesos))
+
+            if ic:
+                _add_intervals(kpis, s.to_numpy(), ic,
+                               None if pesos is None else pesos.loc[s.index].to_numpy(dtype=float))
 
         else:
             # Tratamos la variable como categórica
@@ -132,8 +181,151 @@ def generate_question_detail(poblacion: Dict[str, Any],
 
         distribuciones_resultado[variable] = dist
 
-    return {
-        "kpis": all_kpis,
-        "tablas": all_tablas,
-        "distribuciones": distribuciones_resultado,
-    }
+    return _detail_result(all_kpis, all_tablas, distribuciones_resultado, ponderacion)
+
+
+def _detail_result(kpis: Dict[str, Any], tablas: Dict[str, Any], distribuciones: Dict[str, Any],
+                   ponderacion: Dict[str, Any] | None) -> Dict[str, Any]:
+    resultado = {"kpis": kpis, "tablas": tablas, "distribuciones": distribuciones}
+    if ponderacion:
+        # diagnóstico del raking (no es una variable, va fuera de "kpis")
+        resultado["ponderacion"] = ponderacion
+    return resultado
+
+
+def _add_intervals(kpis: Dict[str, Any], valores: np.ndarray, ic: Dict[str, Any],
+                   pesos: np.ndarray | None = None) -> None:
+    """
+    IC bootstrap de la media (y del NPS si la variable lo tiene) sobre los
+    valores válidos; con `pesos` (alineados con `valores`) los IC son
+    ponderados, como la media y el NPS de los KPIs.
+    """
+    kpis["media_ic"] = bootstrap_mean_ci(valores, pesos=pesos, **ic)
+    if "nps" in kpis:
+        kpis["nps_ic"] = bootstrap_mean_ci(nps_scores(valores, 6, 9), pesos=pesos, **ic)
+
+
+def _likert_battery(df: pd.DataFrame, variables: List[str],
+                    opciones: Dict[str, Any] | None = None,
+                    pesos: pd.Series | None = None,
+                    ) -> Tuple[Dict[str, Any], Dict[str, Any], Dict[str, Any]]:
+    """
+    Modo batería: mismas salidas que el recorrido por variable, pero calculadas
+    sobre matrices para todas las columnas a la vez.
+
+      - categorías: códigos enteros (pd.factorize por columna) desplazados a un
+        rango común y contados con un único np.bincount
+      - valores numéricos: matriz float (n x k, NaN = no válido) en orden
+        Fortran, armada desde los códigos; las reducciones son por columna
+    """
+    n_total = len(df)
+    k = len(variables)
+    ic = interval_options(opciones)
+
+    # 1) Códigos enteros de los valores originales; to_numeric solo sobre los
+    #    valores distintos y la matriz numérica se arma indexando por código
+    codigos = np.empty((n_total, k), dtype=np.int64, order="F")
+    M = np.empty((n_total, k), dtype=float, order="F")
+    uniques = []
+    offsets = np.zeros(k + 1, dtype=np.int64)
+    for j, v in enumerate(variables):
+        c, u = pd.factorize(df[v], use_na_sentinel=False)
+        numericos = np.asarray(pd.to_numeric(u, errors="coerce"), dtype=float)
+        M[:, j] = numericos[c]
+        codigos[:, j] = c + offsets[j]
+        uniques.append(u)
+        offsets[j + 1] = offsets[j] + len(u)
+    conteos = np.bincount(codigos.ravel(order="F"), minlength=int(offsets[-1]))
+
+    # 2) Estadísticos de todas las columnas numéricas a la vez
+    valid = ~np.isnan(M)
+    n_validos_num = valid.sum(axis=0)
+    es_num = n_validos_num > 0
+    Mn = M[:, es_num]
+    vn = valid[:, es_num]
+    cnt = n_validos_num[es_num]
+
+    medias = np.where(vn, Mn, 0.0).sum(axis=0) / cnt
+    if pesos is not None:
+        # pesos por fila como matriz n x k (0 donde no hay respuesta válida)
+        W = np.where(vn, pesos.to_numpy(dtype=float)[:, None], 0.0)
+        w_tot = W.sum(axis=0)
+        medias_pond = (W * np.where(vn, Mn, 0.0)).sum(axis=0) / w_tot
+        nps_pond = (np.where(Mn >= 9, W, 0.0).sum(axis=0) - np.where(Mn <= 6, W, 0.0).sum(axis=0)) * 100.0 / w_tot
+    desv = np.where(vn, Mn - medias, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        std = np.sqrt((desv * desv).sum(axis=0) / (cnt - 1))
+    std[cnt < 2] = np.nan
+    cuartiles = np.nanquantile(Mn, [0.25, 0.5, 0.75], axis=0) if Mn.size else np.empty((3, 0))
+    medianas = np.nanmedian(Mn, axis=0) if Mn.size else np.empty(0)
+    mins = np.where(vn, Mn, np.inf).min(axis=0)
+    maxs = np.where(vn, Mn, -np.inf).max(axis=0)
+    enteras = (np.where(vn, Mn - np.floor(Mn), 0.0) == 0).all(axis=0)
+    top2 = (Mn >= (maxs - 1)).sum(axis=0) * 100.0 / cnt
+    es_likert = enteras & (maxs - mins <= LIKERT_MAX_SPAN)
+    es_nps = (mins >= 0) & (mins <= 1) & (maxs <= 10)
+    nps = ((Mn >= 9).sum(axis=0) - (Mn <= 6).sum(axis=0)) * 100.0 / cnt
+
+    # 3) Armado de la salida en el orden de las variables
+    all_kpis: Dict[str, Any] = {}
+    all_tablas: Dict[str, Any] = {}
+    distribuciones_resultado: Dict[str, Any] = {}
+    idx_num = np.cumsum(es_num) - 1
+
+    for j, variable in enumerate(variables):
+        cuenta = conteos[offsets[j]:offsets[j + 1]]
+        valores = uniques[j]
+        es_nulo = pd.isna(valores)
+
+        if es_num[j]:
+            n_validos = int(n_validos_num[j])
+        else:
+            n_validos = int(cuenta[~es_nulo].sum())
+
+        kpis: Dict[str, Any] = {
+            "variable": variable,
+            "n_total_poblacion": n_total,
+            "n_respuestas_validas": n_validos,
+            "porcentaje_respuesta": float(n_validos * 100.0 / n_total) if n_total else 0.0,
+            "es_numerica": bool(es_num[j]),
+        }
+
+        if es_num[j]:
+            i = idx_num[j]
+            kpis["media"] = float(medias[i] if pesos is None else medias_pond[i])
+            kpis["mediana"] = float(medianas[i])
+            kpis["desviacion_estandar"] = float(std[i])
+            kpis["min"] = float(mins[i])
+            kpis["max"] = float(maxs[i])
+            all_tablas[f"{variable}_cuartiles"] = [
+                {"percentil": p, "valor": float(cuartiles[q, i])}
+                for q, p in enumerate((25, 50, 75))
+            ]
+            if es_likert[i]:
+                kpis["top_2_box"] = float(top2[i])
+            if es_nps[i]:
+                kpis["nps"] = float(nps[i] if pesos is None else nps_pond[i])
+            if ic:
+                _add_intervals(kpis, Mn[vn[:, i], i], ic,
+                               None if pesos is None else pesos.to_numpy(dtype=float)[vn[:, i]])
+        else:
+            # value_counts(): conteo desc, empates en orden de aparición
+            orden = np.argsort(-cuenta, kind="stable")[:10]
+            total_resp = cuenta[orden].sum()
+            all_tablas[f"{variable}_top_categorias"] = [
+                {
+                    "categoria": "Sin respuesta" if es_nulo[o] else str(valores[o]),
+                    "total": int(cuenta[o]),
+                    "porcentaje": round(float(cuenta[o] * 100.0 / total_resp) if total_resp else 0.0, 1),
+                }
+                for o in orden
+            ]
+
+        all_kpis[variable] = kpis
+
+        dist = pd.Series(cuenta, index=pd.Index(valores)).sort_index()
+        claves = ["NA" if nulo else str(valor)
+                  for valor, nulo in zip(dist.index.tolist(), dist.index.isna())]
+        distribuciones_resultado[variable] = dict(zip(claves, dist.to_numpy().tolist()))
+
+    return all_kpis, all_tablas, distribuciones_resultado
@@ -0,0 +1,83 @@
+from typing import Any, Dict, List
+import logging
+
+import pandas as pd
+
+from .general_summary import _load_core_dataset, _apply_filters
+from .comparison import group_aggregates, grouped_result, _natural_key as _version_key
+
+logger = logging.getLogger(__name__)
+
+
+def _without_version_filter(poblacion: Dict[str, Any]) -> Dict[str, Any]:
+    """Población sin restricción de versión: la tendencia las recorre todas."""
+    filtros = {k: v for k, v in (poblacion.get("filtros") or {}).items() if k != "version"}
+    return {**{k: v for k, v in poblacion.items() if k != "version"}, "filtros": filtros}
+
+
+def generate_trend(poblacion: Dict[str, Any],
+                   distribuciones: List[str],
+                   df: pd.DataFrame | None = None) -> Dict[str, Any]:
+    """
+    Tendencia entre versiones (cargas) del dataset.
+
+    Calcula para cada versión, en una sola agregación agrupada por 'version':
+      - n, satisfaccion_media y nps (pregunta de satisfacción general)
+      - la media de cada variable numérica en 'distribuciones'
+    y las distribuciones de 'distribuciones' por versión con un único groupby
+    sobre (variable, version, valor).
+
+    Los filtros de la población se aplican salvo el de 'version'. Si se pasa
+    `df` (modo batch) se usa tal cual.
+
+    Devuelve:
+    {
+        "kpis": { "versiones": [...], "version_actual", "version_anterior", "variacion_..." },
+        "tablas": { "tendencia": [ {version, n, satisfaccion_media, nps, media_<var>...}, ... ] },
+        "distribuciones": { variable: { version: { valor: conteo } } }
+    }
+    """
+    dataset_name = poblacion.get("dataset")
+    if not dataset_name:
+        raise ValueError("La población no contiene el campo 'dataset'.")
+
+    if df is None:
+        base = _without_version_filter(poblacion)
+        df = _load_core_dataset(dataset_name, poblacion=base)
+        df = _apply_filters(df, base)
+
+    if "version" not in df.columns:
+        raise ValueError(f"El dataset '{dataset_name}' no tiene columna 'version'.")
+
+    if "n" not in poblacion:
+        poblacion["n"] = len(df)
+
+    variables = [v for v in dict.fromkeys(distribuciones) if v in df.columns and v != "version"]
+
+    # Una sola agregación por versión para las medidas y un solo groupby para las distribuciones
+    por_version, numericas, conteos = group_aggregates(df, df["version"].astype(str), variables)
+    orden = sorted(por_version.index, key=_version_key)
+    filas, distribuciones_resultado = grouped_result(por_version, numericas, conteos, variables, orden)
+    serie = [{"version": f.pop("grupo"), **f} for f in filas]
+
+    return {
+        "kpis": trend_kpis(orden, serie, numericas),
+        "tablas": {"tendencia": serie},
+        "distribuciones": distribuciones_resultado,
+    }
+
+
+def trend_kpis(orden: List[str], serie: List[Dict[str, Any]], numericas: List[str]) -> Dict[str, Any]:
+    """KPIs de la tendencia: última versión contra la anterior."""
+    kpis: Dict[str, Any] = {
+        "versiones": orden,
+        "n_versiones": len(orden),
+        "version_actual": orden[-1] if orden else None,
+        "version_anterior": orden[-2] if len(orden) > 1 else None,
+    }
+    if len(serie) > 1:
+        actual, anterior = serie[-1], serie[-2]
+        for clave in ["n", "satisfaccion_media", "nps", *[f"media_{v}" for v in numericas]]:
+            if actual.get(clave) is not None and anterior.get(clave) is not None:
+                kpis[f"variacion_{clave}"] = float(actual[clave] - anterior[clave])
+    return kpis
@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List
+import fcntl
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Cache de slices (dataset, programa, version) en Arrow IPC compartido entre
+# procesos (workers de uvicorn y del pool de analíticas) vía mmap
+ARROW_CACHE = os.getenv("ARROW_CACHE", "false").lower() == "true"
+ARROW_CACHE_DIR = Path(os.getenv("ARROW_CACHE_DIR", "/dev/shm/paaa-arrow"))
+
+_SCHEMA_FILE = "_schema.arrow"
+_MANIFEST_FILE = "_manifest.json"
+
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.ipc as ipc
+    except Exception as e:
+        raise RuntimeError("Para el cache Arrow necesitas instalar 'pyarrow' en Poetry") from e
+    return pa, ipc
+
+
+def _generation_dir(dataset: str, watermark: int) -> Path:
+    """Una generación por marca de agua: una carga nueva nunca pisa archivos mapeados."""
+    return ARROW_CACHE_DIR / dataset / f"wm={watermark}"
+
+
+@contextmanager
+def _dataset_lock(dataset: str):
+    """Lock de archivo por dataset: un solo proceso materializa o purga a la vez."""
+    path = ARROW_CACHE_DIR / dataset / ".lock"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _read_manifest(gen: Path) -> Dict[str, Any] | None:
+    try:
+        return json.loads((gen / _MANIFEST_FILE).read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def _write_ipc(tabla, path: Path) -> None:
+    _, ipc = _pyarrow()
+    with ipc.new_file(str(path), tabla.schema) as writer:
+        writer.write_table(tabla)
+
+
+def _key(valor: Any) -> str | None:
+    return None if pd.isna(valor) else str(valor)
+
+
+def _materialize(dataset: str, watermark: int, df: pd.DataFrame) -> Dict[str, Any]:
+    """
+    Escribe `df` como una generación de slices Arrow IPC, uno por
+    (programa, version), con los textos como large_string (se envuelven sin
+    copiar al pasar a pandas). Se escribe en un directorio temporal y se
+    publica con un rename atómico: los lectores ven la generación completa o
+    ninguna.
+    """
+    pa, _ = _pyarrow()
+    tabla = pa.Table.from_pandas(df, preserve_index=False)
+    tabla = tabla.cast(pa.schema([
+        pa.field(f.name, pa.large_string()) if pa.types.is_string(f.type) else f
+        for f in tabla.schema
+    ]))
+
+    gen = _generation_dir(dataset, watermark)
+    tmp = gen.with_name(f".{gen.name}.{os.getpid()}.tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+
+    particion = [c for c in ("programa", "version") if c in df.columns]
+    if particion:
+        grupos = df.groupby(particion, dropna=False, sort=False).indices
+    else:
+        grupos = {(): np.arange(len(df))}
+
+    slices: List[Dict[str, Any]] = []
+    for i, (clave, posiciones) in enumerate(grupos.items()):
+        clave = clave if isinstance(clave, tuple) else (clave,)
+        valores = dict(zip(particion, clave))
+        archivo = f"slice-{i:05d}.arrow"
+        _write_ipc(tabla.take(pa.array(posiciones)), tmp / archivo)
+        slices.append({
+            "programa": _key(valores.get("programa")),
+            "version": _key(valores.get("version")),
+            "archivo": archivo,
+            "filas": int(len(posiciones)),
+        })
+    _write_ipc(tabla.schema.empty_table(), tmp / _SCHEMA_FILE)
+    manifest = {"dataset": dataset, "watermark": watermark, "filas": len(df), "slices": slices}
+    (tmp / _MANIFEST_FILE).write_text(json.dumps(manifest))
+
+    try:
+        os.rename(tmp, gen)
+    except OSError:
+        # otro proceso publicó la misma generación
+        shutil.rmtree(tmp, ignore_errors=True)
+        return _read_manifest(gen) or manifest
+    logger.info(f"Cache Arrow de {dataset} (wm={watermark}): {len(slices)} slices, {len(df)} filas")
+    return manifest
+
+
+def _purge(dataset: str, keep: int | None = None) -> None:
+    """Borra las generaciones (y temporales) distintas de `keep`; los mmaps abiertos siguen válidos."""
+    base = ARROW_CACHE_DIR / dataset
+    if not base.exists():
+        return
+    for path in base.iterdir():
+        if path.is_dir() and path.name != f"wm={keep}":
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def _mmap(path: Path):
+    pa, ipc = _pyarrow()
+    return ipc.open_file(pa.memory_map(str(path), "r")).read_all()
+
+
+def _string_dtype():
+    """Texto respaldado por Arrow con nulos NaN (como los object de read_sql)."""
+    try:
+        return pd.StringDtype("pyarrow", na_value=np.nan)  # pandas >= 2.3
+    except TypeError:
+        return pd.StringDtype("pyarrow_numpy")
+
+
+def load_slices(dataset: str, watermark: int,
+                programas: Iterable[str] | None,
+                versiones: Iterable[str] | None,
+                columns: Iterable[str] | None,
+                reader: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+    """
+    Población de `dataset` desde el cache Arrow compartido.
+
+    Si la generación de `watermark` no existe, el primer proceso que llega la
+    materializa con `reader()` (dataset completo) bajo un lock de archivo;
+    los demás esperan y la reutilizan. Se mapean (mmap) solo los slices de
+    `programas`/`versiones` y se proyectan `columns`: los buffers numéricos
+    y de texto quedan en la página compartida, no en el heap de cada worker.
+    """
+    pa, _ = _pyarrow()
+    gen = _generation_dir(dataset, watermark)
+    manifest = _read_manifest(gen)
+    if manifest is None:
+        with _dataset_lock(dataset):
+            manifest = _read_manifest(gen)
+            if manifest is None:
+                manifest = _materialize(dataset, watermark, reader())
+                _purge(dataset, keep=watermark)
+
+    programas = None if programas is None else {str(p) for p in programas}
+    versiones = None if versiones is None else {str(v) for v in versiones}
+    tablas = [
+        _mmap(gen / s["archivo"])
+        for s in manifest["slices"]
+        if (programas is None or s["programa"] in programas)
+        and (versiones is None or s["version"] in versiones)
+    ]
+    tabla = pa.concat_tables(tablas) if tablas else _mmap(gen / _SCHEMA_FILE)
+    if columns is not None:
+        pedidas = set(columns)
+        tabla = tabla.select([c for c in tabla.column_names if c in pedidas])
+
+    texto = _string_dtype()
+    return tabla.to_pandas(
+        types_mapper=lambda t: texto if pa.types.is_large_string(t) else None,
+        split_blocks=True,
+    )
+
+
+def invalidate_arrow_cache(dataset: str | None = None, keep: int | None = None) -> None:
+    """
+    Tras una carga: descarta las generaciones del dataset (o de todos) salvo
+    la de `keep`, la marca de la carga nueva, que pudo materializarse ya.
+    """
+    if not ARROW_CACHE or not ARROW_CACHE_DIR.exists():
+        return
+    datasets = [dataset] if dataset else [p.name for p in ARROW_CACHE_DIR.iterdir() if p.is_dir()]
+    for ds in datasets:
+        with _dataset_lock(ds):
+            _purge(ds, keep=keep)
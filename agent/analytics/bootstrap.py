@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+from typing import Any, Dict
+import os
+import time
+
+import numpy as np
+
+BOOTSTRAP_REPLICAS = int(os.getenv("BOOTSTRAP_REPLICAS", "2000"))
+BOOTSTRAP_MAX_REPLICAS = int(os.getenv("BOOTSTRAP_MAX_REPLICAS", "20000"))
+BOOTSTRAP_BUDGET_S = float(os.getenv("BOOTSTRAP_BUDGET_S", "2"))
+BOOTSTRAP_SEED = int(os.getenv("BOOTSTRAP_SEED", "0"))
+# Tamaño máximo de la matriz de índices por bloque (replicas x n)
+BOOTSTRAP_BLOCK_ELEMS = int(os.getenv("BOOTSTRAP_BLOCK_ELEMS", "4000000"))
+# Hasta cuántos valores distintos se remuestrea con la multinomial
+BOOTSTRAP_DISCRETE_MAX = int(os.getenv("BOOTSTRAP_DISCRETE_MAX", "64"))
+
+
+def interval_options(opciones: Dict[str, Any] | None) -> Dict[str, Any] | None:
+    """
+    Lee opciones["intervalos"] del request: True o un dict con
+    replicas / nivel / semilla / presupuesto_s. None si no se pidieron.
+    ValueError si replicas < 1 o nivel fuera de (0, 1).
+    """
+    pedido = (opciones or {}).get("intervalos")
+    if not pedido:
+        return None
+    pedido = pedido if isinstance(pedido, dict) else {}
+    try:
+        ic = {
+            "replicas": min(int(pedido.get("replicas", BOOTSTRAP_REPLICAS)), BOOTSTRAP_MAX_REPLICAS),
+            "nivel": float(pedido.get("nivel", 0.95)),
+            "semilla": int(pedido.get("semilla", BOOTSTRAP_SEED)),
+            "presupuesto_s": float(pedido.get("presupuesto_s", BOOTSTRAP_BUDGET_S)),
+        }
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"opciones.intervalos inválido: {e}") from None
+    if ic["replicas"] < 1:
+        raise ValueError(f"opciones.intervalos.replicas debe ser >= 1 (recibido {ic['replicas']})")
+    if not 0 < ic["nivel"] < 1:
+        raise ValueError(f"opciones.intervalos.nivel debe estar entre 0 y 1, sin incluirlos (recibido {ic['nivel']})")
+    return ic
+
+
+def _hay_tiempo(hechas: int, t_bloque: float, deadline: float) -> bool:
+    """El primer bloque siempre corre; los demás solo si, al ritmo del anterior, terminan antes de `deadline`."""
+    return hechas == 0 or time.perf_counter() + t_bloque <= deadline
+
+
+def _resample_means_discrete(valores: np.ndarray, conteos: np.ndarray, replicas: int,
+                             rng: np.random.Generator, deadline: float,
+                             pesos: np.ndarray | None = None) -> np.ndarray:
+    """
+    Remuestreo de la media para datos con pocos valores distintos: cada réplica
+    es un vector de frecuencias ~ Multinomial(n, p), equivalente en distribución
+    a remuestrear índices pero O(replicas x k) en vez de O(replicas x n).
+    Con `pesos` (uno por par valor/peso distinto) cada réplica es la media
+    ponderada de las respuestas remuestreadas.
+    """
+    n = int(conteos.sum())
+    p = conteos / n
+    bloque = max(1, BOOTSTRAP_BLOCK_ELEMS // max(len(valores), 1))
+    medias = []
+    hechas = 0
+    t_bloque = 0.0
+    while hechas < replicas and _hay_tiempo(hechas, t_bloque, deadline):
+        t0 = time.perf_counter()
+        b = min(bloque, replicas - hechas)
+        frecuencias = rng.multinomial(n, p, size=b)
+        if pesos is None:
+            medias.append(frecuencias @ valores / n)
+        else:
+            medias.append(frecuencias @ (valores * pesos) / (frecuencias @ pesos))
+        hechas += b
+        t_bloque = time.perf_counter() - t0
+    return np.concatenate(medias)
+
+
+def _resample_means_index(valores: np.ndarray, replicas: int, rng: np.random.Generator,
+                          deadline: float, pesos: np.ndarray | None = None) -> np.ndarray:
+    """
+    Remuestreo general: bloques de una matriz de índices (replicas x n) sin
+    loop por réplica. Con `pesos` cada réplica es una media ponderada.
+    """
+    n = valores.size
+    dtype = np.int32 if n < 2 ** 31 else np.int64
+    bloque = max(1, BOOTSTRAP_BLOCK_ELEMS // n)
+    medias = []
+    hechas = 0
+    t_bloque = 0.0
+    while hechas < replicas and _hay_tiempo(hechas, t_bloque, deadline):
+        t0 = time.perf_counter()
+        b = min(bloque, replicas - hechas)
+        idx = rng.integers(0, n, size=(b, n), dtype=dtype)
+        if pesos is None:
+            medias.append(valores[idx].mean(axis=1))
+        else:
+            w = pesos[idx]
+            medias.append((valores[idx] * w).sum(axis=1) / w.sum(axis=1))
+        hechas += b
+        t_bloque = time.perf_counter() - t0
+    return np.concatenate(medias)
+
+
+def _bootstrap(distintos: np.ndarray, conteos: np.ndarray, muestra: np.ndarray | None,
+               replicas: int, nivel: float, semilla: int, presupuesto_s: float,
+               pesos_distintos: np.ndarray | None = None,
+               pesos_muestra: np.ndarray | None = None) -> Dict[str, Any] | None:
+    n = int(conteos.sum())
+    if n < 2:
+        return None
+
+    rng = np.random.default_rng(semilla)
+    inicio = time.perf_counter()
+    deadline = inicio + presupuesto_s
+    if muestra is None or len(distintos) <= BOOTSTRAP_DISCRETE_MAX:
+        metodo = "multinomial"
+        medias = _resample_means_discrete(distintos, conteos, replicas, rng, deadline, pesos_distintos)
+    else:
+        metodo = "indices"
+        medias = _resample_means_index(muestra, replicas, rng, deadline, pesos_muestra)
+
+    alfa = (1.0 - nivel) / 2.0
+    inferior, superior = np.quantile(medias, [alfa, 1.0 - alfa])
+    resultado = {
+        "inferior": float(inferior),
+        "superior": float(superior),
+        "nivel": nivel,
+        "replicas": int(medias.size),
+        "truncado": bool(medias.size < replicas),
+        "metodo": metodo,
+        "segundos": round(time.perf_counter() - inicio, 4),
+    }
+    if pesos_distintos is not None:
+        resultado["ponderado"] = True
+    return resultado
+
+
+def bootstrap_mean_ci(valores: np.ndarray, replicas: int = BOOTSTRAP_REPLICAS, nivel: float = 0.95,
+                      semilla: int = BOOTSTRAP_SEED, presupuesto_s: float = BOOTSTRAP_BUDGET_S,
+                      pesos: np.ndarray | None = None) -> Dict[str, Any] | None:
+    """
+    Intervalo de confianza bootstrap (percentil) para la media de `valores`.
+
+    Las réplicas se generan por bloques con un Generator sembrado (resultado
+    reproducible). `presupuesto_s` cubre toda la llamada: si el bloque
+    siguiente no cabe (al ritmo del anterior) se corta ahí y el intervalo se
+    calcula con las réplicas hechas ("truncado": true).
+    Con `pesos` (alineados con `valores`, p. ej. los de raking) se remuestrean
+    respuestas con su peso y cada réplica es la media ponderada, igual que
+    el estimador puntual. None si hay menos de 2 valores válidos.
+    """
+    inicio = time.perf_counter()
+    valores = np.asarray(valores, dtype=float)
+    if pesos is None:
+        valores = valores[~np.isnan(valores)]
+        distintos, conteos = np.unique(valores, return_counts=True)
+        return _bootstrap(distintos, conteos, valores, replicas, nivel, semilla,
+                          presupuesto_s - (time.perf_counter() - inicio))
+
+    pesos = np.asarray(pesos, dtype=float)
+    validos = ~np.isnan(valores) & ~np.isnan(pesos)
+    valores, pesos = valores[validos], pesos[validos]
+    # pares (valor, peso) distintos: el raking da pocos pesos distintos (uno
+    # por celda), así que la multinomial sigue aplicando casi siempre
+    pares, conteos = np.unique(np.column_stack([valores, pesos]), axis=0, return_counts=True)
+    return _bootstrap(pares[:, 0], conteos, valores, replicas, nivel, semilla,
+                      presupuesto_s - (time.perf_counter() - inicio),
+                      pesos_distintos=pares[:, 1], pesos_muestra=pesos)
+
+
+def bootstrap_mean_ci_counts(distintos: np.ndarray, conteos: np.ndarray,
+                             replicas: int = BOOTSTRAP_REPLICAS, nivel: float = 0.95,
+                             semilla: int = BOOTSTRAP_SEED,
+                             presupuesto_s: float = BOOTSTRAP_BUDGET_S) -> Dict[str, Any] | None:
+    """Igual que bootstrap_mean_ci a partir de (valor distinto, frecuencia); siempre multinomial."""
+    return _bootstrap(np.asarray(distintos, dtype=float), np.asarray(conteos, dtype=np.int64), None,
+                      replicas, nivel, semilla, presupuesto_s)
+
+
+def nps_scores(valores: np.ndarray, detractor_max: float, promotor_min: float) -> np.ndarray:
+    """
+    Puntaje por respuesta (+100 promotor, -100 detractor, 0 neutro): su media
+    es el NPS. Los NaN se conservan en su posición para seguir alineados con
+    los pesos; bootstrap_mean_ci los descarta.
+    """
+    valores = np.asarray(valores, dtype=float)
+    puntajes = np.where(valores >= promotor_min, 100.0, np.where(valores <= detractor_max, -100.0, 0.0))
+    return np.where(np.isnan(valores), np.nan, puntajes)
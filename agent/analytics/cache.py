@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Tuple
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_TTL_S = float(os.getenv("RESULT_CACHE_TTL_S", "3600"))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "512"))
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", "")  # vacío = sin nivel en disco
+RESULT_CACHE_DISK_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_DISK_MAX_ENTRIES", "5000"))
+# El directorio se recorre solo cuando el conteo local pasa el máximo o cada
+# tantas escrituras (otros procesos también escriben ahí); al evictar se baja
+# hasta RESULT_CACHE_DISK_LOW_WATER del máximo para no recorrerlo de nuevo enseguida
+RESULT_CACHE_DISK_RESCAN_WRITES = int(os.getenv("RESULT_CACHE_DISK_RESCAN_WRITES", "256"))
+RESULT_CACHE_DISK_LOW_WATER = float(os.getenv("RESULT_CACHE_DISK_LOW_WATER", "0.9"))
+
+
+class ResultCache:
+    """
+    Cache de resultados de analíticas.
+
+    - Llave: hash canónico del request + marca de agua del dataset
+      (ver analytics.canonical.request_key), así que una carga nueva del
+      ETL deja inalcanzables los resultados anteriores.
+    - Nivel 1: memoria, LRU acotado por cantidad de entradas, con TTL.
+    - Nivel 2 (opcional): un JSON por llave en `disk_dir`; sobrevive reinicios.
+    """
+
+    def __init__(self, ttl_s: float = RESULT_CACHE_TTL_S, max_entries: int = RESULT_CACHE_MAX_ENTRIES,
+                 disk_dir: str | None = RESULT_CACHE_DIR or None,
+                 disk_max_entries: int = RESULT_CACHE_DISK_MAX_ENTRIES):
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.disk_max_entries = disk_max_entries
+        self._mem: "OrderedDict[str, Tuple[float, str, Any]]" = OrderedDict()  # key -> (expira, dataset, valor)
+        self._lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+        self._disk_count: int | None = None  # archivos en disco según este proceso (None = sin recorrer)
+        self._disk_writes = 0  # escrituras desde el último recorrido
+        self.stats: Dict[str, int] = {"hits_memoria": 0, "hits_disco": 0, "misses": 0, "evicciones": 0}
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+
+    # ------------------------------------------------------------------
+    def get(self, key: str) -> Tuple[Any, str | None]:
+        """Devuelve (valor, nivel) con nivel 'memoria' | 'disco', o (None, None) si no está."""
+        now = time.time()
+        with self._lock:
+            hit = self._mem.get(key)
+            if hit is not None:
+                if hit[0] > now:
+                    self._mem.move_to_end(key)
+                    self.stats["hits_memoria"] += 1
+                    return hit[2], "memoria"
+                del self._mem[key]
+
+        entry = self._disk_read(key, now)
+        if entry is not None:
+            with self._lock:
+                self.stats["hits_disco"] += 1
+            self._mem_put(key, entry["expira"], entry.get("dataset", ""), entry["valor"])
+            return entry["valor"], "disco"
+
+        with self._lock:
+            self.stats["misses"] += 1
+        return None, None
+
+    def set(self, key: str, value: Any, dataset: str = "") -> None:
+        expira = time.time() + self.ttl_s
+        self._mem_put(key, expira, dataset, value)
+        self._disk_write(key, {"expira": expira, "dataset": dataset, "valor": value})
+
+    def invalidate_dataset(self, dataset: str | None = None) -> int:
+        """
+        Descarta las entradas en memoria de un dataset (o todas). El nivel en
+        disco no se recorre: sus llaves incluyen la marca de agua anterior.
+        """
+        with self._lock:
+            keys = [k for k, (_, ds, _) in self._mem.items() if dataset is None or ds == dataset]
+            for k in keys:
+                del self._mem[k]
+        return len(keys)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"entradas_memoria": len(self._mem), **self.stats}
+
+    # ------------------------------------------------------------------
+    def _mem_put(self, key: str, expira: float, dataset: str, value: Any) -> None:
+        with self._lock:
+            self._mem[key] = (expira, dataset, value)
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.max_entries:
+                self._mem.popitem(last=False)
+                self.stats["evicciones"] += 1
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / key[:2] / f"{key}.json"
+
+    def _disk_read(self, key: str, now: float) -> dict | None:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            entry = json.loads(path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Entrada de cache corrupta {path}: {e}")
+            self._disk_unlink(path)
+            return None
+        if entry.get("expira", 0) <= now:
+            self._disk_unlink(path)
+            return None
+        os.utime(path)  # LRU en disco por mtime
+        return entry
+
+    def _disk_write(self, key: str, entry: dict) -> None:
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(entry, ensure_ascii=False, default=str), encoding="utf-8")
+            nueva = not path.exists()
+            os.replace(tmp, path)
+            with self._lock:
+                if nueva and self._disk_count is not None:
+                    self._disk_count += 1
+                self._disk_writes += 1
+                recorrer = (self._disk_count is None or self._disk_count > self.disk_max_entries
+                            or self._disk_writes >= RESULT_CACHE_DISK_RESCAN_WRITES)
+            if recorrer:
+                self._disk_evict()
+        except Exception as e:
+            logger.warning(f"No se pudo escribir la cache en disco {path}: {e}")
+
+    def _disk_unlink(self, path: Path) -> None:
+        path.unlink(missing_ok=True)
+        with self._lock:
+            if self._disk_count:
+                self._disk_count -= 1
+
+    def _disk_evict(self) -> None:
+        """Recorre el directorio, recalcula el conteo y, si sobra, borra las menos usadas (mtime)."""
+        if not self._evict_lock.acquire(blocking=False):
+            return  # otro hilo ya está recorriendo
+        try:
+            files = list(self.disk_dir.glob("*/*.json"))
+            quedan = len(files)
+            if quedan > self.disk_max_entries:
+                objetivo = int(self.disk_max_entries * RESULT_CACHE_DISK_LOW_WATER)
+                files.sort(key=lambda p: p.stat().st_mtime)
+                for p in files[:quedan - objetivo]:
+                    p.unlink(missing_ok=True)
+                    self.stats["evicciones"] += 1
+                quedan = objetivo
+            with self._lock:
+                self._disk_count = quedan
+                self._disk_writes = 0
+        finally:
+            self._evict_lock.release()
+
+
+RESULT_CACHE = ResultCache()
@@ -0,0 +1,88 @@
+from typing import Any, Dict, List
+import hashlib
+import json
+
+# Campos de la población que son salida (no afectan el cálculo)
+_CAMPOS_SALIDA = {"n"}
+
+
+def _canonical(value: Any) -> Any:
+    """Forma canónica JSON-serializable (dicts con llaves ordenadas al serializar)."""
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    return value
+
+
+def _sorted_values(values: List[Any]) -> List[Any]:
+    """Ordena y deduplica valores de un IN (tolerando tipos mezclados)."""
+    unicos = {json.dumps(v, sort_keys=True, default=str): v for v in values}
+    return [unicos[k] for k in sorted(unicos)]
+
+
+def normalize_filters(filtros: Dict[str, Any] | None) -> Dict[str, Any]:
+    """
+    Normaliza los filtros a la forma de operadores que _apply_filters trata
+    de manera idéntica:
+      - valor simple      -> {"eq": v}
+      - lista             -> {"in": [...]} ordenada y sin duplicados
+      - dict de operadores: se conserva, con "in" ordenado
+    Filtros vacíos ({} o sin operadores) se descartan.
+    """
+    normalizados: Dict[str, Any] = {}
+    for col, cond in (filtros or {}).items():
+        if isinstance(cond, (str, int, float, bool)):
+            normalizados[str(col)] = {"eq": cond}
+        elif isinstance(cond, list):
+            normalizados[str(col)] = {"in": _sorted_values(cond)}
+        elif isinstance(cond, dict):
+            ops = {str(op): _canonical(v) for op, v in cond.items()}
+            if isinstance(ops.get("in"), list):
+                ops["in"] = _sorted_values(ops["in"])
+            if ops:
+                normalizados[str(col)] = ops
+        else:
+            normalizados[str(col)] = _canonical(cond)
+    return normalizados
+
+
+def filter_signature(poblacion: Dict[str, Any]) -> str:
+    """
+    Firma de la población filtrada: dataset + programa + filtros normalizados.
+
+    Dos specs con la misma firma producen exactamente el mismo DataFrame
+    filtrado, así que pueden compartir la carga y el filtrado.
+    """
+    firma = {
+        "dataset": poblacion.get("dataset"),
+        "programa": poblacion.get("programa"),
+        "filtros": normalize_filters(poblacion.get("filtros")),
+    }
+    return json.dumps(firma, sort_keys=True, ensure_ascii=False, default=str)
+
+
+def canonical_request(poblacion: Dict[str, Any], distribuciones: List[str],
+                      tipo_analitica: str | None,
+                      opciones: Dict[str, Any] | None = None) -> Dict[str, Any]:
+    """Request de analítica en forma canónica (sin campos de salida como 'n')."""
+    pob = {k: _canonical(v) for k, v in poblacion.items() if k not in _CAMPOS_SALIDA}
+    pob["filtros"] = normalize_filters(poblacion.get("filtros"))
+    doc = {
+        "poblacion": pob,
+        "distribuciones": list(distribuciones or []),
+        "tipo_analitica": tipo_analitica or "resumen_general",
+    }
+    if opciones:
+        doc["opciones"] = _canonical(opciones)
+    return doc
+
+
+def request_key(poblacion: Dict[str, Any], distribuciones: List[str],
+                tipo_analitica: str | None, watermark: int | None = None,
+                opciones: Dict[str, Any] | None = None) -> str:
+    """Hash SHA-256 del request canónico más la marca de agua del dataset."""
+    doc = canonical_request(poblacion, distribuciones, tipo_analitica, opciones)
+    doc["watermark"] = watermark
+    raw = json.dumps(doc, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+from typing import Any, Dict, Iterable, List
+import logging
+import os
+import threading
+import time
+
+import pandas as pd
+
+from etl.db import make_engine
+from etl.catalog import STOPWORDS, keywords_for, load_question_catalog
+
+logger = logging.getLogger(__name__)
+
+CATALOG_TTL_S = float(os.getenv("QUESTION_CATALOG_TTL_S", "300"))
+
+
+class QuestionCatalog:
+    """
+    Índice en memoria del catálogo de preguntas de un dataset.
+
+    - columnas: columna -> fila del catálogo (dict)
+    - por_codigo: código de pregunta (ig01_1, ep07_18, ...) -> columna
+    - indice: palabra clave -> columnas (índice invertido)
+    """
+
+    def __init__(self, filas: List[Dict[str, Any]]):
+        self.columnas: Dict[str, Dict[str, Any]] = {}
+        self.por_codigo: Dict[str, str] = {}
+        self.indice: Dict[str, List[str]] = {}
+        for fila in filas:
+            col = fila["columna"]
+            self.columnas[col] = fila
+            if fila.get("codigo"):
+                self.por_codigo.setdefault(fila["codigo"], col)
+            for palabra in (fila.get("palabras_clave") or "").split():
+                self.indice.setdefault(palabra, []).append(col)
+        self._orden = {c: i for i, c in enumerate(self.columnas)}
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "QuestionCatalog":
+        return cls(df.to_dict(orient="records"))
+
+    @classmethod
+    def from_columns(cls, columnas: Iterable[str]) -> "QuestionCatalog":
+        """Catálogo mínimo a partir de nombres de columna (cuando el ETL aún no lo generó)."""
+        return cls([
+            {"columna": str(c), "palabras_clave": " ".join(keywords_for(str(c), ""))}
+            for c in columnas
+        ])
+
+    def __len__(self) -> int:
+        return len(self.columnas)
+
+    def __contains__(self, columna: str) -> bool:
+        return columna in self.columnas
+
+    def describe(self, columna: str) -> Dict[str, Any] | None:
+        return self.columnas.get(columna)
+
+    def by_code(self, codigo: str) -> str | None:
+        return self.por_codigo.get(codigo.lower())
+
+    def first_existing(self, candidatos: Iterable[str]) -> str | None:
+        for c in candidatos:
+            if c in self.columnas:
+                return c
+        return None
+
+    def find_by_keywords(self, keywords: List[str]) -> str | None:
+        """
+        Primera columna (en orden del dataset) cuyo nombre contenga *todas*
+        las palabras clave. Se acota con el índice invertido y solo se
+        verifica el substring sobre los candidatos.
+        """
+        candidatos: set[str] | None = None
+        for kw in keywords:
+            kw = kw.lower()
+            hits = {c for c in self._postings_for(kw) if kw in c.lower()}
+            candidatos = hits if candidatos is None else candidatos & hits
+            if not candidatos:
+                return None
+        if not candidatos:
+            return None
+        return min(candidatos, key=self._orden.__getitem__)
+
+    def _postings_for(self, kw: str) -> Iterable[str]:
+        """
+        Superconjunto de columnas cuyo nombre puede contener `kw`: las que
+        tienen alguna palabra del vocabulario que contiene su token más largo.
+        Si el token no es indexable (corto o stopword) se devuelven todas.
+        """
+        token = max(kw.split("_"), key=len, default="")
+        if len(token) < 3 or token in STOPWORDS or token.isdigit():
+            return self.columnas.keys()
+        cols: set[str] = set()
+        for palabra, posting in self.indice.items():
+            if token in palabra:
+                cols.update(posting)
+        return cols
+
+    def search(self, texto: str) -> List[Dict[str, Any]]:
+        """Columnas que contienen todas las palabras clave de `texto`, en orden del dataset."""
+        cols: set[str] | None = None
+        for t in keywords_for(texto, ""):
+            hits = set(self.indice.get(t, []))
+            cols = hits if cols is None else cols & hits
+        return [self.columnas[c] for c in sorted(cols or (), key=self._orden.__getitem__)]
+
+
+_CACHE: Dict[str, tuple[float, QuestionCatalog]] = {}
+_LOCK = threading.Lock()
+
+
+def get_catalog(dataset: str, fallback_columns: Iterable[str] | None = None) -> QuestionCatalog:
+    """
+    Devuelve el catálogo del dataset, cacheado en memoria por CATALOG_TTL_S.
+
+    Si la base aún no tiene catálogo (o no se puede leer) y se pasan
+    `fallback_columns`, construye uno mínimo a partir de esos nombres.
+    """
+    now = time.monotonic()
+    with _LOCK:
+        hit = _CACHE.get(dataset)
+        if hit and now - hit[0] < CATALOG_TTL_S:
+            return hit[1]
+
+    catalogo = QuestionCatalog([])
+    try:
+        with make_engine().connect() as conn:
+            df = load_question_catalog(conn, dataset, schema=os.getenv("ETL_SCHEMA", "etl"))
+        catalogo = QuestionCatalog.from_frame(df)
+    except Exception as e:
+        logger.warning(f"No se pudo leer el catálogo de preguntas de {dataset}: {e}")
+
+    if len(catalogo):
+        with _LOCK:
+            _CACHE[dataset] = (now, catalogo)
+        return catalogo
+    return QuestionCatalog.from_columns(fallback_columns or [])
+
+
+def invalidate_catalog(dataset: str | None = None) -> None:
+    with _LOCK:
+        if dataset is None:
+            _CACHE.clear()
+        else:
+            _CACHE.pop(dataset, None)
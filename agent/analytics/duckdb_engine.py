@@ -0,0 +1,326 @@
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, List, Tuple
+import logging
+import math
+import os
+import threading
+import time
+
+import pandas as pd
+
+from etl.db import make_engine
+from etl.snapshots import snapshot_files, snapshot_watermarks
+from analytics.analytic_types.comparison import (
+    SAT_COL,
+    SATISFACTION_MAPPING,
+    comparison_group,
+    comparison_kpis,
+    grouped_result,
+    _natural_key,
+)
+from analytics.analytic_types.general_summary import _snapshot_pushdown
+from analytics.analytic_types.trend import trend_kpis, _without_version_filter
+from analytics.sql_filters import FilterCompiler, _quote
+from analytics.weighting import weighting_spec
+
+logger = logging.getLogger(__name__)
+
+# Motor por defecto de las analíticas: "pandas", "duckdb" o "comparar"
+ANALYTICS_ENGINE = os.getenv("ANALYTICS_ENGINE", "pandas").lower()
+# Origen de DuckDB: "parquet" (snapshots), "postgres" (postgres scanner) o "auto"
+DUCKDB_SOURCE = os.getenv("DUCKDB_SOURCE", "auto").lower()
+DUCKDB_THREADS = int(os.getenv("DUCKDB_THREADS", "0"))  # 0 = los que elija DuckDB
+DUCKDB_MEMORY_LIMIT = os.getenv("DUCKDB_MEMORY_LIMIT", "")
+# Tolerancia relativa al comparar números entre motores
+ENGINE_COMPARE_RTOL = float(os.getenv("ANALYTICS_ENGINE_COMPARE_RTOL", "1e-9"))
+ENGINE_COMPARE_MAX_DIFFS = 20
+
+MOTORES = ("pandas", "duckdb", "comparar")
+# Analíticas con implementación SQL en DuckDB
+DUCKDB_TYPES = {"comparacion_grupos", "tendencia"}
+
+_NUMERIC_TYPES = ("TINYINT", "SMALLINT", "INTEGER", "BIGINT", "HUGEINT", "UTINYINT", "USMALLINT",
+                  "UINTEGER", "UBIGINT", "FLOAT", "REAL", "DOUBLE", "DECIMAL")
+
+# Una base DuckDB en memoria por proceso; cada consulta usa su propio cursor
+_BASE = None
+_PG_ATTACHED = False
+_BASE_LOCK = threading.Lock()
+
+
+def _duckdb():
+    try:
+        import duckdb
+    except Exception as e:
+        raise RuntimeError("Para el motor DuckDB necesitas instalar 'duckdb' en Poetry") from e
+    return duckdb
+
+
+def engine_option(opciones: Dict[str, Any] | None) -> str:
+    """opciones["motor"] o, si no viene, ANALYTICS_ENGINE."""
+    motor = str((opciones or {}).get("motor") or ANALYTICS_ENGINE).lower()
+    if motor not in MOTORES:
+        raise ValueError(f"Motor de analíticas no soportado: '{motor}' (usa {', '.join(MOTORES)})")
+    return motor
+
+
+def supports_duckdb(tipo_analitica: str, opciones: Dict[str, Any] | None) -> bool:
+    """La ponderación (raking) solo existe en el motor pandas."""
+    return tipo_analitica in DUCKDB_TYPES and not weighting_spec(opciones)
+
+
+# -----------------------------------------------------------------------------
+# Conexión y origen de datos
+# -----------------------------------------------------------------------------
+def _libpq_dsn() -> str:
+    """PG_DSN (formato SQLAlchemy) en formato libpq para el postgres scanner."""
+    url = make_engine().url
+    return url.set(drivername="postgresql").render_as_string(hide_password=False)
+
+
+def _cursor(postgres: bool = False):
+    global _BASE, _PG_ATTACHED
+    with _BASE_LOCK:
+        if _BASE is None:
+            config = {}
+            if DUCKDB_THREADS > 0:
+                config["threads"] = DUCKDB_THREADS
+            if DUCKDB_MEMORY_LIMIT:
+                config["memory_limit"] = DUCKDB_MEMORY_LIMIT
+            _BASE = _duckdb().connect(database=":memory:", config=config)
+        if postgres and not _PG_ATTACHED:
+            _BASE.execute("INSTALL postgres")
+            _BASE.execute("LOAD postgres")
+            _BASE.execute(f"ATTACH '{_libpq_dsn().replace(chr(39), chr(39) * 2)}' AS pg (TYPE postgres, READ_ONLY)")
+            _PG_ATTACHED = True
+        return _BASE.cursor()
+
+
+def _open_source(dataset_name: str, poblacion: Dict[str, Any]) -> Tuple[Any, str]:
+    """
+    Cursor con la vista temporal 'poblacion_src' sobre core.<dataset>:
+      - snapshots Parquet vigentes (solo los programas pedidos), o
+      - la tabla de Postgres vía el postgres scanner (DUCKDB_SOURCE=postgres,
+        o en modo auto si falta algún snapshot)
+    """
+    if DUCKDB_SOURCE in ("parquet", "auto"):
+        programas, _ = _snapshot_pushdown(poblacion)
+        try:
+            with make_engine().connect() as conn:
+                marcas = snapshot_watermarks(conn, dataset_name, os.getenv("ETL_SCHEMA", "etl"),
+                                             os.getenv("CORE_SCHEMA", "core"))
+            archivos = snapshot_files(dataset_name, marcas, programas)
+        except Exception as e:
+            logger.warning(f"Snapshots de {dataset_name} no disponibles para DuckDB: {e}")
+            archivos = None
+        if archivos:
+            con = _cursor()
+            con.read_parquet(archivos, union_by_name=True).create_view("poblacion_src", replace=True)
+            return con, "parquet"
+        if DUCKDB_SOURCE == "parquet":
+            raise RuntimeError(f"No hay snapshots Parquet vigentes de '{dataset_name}'.")
+
+    schema = os.getenv("CORE_SCHEMA", "core")
+    con = _cursor(postgres=True)
+    con.execute(f"CREATE OR REPLACE TEMP VIEW poblacion_src AS SELECT * FROM pg.{_quote(schema)}.{_quote(dataset_name)}")
+    return con, "postgres"
+
+
+def _duckdb_class(tipo: str) -> str:
+    tipo = tipo.upper()
+    if tipo.startswith(_NUMERIC_TYPES):
+        return "numeric"
+    if tipo.startswith(("DATE", "TIMESTAMP")):
+        return "temporal"
+    if tipo == "BOOLEAN":
+        return "boolean"
+    return "text" if tipo == "VARCHAR" else "other"
+
+
+def _column_types(con) -> Dict[str, str]:
+    """Columnas de poblacion_src clasificadas como postgres_column_types."""
+    filas = con.execute("DESCRIBE poblacion_src").fetchall()
+    return {nombre: _duckdb_class(tipo) for nombre, tipo, *_ in filas}
+
+
+# -----------------------------------------------------------------------------
+# Agregados agrupados en SQL (mismo formato que comparison.group_aggregates)
+# -----------------------------------------------------------------------------
+def _label_expr(col: str, na_label: str) -> str:
+    return f"COALESCE(CAST({_quote(col)} AS VARCHAR), '{na_label}')"
+
+
+def _group_aggregates_sql(con, grupo: str, na_label: str, variables: List[str],
+                          tipos: Dict[str, str], where: str,
+                          params: Dict[str, Any]) -> Tuple[pd.DataFrame, List[str], pd.Series]:
+    """
+    Igual que comparison.group_aggregates pero resuelto por DuckDB:
+    una agregación GROUP BY para las medidas y un UNPIVOT + GROUP BY para las
+    distribuciones, ambos sobre la población filtrada por el WHERE compilado.
+
+    Las etiquetas salen de CAST(... AS VARCHAR); en columnas enteras con
+    nulos pandas las ve como float ("1.0" en vez de "1") y el modo
+    "comparar" lo reporta como diferencia.
+    """
+    compiler = FilterCompiler(tipos, dialect="duckdb")
+    medidas = [f"{_label_expr(grupo, na_label)} AS grupo"]
+    aggs = ["COUNT(*) AS n"]
+    if SAT_COL in tipos:
+        casos = " ".join(
+            f"WHEN '{k.replace(chr(39), chr(39) * 2)}' THEN {v}" for k, v in SATISFACTION_MAPPING.items()
+        )
+        medidas.append(f"CAST(CASE CAST({_quote(SAT_COL)} AS VARCHAR) {casos} END AS DOUBLE) AS sat")
+        aggs += [
+            "COUNT(sat) AS n_sat",
+            "AVG(sat) AS satisfaccion_media",
+            "COUNT(*) FILTER (WHERE sat >= 4) AS promotores",
+            "COUNT(*) FILTER (WHERE sat <= 2) AS detractores",
+        ]
+    for i, v in enumerate(variables):
+        medidas.append(f"{compiler.numeric_expr(v)} AS num_{i}")
+        aggs += [f"AVG(num_{i}) AS {_quote('media_' + v)}", f"COUNT(num_{i}) AS validos_{i}"]
+
+    sql = (
+        f"WITH base AS (SELECT {', '.join(medidas)} FROM poblacion_src WHERE {where}) "
+        f"SELECT grupo, {', '.join(aggs)} FROM base GROUP BY grupo"
+    )
+    por_grupo = con.execute(sql, params).df().set_index("grupo")
+    numericas = [v for i, v in enumerate(variables) if por_grupo[f"validos_{i}"].sum() > 0]
+    por_grupo = por_grupo.drop(
+        columns=[f"validos_{i}" for i in range(len(variables))]
+        + [f"media_{v}" for v in variables if v not in numericas]
+    )
+
+    conteos = pd.Series(dtype="int64")
+    if variables:
+        valores = ", ".join(f"{_label_expr(v, 'NA')} AS {_quote(v)}" for v in variables)
+        columnas = ", ".join(_quote(v) for v in variables)
+        sql = (
+            f"WITH base AS (SELECT {_label_expr(grupo, na_label)} AS grupo, {valores} "
+            f"FROM poblacion_src WHERE {where}) "
+            f"SELECT variable, grupo, valor, COUNT(*) AS conteo "
+            f"FROM (UNPIVOT base ON {columnas} INTO NAME variable VALUE valor) "
+            f"GROUP BY variable, grupo, valor"
+        )
+        largo = con.execute(sql, params).df()
+        conteos = largo.set_index(["variable", "grupo", "valor"])["conteo"].sort_index()
+    return por_grupo, numericas, conteos
+
+
+def generate_results_duckdb(poblacion: Dict[str, Any], distribuciones: List[str],
+                            tipo_analitica: str, opciones: Dict[str, Any] | None = None) -> Dict[str, Any]:
+    """
+    Ejecuta `tipo_analitica` (ver DUCKDB_TYPES) en DuckDB: filtros compilados
+    a SQL (FilterCompiler, dialecto duckdb) y agregaciones en el motor, sin
+    materializar la población en pandas. Misma salida que el motor pandas.
+    """
+    dataset_name = poblacion.get("dataset")
+    if not dataset_name:
+        raise ValueError("La población no contiene el campo 'dataset'.")
+    if tipo_analitica not in DUCKDB_TYPES:
+        raise ValueError(f"'{tipo_analitica}' no está implementada en el motor DuckDB.")
+
+    es_tendencia = tipo_analitica == "tendencia"
+    filtro = _without_version_filter(poblacion) if es_tendencia else poblacion
+    grupo = "version" if es_tendencia else comparison_group(opciones)
+
+    con, origen = _open_source(dataset_name, filtro)
+    try:
+        tipos = _column_types(con)
+        if grupo not in tipos:
+            raise ValueError(f"El dataset '{dataset_name}' no tiene la columna '{grupo}'.")
+        compiler = FilterCompiler(tipos, dialect="duckdb")
+        where = compiler.compile(filtro, set(tipos))
+        variables = [v for v in dict.fromkeys(distribuciones) if v in tipos and v != grupo]
+        # la tendencia etiqueta las versiones con astype(str): un nulo de texto queda "None"
+        por_grupo, numericas, conteos = _group_aggregates_sql(
+            con, grupo, "None" if es_tendencia else "NA", variables, tipos, where, compiler.params
+        )
+    finally:
+        con.close()
+    logger.debug(f"{tipo_analitica} de {dataset_name} resuelta en DuckDB desde {origen}")
+
+    if "n" not in poblacion:
+        poblacion["n"] = int(por_grupo["n"].sum())
+
+    orden = sorted(por_grupo.index, key=_natural_key)
+    filas, distribuciones_resultado = grouped_result(por_grupo, numericas, conteos, variables, orden)
+    if es_tendencia:
+        serie = [{"version": f.pop("grupo"), **f} for f in filas]
+        return {
+            "kpis": trend_kpis(orden, serie, numericas),
+            "tablas": {"tendencia": serie},
+            "distribuciones": distribuciones_resultado,
+        }
+    return {
+        "kpis": comparison_kpis(grupo, filas, numericas),
+        "tablas": {"grupos": filas},
+        "distribuciones": distribuciones_resultado,
+    }
+
+
+# -----------------------------------------------------------------------------
+# Modo "comparar": el mismo spec en ambos motores
+# -----------------------------------------------------------------------------
+def diff_results(a: Any, b: Any, ruta: str = "", rtol: float = ENGINE_COMPARE_RTOL,
+                 salida: List[str] | None = None) -> List[str]:
+    """Rutas donde difieren dos resultados (números con tolerancia relativa `rtol`)."""
+    salida = [] if salida is None else salida
+    if len(salida) >= ENGINE_COMPARE_MAX_DIFFS:
+        return salida
+    if isinstance(a, dict) and isinstance(b, dict):
+        for k in list(a) + [k for k in b if k not in a]:
+            if k not in a or k not in b:
+                salida.append(f"{ruta}/{k}: solo en {'pandas' if k in a else 'duckdb'}")
+            else:
+                diff_results(a[k], b[k], f"{ruta}/{k}", rtol, salida)
+    elif isinstance(a, list) and isinstance(b, list):
+        if len(a) != len(b):
+            salida.append(f"{ruta}: {len(a)} vs {len(b)} elementos")
+        for i, (x, y) in enumerate(zip(a, b)):
+            diff_results(x, y, f"{ruta}[{i}]", rtol, salida)
+    elif isinstance(a, (int, float)) and isinstance(b, (int, float)) \
+            and not isinstance(a, bool) and not isinstance(b, bool):
+        if not (math.isclose(a, b, rel_tol=rtol, abs_tol=rtol)
+                or (math.isnan(a) and math.isnan(b))):
+            salida.append(f"{ruta}: {a!r} vs {b!r}")
+    elif a != b:
+        salida.append(f"{ruta}: {a!r} vs {b!r}")
+    return salida
+
+
+def compare_engines(poblacion: Dict[str, Any], distribuciones: List[str], tipo_analitica: str,
+                    opciones: Dict[str, Any] | None,
+                    pandas_fn: Callable[[Dict[str, Any], Dict[str, Any]], Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Corre el spec en pandas (`pandas_fn(poblacion, opciones)`) y en DuckDB y
+    devuelve el resultado de pandas con "motores": tiempos de cada motor,
+    si coinciden y las primeras diferencias encontradas.
+    """
+    opciones = {k: v for k, v in (opciones or {}).items() if k != "motor"}
+
+    t0 = time.perf_counter()
+    resultado = pandas_fn(poblacion, {**opciones, "motor": "pandas"})
+    t_pandas = time.perf_counter() - t0
+
+    motores: Dict[str, Any] = {"pandas": {"segundos": round(t_pandas, 4)}}
+    if not supports_duckdb(tipo_analitica, opciones):
+        motores["duckdb"] = {"error": f"'{tipo_analitica}' no está implementada en el motor DuckDB"}
+        return {**resultado, "motores": motores}
+
+    t0 = time.perf_counter()
+    try:
+        otro = generate_results_duckdb(dict(poblacion), distribuciones, tipo_analitica, opciones)
+    except Exception as e:
+        logger.exception("Falló el motor DuckDB en modo comparar")
+        motores["duckdb"] = {"error": str(e)}
+        return {**resultado, "motores": motores}
+    t_duckdb = time.perf_counter() - t0
+
+    diferencias = diff_results(resultado, otro)
+    motores["duckdb"] = {"segundos": round(t_duckdb, 4)}
+    motores["coinciden"] = not diferencias
+    motores["diferencias"] = diferencias
+    motores["aceleracion"] = round(t_pandas / t_duckdb, 2) if t_duckdb > 0 else None
+    return {**resultado, "motores": motores}
@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+from typing import Any, Dict, Iterable, Tuple
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+def is_year_column(col: str) -> bool:
+    """Columnas que _apply_filters compara numéricamente (año de graduación, etc.)."""
+    return "ano" in col.lower() or "year" in col.lower()
+
+
+class FrameIndex:
+    """
+    Índice en memoria sobre un DataFrame de solo lectura (el core cacheado).
+
+    - Bitmaps por (columna, valor): arreglos bool empaquetados (np.packbits),
+      construidos la primera vez que se consultan a partir de pd.factorize.
+    - Índice de rango para columnas numéricas/de año: valores ordenados +
+      permutación (argsort); gte/lte/gt/lt se resuelven con searchsorted.
+
+    Las condiciones se combinan con AND sobre los bitmaps empaquetados y el
+    DataFrame se recorta una sola vez con la máscara final.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self.n = len(df)
+        self._lock = threading.Lock()
+        self._codes: Dict[Tuple[str, bool], Tuple[np.ndarray, Dict[Any, int]]] = {}
+        self._bitmaps: Dict[Tuple[str, bool, int], np.ndarray] = {}
+        self._ranges: Dict[str, Tuple[np.ndarray, np.ndarray, int]] = {}
+        self._numeric: Dict[str, np.ndarray] = {}
+
+    # ------------------------------------------------------------------
+    # Construcción perezosa
+    # ------------------------------------------------------------------
+    def numeric_values(self, col: str) -> np.ndarray:
+        with self._lock:
+            vals = self._numeric.get(col)
+        if vals is None:
+            vals = pd.to_numeric(self.df[col], errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+            with self._lock:
+                self._numeric[col] = vals
+        return vals
+
+    def _factorized(self, col: str, numeric: bool) -> Tuple[np.ndarray, Dict[Any, int]]:
+        key = (col, numeric)
+        with self._lock:
+            hit = self._codes.get(key)
+        if hit is None:
+            serie = pd.Series(self.numeric_values(col)) if numeric else self.df[col]
+            codes, uniques = pd.factorize(serie, use_na_sentinel=True)
+            lookup = {}
+            for i, u in enumerate(uniques.tolist() if hasattr(uniques, "tolist") else list(uniques)):
+                try:
+                    lookup.setdefault(u, i)
+                except TypeError:  # valores no hashables: no indexables
+                    pass
+            hit = (np.asarray(codes), lookup)
+            with self._lock:
+                self._codes[key] = hit
+        return hit
+
+    def eq_bitmap(self, col: str, value: Any, numeric: bool = False) -> np.ndarray:
+        """Bitmap empaquetado de filas donde col == value."""
+        codes, lookup = self._factorized(col, numeric)
+        try:
+            code = lookup.get(value, -1)
+        except TypeError:
+            code = -1
+        if code < 0:
+            return np.zeros((self.n + 7) // 8, dtype=np.uint8)
+        key = (col, numeric, code)
+        with self._lock:
+            bm = self._bitmaps.get(key)
+        if bm is None:
+            bm = np.packbits(codes == code)
+            with self._lock:
+                self._bitmaps[key] = bm
+        return bm
+
+    def in_bitmap(self, col: str, values: Iterable[Any], numeric: bool = False) -> np.ndarray:
+        out = np.zeros((self.n + 7) // 8, dtype=np.uint8)
+        for v in values:
+            np.bitwise_or(out, self.eq_bitmap(col, v, numeric), out=out)
+        return out
+
+    def _sorted(self, col: str) -> Tuple[np.ndarray, np.ndarray, int]:
+        with self._lock:
+            hit = self._ranges.get(col)
+        if hit is None:
+            vals = self.numeric_values(col)
+            order = np.argsort(vals, kind="stable")  # NaN quedan al final
+            n_valid = int((~np.isnan(vals)).sum())
+            hit = (vals[order][:n_valid], order, n_valid)
+            with self._lock:
+                self._ranges[col] = hit
+        return hit
+
+    def range_bitmap(self, col: str, op: str, value: Any) -> np.ndarray:
+        """Bitmap empaquetado para col <op> value con op en gte/lte/gt/lt (columna numérica)."""
+        sorted_vals, order, n_valid = self._sorted(col)
+        v = float(value)
+        if op == "gte":
+            rows = order[np.searchsorted(sorted_vals, v, side="left"):n_valid]
+        elif op == "gt":
+            rows = order[np.searchsorted(sorted_vals, v, side="right"):n_valid]
+        elif op == "lte":
+            rows = order[:np.searchsorted(sorted_vals, v, side="right")]
+        elif op == "lt":
+            rows = order[:np.searchsorted(sorted_vals, v, side="left")]
+        else:
+            raise ValueError(f"Operador de rango no soportado: {op}")
+        mask = np.zeros(self.n, dtype=bool)
+        mask[rows] = True
+        return np.packbits(mask)
+
+    # ------------------------------------------------------------------
+    def unpack(self, bitmap: np.ndarray) -> np.ndarray:
+        return np.unpackbits(bitmap, count=self.n).astype(bool)
+
+    def full(self) -> np.ndarray:
+        return np.packbits(np.ones(self.n, dtype=bool))
+
+
+def _mask_to_bitmap(mask: Any) -> np.ndarray:
+    if isinstance(mask, pd.Series):
+        mask = mask.to_numpy(dtype=bool, na_value=False)
+    return np.packbits(np.asarray(mask, dtype=bool))
+
+
+def compile_filter_mask(index: FrameIndex, poblacion: Dict[str, Any]) -> np.ndarray:
+    """
+    Evalúa 'programa' y 'filtros' de la población a una única máscara booleana
+    (AND de todas las condiciones), con la misma semántica que el filtrado
+    secuencial de _apply_filters.
+    """
+    df = index.df
+    acc = index.full()
+
+    def _and(bm: np.ndarray) -> None:
+        np.bitwise_and(acc, bm, out=acc)
+
+    programa = poblacion.get("programa")
+    if programa is not None and "programa" in df.columns:
+        _and(index.eq_bitmap("programa", programa))
+
+    filtros = poblacion.get("filtros", {}) or {}
+    for col, cond in filtros.items():
+        if col not in df.columns:
+            logger.warning(f"Column '{col}' not found in dataframe. Ignoring filter.")
+            continue
+
+        numeric = is_year_column(col)
+        serie = pd.Series(index.numeric_values(col), index=df.index) if numeric else df[col]
+        range_ok = numeric or pd.api.types.is_numeric_dtype(serie.dtype)
+
+        # 1) Valor simple -> igualdad
+        if isinstance(cond, (str, int, float, bool)):
+            _and(index.eq_bitmap(col, cond, numeric))
+
+        # 2) Lista -> IN
+        elif isinstance(cond, list):
+            _and(index.in_bitmap(col, cond, numeric))
+
+        # 3) Dict de operadores
+        elif isinstance(cond, dict):
+            if "eq" in cond:
+                _and(index.eq_bitmap(col, cond["eq"], numeric))
+            if "neq" in cond:
+                _and(np.invert(index.eq_bitmap(col, cond["neq"], numeric)))
+            for op, fn in (("gte", serie.ge), ("lte", serie.le), ("gt", serie.gt), ("lt", serie.lt)):
+                if op not in cond:
+                    continue
+                if range_ok and isinstance(cond[op], (int, float)) and not isinstance(cond[op], bool):
+                    if not numeric:
+                        index.numeric_values(col)
+                    _and(index.range_bitmap(col, op, cond[op]))
+                else:
+                    _and(_mask_to_bitmap(fn(cond[op])))
+            if "in" in cond:
+                _and(index.in_bitmap(col, cond["in"], numeric))
+
+    return index.unpack(acc)
@@ -1,6 +1,37 @@
-from analytics.analytic_types.general_summary import generate_general_summary
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+from analytics.analytic_types.general_summary import (
+    generate_general_summary,
+    _load_core_dataset,
+    _apply_filters,
+    _snapshot_pushdown,
+    CORE_PUSHDOWN,
+)
 from analytics.analytic_types.question_detail import generate_question_detail
 from analytics.analytic_types.population_profile import generate_population_profile
+from analytics.analytic_types.data_quality import generate_data_quality
+from analytics.analytic_types.trend import generate_trend, _without_version_filter
+from analytics.analytic_types.comparison import generate_group_comparison
+from analytics.duckdb_engine import (
+    engine_option,
+    supports_duckdb,
+    generate_results_duckdb,
+    compare_engines,
+)
+from analytics.canonical import filter_signature
+from analytics.weighting import weighting_spec
+from analytics.watermark import pinned_watermark
+from analytics.streaming import (
+    should_stream,
+    generate_general_summary_streaming,
+    generate_question_detail_streaming,
+)
+
+BATCH_THREADS = int(os.getenv("ANALYTICS_BATCH_THREADS", "4"))
+
+# Analíticas que no recorren el DataFrame de la población
+_SIN_DATAFRAME = {"calidad_datos"}
 
 
 '''
@@ -11,41 +42,166 @@ from analytic_types.data_quality import generate_data_quality
 '''
 
 
-def generate_results(poblacion: dict, distribuciones: list, tipo_analitica: str):
+def generate_results(poblacion: dict, distribuciones: list, tipo_analitica: str, df=None,
+                     opciones: dict | None = None, watermark: int | None = None):
     """
     Orquesta la generación de resultados según el tipo de analítica.
 
+    `df` es opcional: población ya cargada y filtrada (lo usa el modo batch).
+    `opciones` son ajustes del cálculo que no cambian la población, p.ej.
+    {"intervalos": {"replicas": 2000, "nivel": 0.95}} (IC bootstrap).
+    Sin `df`, resumen_general y detalle_pregunta pueden resolverse por chunks
+    desde la BD (ver analytics.streaming.should_stream) en vez de cargar la tabla.
+
+    opciones["motor"] (o ANALYTICS_ENGINE) elige el motor: "pandas", "duckdb"
+    (SQL embebido, ver analytics.duckdb_engine.DUCKDB_TYPES; lo demás cae a
+    pandas) o "comparar" (ambos motores, con tiempos y diferencias en
+    "motores"). Con `df` (modo batch) siempre se usa pandas.
+
+    `watermark` es la marca del dataset con la que se armó la llave de la
+    cache de resultados: los caches del worker (frames, pesos) usan esa
+    misma marca en vez de volver a leerla (ver pinned_watermark).
+
     tipo_analitica puede ser:
       - "resumen_general"
       - "detalle_pregunta"
       - "comparacion_grupos"
       - "perfil_poblacion"
       - "calidad_datos"
+      - "tendencia"
     """
 
+    with pinned_watermark(poblacion.get("dataset"), watermark):
+        return _generate_results(poblacion, distribuciones, tipo_analitica, df, opciones)
+
+
+def _generate_results(poblacion: dict, distribuciones: list, tipo_analitica: str, df,
+                      opciones: dict | None):
     # default por si viene None o vacío
     if not tipo_analitica:
         tipo_analitica = "resumen_general"
 
+    if df is None:
+        motor = engine_option(opciones)
+        if motor == "comparar":
+            return compare_engines(
+                poblacion, distribuciones, tipo_analitica, opciones,
+                lambda p, o: generate_results(p, distribuciones, tipo_analitica, opciones=o),
+            )
+        if motor == "duckdb" and supports_duckdb(tipo_analitica, opciones):
+            return generate_results_duckdb(poblacion, distribuciones, tipo_analitica, opciones)
+
+    # la ponderación necesita la población completa en memoria
+    streaming = df is None and tipo_analitica in ("resumen_general", "detalle_pregunta") \
+        and not weighting_spec(opciones) and should_stream(poblacion)
+
     match tipo_analitica:
         case "resumen_general":
-            return generate_general_summary(poblacion, distribuciones)
+            if streaming:
+                return generate_general_summary_streaming(poblacion, distribuciones, opciones)
+            return generate_general_summary(poblacion, distribuciones, df, opciones)
     
         case "detalle_pregunta":
-            return generate_question_detail(poblacion, distribuciones)
+            if streaming:
+                return generate_question_detail_streaming(poblacion, distribuciones, opciones)
+            return generate_question_detail(poblacion, distribuciones, df, opciones)
             pass
 
         case "comparacion_grupos":
-            #return generate_group_comparison(poblacion, distribuciones)
-            pass
+            return generate_group_comparison(poblacion, distribuciones, df, opciones)
 
         case "perfil_poblacion":
-            return generate_population_profile(poblacion, distribuciones)
+            return generate_population_profile(poblacion, distribuciones, df, opciones)
 
 
         case "calidad_datos":
-            #return generate_data_quality(poblacion, distribuciones) #por como funciona el etl, no es necesario en realidad
-            pass
+            return generate_data_quality(poblacion, distribuciones)
+
+        case "tendencia":
+            return generate_trend(poblacion, distribuciones, df)
 
         case _:
-            raise ValueError(f"Tipo de analítica no soportado: {tipo_analitica}")
\ No newline at end of file
+            raise ValueError(f"Tipo de analítica no soportado: {tipo_analitica}")
+
+def run_analytics_job(poblacion: dict, distribuciones: list, tipo_analitica: str,
+                      opciones: dict | None = None, watermark: int | None = None) -> dict:
+    """
+    Punto de entrada para ejecutar generate_results en un proceso del pool.
+
+    generate_results completa poblacion["n"] en sitio; como el proceso worker
+    no comparte memoria con la API, se devuelve la población junto con los resultados.
+    `watermark` es la marca que leyó la API para la llave de la cache.
+    """
+    resultados = generate_results(poblacion, distribuciones, tipo_analitica, opciones=opciones,
+                                  watermark=watermark)
+    return {"poblacion": poblacion, "resultados": resultados}
+
+
+def generate_results_batch(specs: list) -> list:
+    """
+    Evalúa muchas specs {poblacion, distribuciones, tipo_analitica, watermark?}
+    compartiendo la carga del dataset y el filtrado (`watermark`: la marca
+    con la que la API armó la llave de la cache, ver generate_results).
+
+      1) agrupa las specs por firma de población (dataset + programa + filtros)
+      2) carga cada dataset una sola vez y filtra una sola vez por grupo
+      3) evalúa las specs del grupo sobre el mismo DataFrame (de solo lectura)
+         en paralelo con hilos (pandas libera el GIL en buena parte del trabajo)
+
+    Devuelve una lista en el mismo orden que `specs`; cada elemento es
+    {"poblacion", "resultados"} o {"poblacion", "error"} si esa spec falló.
+    """
+    def _poblacion_filtrada(spec):
+        # la tendencia recorre todas las versiones: se agrupa sin el filtro de versión
+        if spec.get("tipo_analitica") == "tendencia":
+            return _without_version_filter(spec["poblacion"])
+        return spec["poblacion"]
+
+    grupos: dict = {}
+    for i, spec in enumerate(specs):
+        grupos.setdefault(filter_signature(_poblacion_filtrada(spec)), []).append(i)
+
+    bases: dict = {}
+    salida: list = [None] * len(specs)
+
+    def _evaluar(i, df):
+        spec = specs[i]
+        poblacion = dict(spec["poblacion"])
+        try:
+            if df is not None and "n" not in poblacion:
+                poblacion["n"] = len(df)
+            resultados = generate_results(poblacion, spec.get("distribuciones") or [],
+                                          spec.get("tipo_analitica"), df, spec.get("opciones"),
+                                          spec.get("watermark"))
+            return {"poblacion": poblacion, "resultados": resultados}
+        except Exception as e:
+            return {"poblacion": poblacion, "error": str(e)}
+
+    with ThreadPoolExecutor(max_workers=BATCH_THREADS) as pool:
+        futuros = {}
+        for indices in grupos.values():
+            poblacion = _poblacion_filtrada(specs[indices[0]])
+            df = None
+            if any(specs[i].get("tipo_analitica") not in _SIN_DATAFRAME for i in indices):
+                try:
+                    dataset = poblacion.get("dataset")
+                    base_key = (dataset, _snapshot_pushdown(poblacion) if CORE_PUSHDOWN else None)
+                    if base_key not in bases:
+                        with pinned_watermark(dataset, specs[indices[0]].get("watermark")):
+                            bases[base_key] = _load_core_dataset(dataset, poblacion=poblacion)
+                    df = _apply_filters(bases[base_key], poblacion)
+                except Exception as e:
+                    for i in indices:
+                        salida[i] = {"poblacion": specs[i]["poblacion"], "error": str(e)}
+                    continue
+            for i in indices:
+                futuros[pool.submit(_evaluar, i, df)] = i
+        for fut, i in futuros.items():
+            salida[i] = fut.result()
+
+    return salida
+
+
+def run_analytics_batch_job(specs: list) -> list:
+    """Punto de entrada del modo batch para el pool de procesos."""
+    return generate_results_batch(specs)
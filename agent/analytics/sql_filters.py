@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+from typing import Any, Dict, List, Tuple
+
+import pandas as pd
+
+from analytics.frame_index import is_year_column
+
+# Texto convertible a número con la misma tolerancia que pd.to_numeric
+_NUMERIC_RE = r"^\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?\s*$"
+
+_OPS = {"gte": ">=", "lte": "<=", "gt": ">", "lt": "<"}
+
+# data_type de information_schema -> clase que usa FilterCompiler
+_POSTGRES_TYPES = {
+    **dict.fromkeys(("smallint", "integer", "bigint", "numeric", "real", "double precision"), "numeric"),
+    **dict.fromkeys(("text", "character varying", "character"), "text"),
+    **dict.fromkeys(("date", "timestamp without time zone", "timestamp with time zone"), "temporal"),
+    "boolean": "boolean",
+}
+
+
+def _quote(col: str) -> str:
+    return '"' + col.replace('"', '""') + '"'
+
+
+class FilterCompiler:
+    """
+    Traduce 'programa' + 'filtros' de una población a un WHERE parametrizado
+    con la misma semántica que _apply_filters sobre pandas:
+
+      - columnas de año ('ano'/'year') se comparan como numéricas; el texto
+        no convertible queda NULL (equivale a NaN tras pd.to_numeric)
+      - igualdad entre tipos distintos (texto vs número) nunca matchea
+      - neq incluye los nulos (NaN != x es True en pandas)
+      - comparaciones de texto en orden de code points (COLLATE "C")
+      - fechas contra texto interpretable como fecha (pd.Timestamp) y
+        booleanos contra bool; un valor de otro tipo nunca matchea
+
+    `column_types` mapea columna -> "numeric" | "text" | "temporal" |
+    "boolean"; lo demás (uuid, json...) se compara como texto casteado.
+    `dialect` es "postgres" o "duckdb".
+    """
+
+    def __init__(self, column_types: Dict[str, str], dialect: str = "postgres"):
+        self.column_types = column_types
+        self.dialect = dialect
+        self.params: Dict[str, Any] = {}
+
+    # ------------------------------------------------------------------
+    def _param(self, value: Any) -> str:
+        name = f"p{len(self.params)}"
+        self.params[name] = value
+        return f":{name}" if self.dialect == "postgres" else f"${name}"
+
+    def numeric_expr(self, col: str) -> str:
+        q = _quote(col)
+        if self.column_types.get(col) == "numeric":
+            return f"CAST({q} AS DOUBLE PRECISION)"
+        if self.dialect == "duckdb":
+            return f"TRY_CAST(TRIM(CAST({q} AS VARCHAR)) AS DOUBLE)"
+        return (
+            f"(CASE WHEN {q}::text ~ '{_NUMERIC_RE}' "
+            f"THEN btrim({q}::text)::double precision END)"
+        )
+
+    def _operand(self, col: str, value: Any) -> Tuple[str, Any] | None:
+        """(expresión de columna, valor) comparables, o None si los tipos nunca coinciden."""
+        tipo = self.column_types.get(col)
+        if is_year_column(col) or tipo == "numeric":
+            if isinstance(value, bool):
+                value = int(value)
+            if not isinstance(value, (int, float)):
+                return None
+            return self.numeric_expr(col), value
+        if tipo == "boolean":
+            if not isinstance(value, (bool, int, float)) or value not in (0, 1):
+                return None
+            return _quote(col), bool(value)
+        if tipo == "temporal":
+            # el valor se interpreta aquí: un texto que no es fecha no llega
+            # a Postgres (el cast implícito fallaría) y simplemente no matchea
+            if not isinstance(value, str):
+                return None
+            try:
+                momento = pd.Timestamp(value)
+            except (ValueError, TypeError):
+                return None
+            if pd.isna(momento):
+                return None
+            return _quote(col), momento.to_pydatetime()
+        if not isinstance(value, str):
+            return None
+        if self.dialect == "duckdb":
+            return f"CAST({_quote(col)} AS VARCHAR)", value
+        return (_quote(col) if tipo == "text" else f"{_quote(col)}::text"), value
+
+    def _eq(self, col: str, value: Any) -> str:
+        op = self._operand(col, value)
+        if op is None:
+            return "FALSE"
+        return f"{op[0]} = {self._param(op[1])}"
+
+    def _in(self, col: str, values: List[Any]) -> str:
+        partes = [self._eq(col, v) for v in values]
+        partes = [p for p in partes if p != "FALSE"]
+        return "(" + " OR ".join(partes) + ")" if partes else "FALSE"
+
+    def _cmp(self, col: str, op: str, value: Any) -> str:
+        operand = self._operand(col, value)
+        if operand is None:
+            # pandas lanzaría TypeError comparando tipos distintos
+            raise TypeError(f"No se puede comparar '{col}' {op} {value!r}")
+        expr, v = operand
+        if isinstance(v, str):
+            # solo expresiones de texto: COLLATE sobre fechas/booleanos es un error
+            expr = f'{expr} COLLATE "C"'
+        return f"{expr} {_OPS[op]} {self._param(v)}"
+
+    # ------------------------------------------------------------------
+    def compile(self, poblacion: Dict[str, Any], columns: set[str] | None = None) -> str:
+        """Devuelve la condición WHERE (sin la palabra WHERE); "TRUE" si no hay filtros."""
+        conds: List[str] = []
+        columns = columns if columns is not None else set(self.column_types)
+
+        programa = poblacion.get("programa")
+        if programa is not None and "programa" in columns:
+            conds.append(self._eq("programa", programa))
+
+        for col, cond in (poblacion.get("filtros") or {}).items():
+            if col not in columns:
+                continue
+            if isinstance(cond, (str, int, float, bool)):
+                conds.append(self._eq(col, cond))
+            elif isinstance(cond, list):
+                conds.append(self._in(col, cond))
+            elif isinstance(cond, dict):
+                if "eq" in cond:
+                    conds.append(self._eq(col, cond["eq"]))
+                if "neq" in cond:
+                    eq = self._eq(col, cond["neq"])
+                    conds.append("TRUE" if eq == "FALSE" else f"(({eq}) IS NOT TRUE)")
+                for op in ("gte", "lte", "gt", "lt"):
+                    if op in cond:
+                        conds.append(self._cmp(col, op, cond[op]))
+                if "in" in cond:
+                    conds.append(self._in(col, cond["in"]))
+
+        return " AND ".join(conds) if conds else "TRUE"
+
+
+def postgres_column_types(conn, schema: str, table: str) -> Dict[str, str]:
+    """Columnas de schema.table clasificadas en 'numeric', 'text', 'temporal', 'boolean' u 'other'."""
+    from sqlalchemy import text
+
+    rows = conn.execute(
+        text(
+            "SELECT column_name, data_type FROM information_schema.columns "
+            "WHERE table_schema = :schema AND table_name = :table"
+        ),
+        {"schema": schema, "table": table},
+    ).all()
+    return {c: _POSTGRES_TYPES.get(t, "other") for c, t in rows}
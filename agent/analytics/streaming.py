@@ -0,0 +1,378 @@
+from __future__ import annotations
+
+from typing import Any, Dict, Iterator, List
+import logging
+import math
+import os
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from etl.db import make_engine
+from analytics.analytic_types.question_detail import LIKERT_MAX_SPAN
+from analytics.bootstrap import bootstrap_mean_ci_counts, interval_options, nps_scores
+from analytics.sql_filters import FilterCompiler, postgres_column_types, _quote
+
+logger = logging.getLogger(__name__)
+
+STREAM_CHUNK_ROWS = int(os.getenv("ANALYTICS_STREAM_CHUNK_ROWS", "50000"))
+SKETCH_MAX_CENTROIDS = int(os.getenv("ANALYTICS_SKETCH_MAX_CENTROIDS", "4096"))
+STREAMING_MIN_ROWS = int(os.getenv("ANALYTICS_STREAMING_MIN_ROWS", "0"))  # 0 = solo a pedido
+
+SAT_COL = "ep07_18_en_general_cual_es_su_grado_de_satisfaccion_en_relacion"
+POSGRADO_COL = "ig01_1_el_posgrado_que_usted_curso_es"
+SATISFACTION_MAPPING = {
+    "Insatisfecho (a)": 1,
+    "Algo satisfecho (a)": 2,
+    "Satisfecho (a)": 3,
+    "Muy satisfecho (a)": 4,
+    "Extremadamente satisfecho (a)": 5,
+}
+
+
+# -----------------------------------------------------------------------------
+# Acumuladores combinables entre chunks
+# -----------------------------------------------------------------------------
+class _NaN:
+    """Llave única para los nulos en los conteos (NaN != NaN)."""
+
+    def __repr__(self) -> str:
+        return "NaN"
+
+
+NA_KEY = _NaN()
+
+
+class ValueCounts:
+    """value_counts(dropna=False) combinable; recuerda el orden de primera aparición."""
+
+    def __init__(self):
+        self.counts: Dict[Any, int] = {}
+
+    def update(self, serie: pd.Series) -> None:
+        vc = serie.value_counts(dropna=False, sort=False)
+        for valor, conteo in vc.items():
+            k = NA_KEY if pd.isna(valor) else valor
+            self.counts[k] = self.counts.get(k, 0) + int(conteo)
+
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+    def by_count(self) -> List[tuple]:
+        """Orden de value_counts(): conteo desc, empates por primera aparición."""
+        return sorted(self.counts.items(), key=lambda kv: -kv[1])
+
+    def by_value(self) -> List[tuple]:
+        """Orden de sort_index(): valores ascendentes, nulos al final."""
+        validos = [(k, v) for k, v in self.counts.items() if k is not NA_KEY]
+        try:
+            validos.sort(key=lambda kv: kv[0])
+        except TypeError:
+            validos.sort(key=lambda kv: str(kv[0]))
+        if NA_KEY in self.counts:
+            validos.append((NA_KEY, self.counts[NA_KEY]))
+        return validos
+
+
+class QuantileSketch:
+    """
+    Sketch de cuantiles combinable: mapa valor -> peso.
+
+    Mientras la cantidad de valores distintos no supere `max_centroids`
+    (siempre en escalas Likert/años) es exacto y reproduce la interpolación
+    lineal de pandas. Por encima, reagrupa los valores en centroides de igual
+    peso, acotando la memoria a costa de una aproximación.
+    """
+
+    def __init__(self, max_centroids: int = SKETCH_MAX_CENTROIDS):
+        self.max_centroids = max_centroids
+        self.weights: Dict[float, int] = {}
+        self.exact = True
+
+    def update(self, valores: np.ndarray) -> None:
+        vals, cnts = np.unique(valores, return_counts=True)
+        for v, c in zip(vals.tolist(), cnts.tolist()):
+            self.weights[v] = self.weights.get(v, 0) + c
+        if len(self.weights) > self.max_centroids:
+            self._compress()
+
+    def _compress(self) -> None:
+        """Reagrupa en max_centroids/2 centroides de igual peso (conserva los rangos)."""
+        self.exact = False
+        keys = np.array(sorted(self.weights), dtype=float)
+        w = np.array([self.weights[k] for k in keys], dtype=float)
+        k = max(self.max_centroids // 2, 1)
+        antes = np.cumsum(w) - w
+        grupo = np.minimum((antes * k / w.sum()).astype(int), k - 1)
+        peso = np.bincount(grupo, weights=w, minlength=k)
+        suma = np.bincount(grupo, weights=w * keys, minlength=k)
+        usados = peso > 0
+        self.weights = {float(c): int(p) for c, p in zip(suma[usados] / peso[usados], peso[usados])}
+
+    def quantile(self, q: float) -> float:
+        if not self.weights:
+            return math.nan
+        keys = sorted(self.weights)
+        cum = np.cumsum([self.weights[k] for k in keys])
+        n = int(cum[-1])
+        h = (n - 1) * q
+        lo = int(math.floor(h))
+        hi = min(lo + 1, n - 1)
+        v_lo = keys[int(np.searchsorted(cum, lo, side="right"))]
+        v_hi = keys[int(np.searchsorted(cum, hi, side="right"))]
+        return float(v_lo + (h - lo) * (v_hi - v_lo))
+
+
+class NumericStats:
+    """count/sum/media/varianza (Chan) /min/max + sketch de cuantiles."""
+
+    def __init__(self, umbrales: Dict[str, Any] | None = None):
+        self.umbrales = umbrales or {}
+        self.conteos = {k: 0 for k in self.umbrales}
+        self.n = 0
+        self.total = 0.0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.sketch = QuantileSketch()
+
+    def update(self, valores: np.ndarray) -> None:
+        valores = valores[~np.isnan(valores)]
+        if valores.size == 0:
+            return
+        nb = valores.size
+        mb = float(valores.mean())
+        m2b = float(((valores - mb) ** 2).sum())
+        delta = mb - self.mean
+        tot = self.n + nb
+        self.mean += delta * nb / tot
+        self.m2 += m2b + delta * delta * self.n * nb / tot
+        self.n = tot
+        self.total += float(valores.sum())
+        self.min = min(self.min, float(valores.min()))
+        self.max = max(self.max, float(valores.max()))
+        self.sketch.update(valores)
+        for k, pred in self.umbrales.items():
+            self.conteos[k] += int(pred(valores).sum())
+
+    def std(self) -> float:
+        return math.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else math.nan
+
+
+# -----------------------------------------------------------------------------
+# Lectura por chunks con cursor del lado del servidor
+# -----------------------------------------------------------------------------
+def iter_core_chunks(dataset_name: str, poblacion: Dict[str, Any], columnas: List[str] | None = None,
+                     chunk_rows: int = STREAM_CHUNK_ROWS,
+                     core_schema: str | None = None) -> Iterator[pd.DataFrame]:
+    """
+    Itera core.<dataset> filtrado (WHERE compilado desde la población) en
+    chunks de `chunk_rows` filas usando un cursor con nombre del servidor
+    (stream_results/yield_per), así la memoria no depende del tamaño de la tabla.
+    """
+    schema = core_schema or os.getenv("CORE_SCHEMA", "core")
+    engine = make_engine()
+    with engine.connect() as conn:
+        tipos = postgres_column_types(conn, schema, dataset_name)
+        compiler = FilterCompiler(tipos)
+        where = compiler.compile(poblacion, set(tipos))
+
+        cols = [c for c in (columnas or list(tipos)) if c in tipos]
+        select = ", ".join(_quote(c) for c in cols) if cols else "1 AS _"
+        sql = text(f'SELECT {select} FROM "{schema}"."{dataset_name}" WHERE {where}')
+
+        stream = conn.execution_options(stream_results=True, yield_per=chunk_rows)
+        vacio = True
+        for chunk in pd.read_sql_query(sql, stream, params=compiler.params, chunksize=chunk_rows):
+            vacio = False
+            yield chunk
+        if vacio:
+            yield pd.DataFrame(columns=cols)
+
+
+def should_stream(poblacion: Dict[str, Any]) -> bool:
+    """
+    Usa el ejecutor por chunks si se pide explícitamente (poblacion["modo"] ==
+    "streaming") o si la tabla supera ANALYTICS_STREAMING_MIN_ROWS filas
+    según las estadísticas del planner (pg_class.reltuples, sin escanear).
+    """
+    modo = poblacion.get("modo")
+    if modo in ("streaming", "memoria"):
+        return modo == "streaming"
+    if STREAMING_MIN_ROWS <= 0:
+        return False
+    schema = os.getenv("CORE_SCHEMA", "core")
+    try:
+        with make_engine().connect() as conn:
+            filas = conn.execute(
+                text("SELECT reltuples FROM pg_class WHERE oid = to_regclass(:fq)"),
+                {"fq": f'"{schema}"."{poblacion.get("dataset")}"'},
+            ).scalar()
+    except Exception as e:
+        logger.warning(f"No se pudo estimar el tamaño de {poblacion.get('dataset')}: {e}")
+        return False
+    return bool(filas and filas >= STREAMING_MIN_ROWS)
+
+
+# -----------------------------------------------------------------------------
+# Analíticas por chunks (mismo formato de salida que la ruta en memoria)
+# -----------------------------------------------------------------------------
+def _composition_rows(vc: ValueCounts, label_key: str, na_label: str,
+                      top: int | None = None) -> List[Dict[str, Any]]:
+    """Como iterar value_counts(dropna=False)[.head(top)]: porcentaje sobre las filas mostradas."""
+    filas_vc = vc.by_count()[:top]
+    total = sum(c for _, c in filas_vc)
+    filas = []
+    for valor, conteo in filas_vc:
+        nombre = na_label if valor is NA_KEY else str(valor)
+        porcentaje = (conteo * 100.0 / total) if total else 0.0
+        filas.append({label_key: nombre, "total": int(conteo), "porcentaje": round(porcentaje, 1)})
+    return filas
+
+
+def _distribution(vc: ValueCounts) -> Dict[str, int]:
+    return {("NA" if k is NA_KEY else str(k)): int(v) for k, v in vc.by_value()}
+
+
+def _counts_intervals(num: NumericStats, ic: Dict[str, Any],
+                      detractor_max: float, promotor_min: float,
+                      media_key: str, con_nps: bool) -> Dict[str, Any]:
+    """IC bootstrap desde el sketch (solo si es exacto: frecuencias reales por valor)."""
+    if not num.sketch.exact:
+        return {}
+    valores = np.array(list(num.sketch.weights), dtype=float)
+    pesos = np.array(list(num.sketch.weights.values()), dtype=np.int64)
+    out = {media_key: bootstrap_mean_ci_counts(valores, pesos, **ic)}
+    if con_nps:
+        out["nps_ic"] = bootstrap_mean_ci_counts(nps_scores(valores, detractor_max, promotor_min),
+                                                 pesos, **ic)
+    return out
+
+
+def generate_general_summary_streaming(poblacion: Dict[str, Any],
+                                       distribuciones: List[str],
+                                       opciones: Dict[str, Any] | None = None) -> Dict[str, Any]:
+    """Equivalente a generate_general_summary combinando agregados parciales por chunk."""
+    dataset_name = poblacion.get("dataset")
+    if not dataset_name:
+        raise ValueError("La población no contiene el campo 'dataset'.")
+
+    columnas = list(dict.fromkeys([SAT_COL, POSGRADO_COL, "programa", *distribuciones]))
+    n = 0
+    presentes: set[str] = set()
+    sat = NumericStats({"detractores": lambda v: v <= 2, "promotores": lambda v: v >= 4})
+    conteos: Dict[str, ValueCounts] = {c: ValueCounts() for c in columnas}
+
+    for chunk in iter_core_chunks(dataset_name, poblacion, columnas):
+        n += len(chunk)
+        presentes.update(chunk.columns)
+        if SAT_COL in chunk.columns:
+            vals = chunk[SAT_COL].dropna().map(SATISFACTION_MAPPING)
+            sat.update(pd.to_numeric(vals, errors="coerce").to_numpy(dtype=float))
+        for c in chunk.columns:
+            conteos[c].update(chunk[c])
+
+    if "n" not in poblacion:
+        poblacion["n"] = n
+
+    kpis: Dict[str, Any] = {"total_registros": n}
+    if SAT_COL in presentes and sat.n:
+        kpis["satisfaccion_media"] = float(sat.total / sat.n)
+        kpis["nps"] = float((sat.conteos["promotores"] - sat.conteos["detractores"]) * 100.0 / sat.n)
+        ic = interval_options(opciones)
+        if ic:
+            kpis.update(_counts_intervals(sat, ic, 2, 4, "satisfaccion_media_ic", True))
+
+    tablas: Dict[str, Any] = {}
+    if POSGRADO_COL in presentes:
+        tablas["posgrados"] = _composition_rows(conteos[POSGRADO_COL], "posgrado", "Sin especificar")
+    if "programa" in presentes:
+        tablas["programas"] = _composition_rows(conteos["programa"], "programa", "Sin especificar")
+
+    distribuciones_resultado = {v: _distribution(conteos[v]) for v in distribuciones if v in presentes}
+    return {"kpis": kpis, "tablas": tablas, "distribuciones": distribuciones_resultado}
+
+
+_UMBRALES_NPS = {
+    "detractores": lambda v: v <= 6,
+    "promotores": lambda v: v >= 9,
+    "no_enteros": lambda v: v != np.floor(v),
+}
+
+
+def generate_question_detail_streaming(poblacion: Dict[str, Any],
+                                       distribuciones: List[str],
+                                       opciones: Dict[str, Any] | None = None) -> Dict[str, Any]:
+    """Equivalente a generate_question_detail combinando agregados parciales por chunk."""
+    if not distribuciones:
+        raise ValueError(
+            "Para 'detalle_pregunta' se requiere al menos una variable en 'distribuciones'."
+        )
+    dataset_name = poblacion.get("dataset")
+    if not dataset_name:
+        raise ValueError("La población no contiene el campo 'dataset'.")
+
+    n_total = 0
+    presentes: set[str] = set()
+    conteos = {v: ValueCounts() for v in distribuciones}
+    numericos = {v: NumericStats(_UMBRALES_NPS) for v in distribuciones}
+
+    for chunk in iter_core_chunks(dataset_name, poblacion, list(distribuciones)):
+        n_total += len(chunk)
+        presentes.update(chunk.columns)
+        for v in chunk.columns:
+            conteos[v].update(chunk[v])
+            numericos[v].update(pd.to_numeric(chunk[v], errors="coerce").to_numpy(dtype=float))
+
+    if "n" not in poblacion:
+        poblacion["n"] = n_total
+
+    ic = interval_options(opciones)
+    all_kpis: Dict[str, Any] = {}
+    all_tablas: Dict[str, Any] = {}
+    distribuciones_resultado: Dict[str, Any] = {}
+    for variable in distribuciones:
+        if variable not in presentes:
+            continue
+        num, vc = numericos[variable], conteos[variable]
+        es_numerica = num.n > 0
+        n_validos = num.n if es_numerica else vc.total() - vc.counts.get(NA_KEY, 0)
+        kpis: Dict[str, Any] = {
+            "variable": variable,
+            "n_total_poblacion": n_total,
+            "n_respuestas_validas": n_validos,
+            "porcentaje_respuesta": float(n_validos * 100.0 / n_total) if n_total else 0.0,
+            "es_numerica": bool(es_numerica),
+        }
+        if es_numerica:
+            kpis["media"] = float(num.total / num.n)
+            kpis["mediana"] = num.sketch.quantile(0.5)
+            kpis["desviacion_estandar"] = float(num.std())
+            kpis["min"] = float(num.min)
+            kpis["max"] = float(num.max)
+            all_tablas[f"{variable}_cuartiles"] = [
+                {"percentil": p, "valor": num.sketch.quantile(p / 100)} for p in (25, 50, 75)
+            ]
+            if num.conteos["no_enteros"] == 0 and num.max - num.min <= LIKERT_MAX_SPAN:
+                # escala entera acotada: el sketch es exacto (pocos valores distintos)
+                top = sum(w for v, w in num.sketch.weights.items() if v >= num.max - 1)
+                kpis["top_2_box"] = float(top * 100.0 / num.n)
+            if 0 <= num.min <= 1 and num.max <= 10:
+                kpis["nps"] = float(
+                    (num.conteos["promotores"] - num.conteos["detractores"]) * 100.0 / num.n
+                )
+            if ic:
+                kpis.update(_counts_intervals(num, ic, 6, 9, "media_ic", "nps" in kpis))
+            if not num.sketch.exact:
+                kpis["cuantiles_aproximados"] = True
+        else:
+            all_tablas[f"{variable}_top_categorias"] = _composition_rows(
+                vc, "categoria", "Sin respuesta", top=10
+            )
+
+        all_kpis[variable] = kpis
+        distribuciones_resultado[variable] = _distribution(vc)
+
+    return {"kpis": all_kpis, "tablas": all_tablas, "distribuciones": distribuciones_resultado}
@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator
+import logging
+import os
+import threading
+import time
+
+from etl.db import make_engine
+from etl.watermarks import read_watermark
+
+logger = logging.getLogger(__name__)
+
+# Cuánto se reutiliza la marca leída antes de volver a consultarla.
+# Las cargas hechas desde este mismo proceso invalidan de inmediato.
+WATERMARK_TTL_S = float(os.getenv("WATERMARK_TTL_S", "2"))
+
+_CACHE: Dict[str, tuple[float, int]] = {}
+_LOCK = threading.Lock()
+
+# Marca fijada por quien armó la llave de la cache de resultados (la API):
+# dentro de un trabajo del pool todos los caches usan esa misma marca
+_PINNED: ContextVar[Dict[str, int] | None] = ContextVar("watermark_pinned", default=None)
+
+
+@contextmanager
+def pinned_watermark(dataset: str | None, watermark: int | None) -> Iterator[None]:
+    """
+    Dentro del bloque, current_watermark(dataset) devuelve `watermark` sin
+    consultar la BD. Los workers no reciben los eventos de invalidación, así
+    que sin esto podrían ver la marca anterior (hasta WATERMARK_TTL_S) y
+    guardar datos viejos bajo la llave nueva. Con `watermark` None no fija nada.
+    """
+    if dataset is None or watermark is None:
+        yield
+        return
+    token = _PINNED.set({**(_PINNED.get() or {}), dataset: watermark})
+    try:
+        yield
+    finally:
+        _PINNED.reset(token)
+
+
+def current_watermark(dataset: str) -> int | None:
+    """
+    Marca de agua vigente del dataset (0 si nunca se registró una carga).
+    Devuelve None si no se pudo consultar: en ese caso no se debe cachear.
+    Dentro de pinned_watermark devuelve la marca fijada.
+    """
+    fijadas = _PINNED.get()
+    if fijadas and dataset in fijadas:
+        return fijadas[dataset]
+    now = time.monotonic()
+    with _LOCK:
+        hit = _CACHE.get(dataset)
+        if hit and now - hit[0] < WATERMARK_TTL_S:
+            return hit[1]
+    try:
+        with make_engine().connect() as conn:
+            wm = read_watermark(conn, dataset, schema=os.getenv("ETL_SCHEMA", "etl"))
+    except Exception as e:
+        logger.warning(f"No se pudo leer la marca de agua de {dataset}: {e}")
+        return None
+    with _LOCK:
+        _CACHE[dataset] = (now, wm)
+    return wm
+
+
+def invalidate_watermark(dataset: str | None = None) -> None:
+    with _LOCK:
+        if dataset is None:
+            _CACHE.clear()
+        else:
+            _CACHE.pop(dataset, None)
@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Any, Dict, Tuple
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from analytics.canonical import filter_signature
+from analytics.watermark import current_watermark
+
+logger = logging.getLogger(__name__)
+
+RAKING_MAX_ITER = int(os.getenv("RAKING_MAX_ITER", "100"))
+RAKING_TOL = float(os.getenv("RAKING_TOL", "1e-6"))
+# Tope del peso individual (múltiplo del peso medio); 0 = sin recorte
+RAKING_MAX_WEIGHT = float(os.getenv("RAKING_MAX_WEIGHT", "0"))
+WEIGHTS_CACHE_MAX = int(os.getenv("WEIGHTS_CACHE_MAX", "64"))
+
+# (firma de población, spec de márgenes, watermark) -> (pesos, diagnóstico)
+_WEIGHTS: "OrderedDict[tuple, Tuple[pd.Series, Dict[str, Any]]]" = OrderedDict()
+_WEIGHTS_LOCK = threading.Lock()
+
+
+def rake(df: pd.DataFrame, margenes: Dict[str, Dict[str, float]],
+         max_iter: int = RAKING_MAX_ITER, tol: float = RAKING_TOL,
+         max_peso: float = RAKING_MAX_WEIGHT) -> Tuple[np.ndarray, Dict[str, Any]]:
+    """
+    Raking (ajuste proporcional iterativo, IPF) de pesos a márgenes conocidos.
+
+    `margenes` = {columna: {valor: proporción o conteo}}; los valores se
+    comparan como texto. Cada columna se codifica una vez a enteros
+    (pd.factorize) y cada paso del IPF es un np.bincount ponderado más un
+    reescalado indexado por código: sin loops por fila.
+
+    Las filas con un valor fuera del margen (o nulo) no se ajustan en esa
+    dimensión. Devuelve pesos con media 1 y un diagnóstico.
+    """
+    n = len(df)
+    w = np.ones(n, dtype=float)
+    dims = []
+    for col, objetivos in margenes.items():
+        if col not in df.columns:
+            raise ValueError(f"Columna de ponderación inexistente: '{col}'")
+        if not objetivos:
+            continue
+        codes, uniques = pd.factorize(df[col].astype("string"), use_na_sentinel=True)
+        claves = [str(k) for k in objetivos]
+        proporciones = np.array([float(v) for v in objetivos.values()], dtype=float)
+        if (proporciones < 0).any() or proporciones.sum() <= 0:
+            raise ValueError(f"Márgenes inválidos para '{col}'")
+        proporciones /= proporciones.sum()
+
+        # código de la columna -> posición en el margen (-1 si no está)
+        posicion = {k: i for i, k in enumerate(claves)}
+        mapa = np.array([posicion.get(str(u), -1) for u in uniques], dtype=np.int64)
+        celda = np.where(codes >= 0, mapa[np.maximum(codes, 0)], -1)
+        en_margen = celda >= 0
+        if not en_margen.any():
+            raise ValueError(f"Ningún valor de '{col}' coincide con sus márgenes")
+        vacias = [claves[i] for i in range(len(claves))
+                  if not np.any(celda == i) and proporciones[i] > 0]
+        if vacias:
+            raise ValueError(f"Celdas sin respondentes en '{col}': {vacias}")
+        dims.append((col, celda, en_margen, proporciones))
+
+    iteraciones, error = 0, 0.0
+    for iteraciones in range(1, max_iter + 1):
+        error = 0.0
+        for _, celda, en_margen, proporciones in dims:
+            k = len(proporciones)
+            actual = np.bincount(celda[en_margen], weights=w[en_margen], minlength=k)
+            objetivo = proporciones * actual.sum()
+            factor = np.divide(objetivo, actual, out=np.ones(k), where=actual > 0)
+            w[en_margen] *= factor[celda[en_margen]]
+            error = max(error, float(np.abs(actual - objetivo).max() / actual.sum()))
+        if max_peso > 0:
+            np.minimum(w, max_peso * w.mean(), out=w)
+        if error < tol:
+            break
+
+    if n:
+        w *= n / w.sum()
+    diagnostico = {
+        "margenes": list(margenes),
+        "iteraciones": iteraciones,
+        "convergio": error < tol,
+        "error_maximo": error,
+        # efecto de diseño de Kish: pérdida de precisión por ponderar
+        "efecto_diseno": float(n * (w ** 2).sum() / w.sum() ** 2) if n else None,
+        "peso_min": float(w.min()) if n else None,
+        "peso_max": float(w.max()) if n else None,
+    }
+    return w, diagnostico
+
+
+def weighting_spec(opciones: Dict[str, Any] | None) -> Dict[str, Any] | None:
+    """opciones["ponderacion"] = {"margenes": {...}, "max_iter"?, "tol"?, "max_peso"?}."""
+    spec = (opciones or {}).get("ponderacion")
+    if not spec:
+        return None
+    if not isinstance(spec, dict) or not isinstance(spec.get("margenes"), dict):
+        raise ValueError("'ponderacion' requiere 'margenes': {columna: {valor: proporción}}")
+    return spec
+
+
+def population_weights(df: pd.DataFrame, poblacion: Dict[str, Any],
+                       opciones: Dict[str, Any] | None) -> Tuple[pd.Series | None, Dict[str, Any] | None]:
+    """
+    Pesos de raking para la población filtrada `df`, o (None, None) si el
+    request no pide ponderación.
+
+    Se cachean por (firma de población — incluye programa y versión —,
+    spec de márgenes, watermark del dataset); sin watermark no se cachea.
+    """
+    spec = weighting_spec(opciones)
+    if spec is None:
+        return None, None
+
+    watermark = current_watermark(poblacion.get("dataset"))
+    key = (
+        filter_signature(poblacion),
+        json.dumps(spec, sort_keys=True, ensure_ascii=False, default=str),
+        watermark,
+    )
+    if watermark is not None:
+        with _WEIGHTS_LOCK:
+            hit = _WEIGHTS.get(key)
+            if hit is not None and hit[0].index.equals(df.index):
+                _WEIGHTS.move_to_end(key)
+                return hit
+
+    w, diagnostico = rake(
+        df,
+        spec["margenes"],
+        max_iter=int(spec.get("max_iter", RAKING_MAX_ITER)),
+        tol=float(spec.get("tol", RAKING_TOL)),
+        max_peso=float(spec.get("max_peso", RAKING_MAX_WEIGHT)),
+    )
+    if not diagnostico["convergio"]:
+        logger.warning(f"Raking sin converger para {poblacion.get('dataset')}: {diagnostico}")
+    resultado = (pd.Series(w, index=df.index), diagnostico)
+
+    if watermark is not None:
+        with _WEIGHTS_LOCK:
+            _WEIGHTS[key] = resultado
+            while len(_WEIGHTS) > WEIGHTS_CACHE_MAX:
+                _WEIGHTS.popitem(last=False)
+    return resultado
+
+
+def weighted_counts(serie: pd.Series, pesos: pd.Series | None = None) -> pd.DataFrame:
+    """
+    Conteos por valor (incluye nulos) con su total ponderado, en el orden de
+    value_counts(dropna=False) según el total ponderado.
+    Columnas: valor, total, ponderado.
+    """
+    codes, uniques = pd.factorize(serie, use_na_sentinel=False)
+    k = len(uniques)
+    conteo = np.bincount(codes, minlength=k)
+    ponderado = (
+        np.bincount(codes, weights=pesos.to_numpy(dtype=float), minlength=k)
+        if pesos is not None else conteo.astype(float)
+    )
+    orden = np.argsort(-ponderado, kind="stable")
+    return pd.DataFrame({
+        "valor": np.asarray(uniques, dtype=object)[orden],
+        "total": conteo[orden],
+        "ponderado": ponderado[orden],
+    })
+
+
+def weighted_mean(valores: pd.Series, pesos: pd.Series | None = None) -> float:
+    """Media (ponderada si hay pesos) de los valores no nulos."""
+    v = pd.to_numeric(valores, errors="coerce")
+    validos = v.notna().to_numpy()
+    if not validos.any():
+        return float("nan")
+    if pesos is None:
+        return float(v.mean())
+    return float(np.average(v.to_numpy(dtype=float)[validos], weights=pesos.to_numpy(dtype=float)[validos]))
+
+
+def weighted_composition(serie: pd.Series, label_key: str, na_label: str, pesos: pd.Series,
+                         top_n: int | None = None) -> list:
+    """
+    Tabla de composición ponderada: mismas filas que la versión sin pesos más
+    'total_ponderado'; 'porcentaje' pasa a ser el porcentaje ponderado.
+    """
+    conteos = weighted_counts(serie, pesos)
+    if top_n is not None:
+        conteos = conteos.head(top_n)
+    total = conteos["ponderado"].sum()
+    filas = []
+    for valor, bruto, ponderado in conteos.itertuples(index=False):
+        filas.append({
+            label_key: na_label if pd.isna(valor) else str(valor),
+            "total": int(bruto),
+            "total_ponderado": round(float(ponderado), 2),
+            "porcentaje": round(float(ponderado * 100.0 / total) if total else 0.0, 1),
+        })
+    return filas
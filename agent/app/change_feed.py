@@ -0,0 +1,120 @@
+# app/change_feed.py
+from __future__ import annotations
+
+from typing import Any, Callable, Dict
+import json
+import logging
+import os
+import select
+import threading
+
+from etl.db import make_engine
+from etl.events import CHANGE_CHANNEL
+
+logger = logging.getLogger(__name__)
+
+# Listener de LISTEN etl_dataset_changed en cada proceso de la API
+CHANGE_FEED = os.getenv("ETL_CHANGE_FEED", "true").lower() == "true"
+CHANGE_FEED_POLL_S = float(os.getenv("ETL_CHANGE_FEED_POLL_S", "30"))
+CHANGE_FEED_RECONNECT_MAX_S = float(os.getenv("ETL_CHANGE_FEED_RECONNECT_MAX_S", "30"))
+
+# Payload de "resincronización": tras reconectar se pudieron perder avisos
+RESYNC = {"dataset": None, "programa": None, "version": None, "watermark": None}
+
+
+class ChangeFeedListener:
+    """
+    Hilo de fondo con una conexión dedicada en LISTEN al canal de cambios del ETL.
+
+    Cada notificación (payload JSON {dataset, programa, version, watermark})
+    se entrega a `dispatch`. Si la conexión se cae se reconecta con backoff
+    exponencial; al reconectar se despacha RESYNC (dataset None = invalidar
+    todo), porque los NOTIFY emitidos mientras no escuchaba se perdieron.
+    Sin avisos, cada CHANGE_FEED_POLL_S se hace un SELECT 1 para detectar
+    conexiones muertas.
+    """
+
+    def __init__(self, dispatch: Callable[[Dict[str, Any]], None], channel: str = CHANGE_CHANNEL,
+                 dsn: str | None = None):
+        self.dispatch = dispatch
+        self.channel = channel
+        self.dsn = dsn
+        self.connected = False
+        self.stats = {"notificaciones": 0, "reconexiones": 0, "errores": 0}
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def _connect(self):
+        import psycopg2
+        import psycopg2.extensions
+
+        url = make_engine(self.dsn).url.set(drivername="postgresql")
+        conn = psycopg2.connect(url.render_as_string(hide_password=False))
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cur:
+            cur.execute(f'LISTEN "{self.channel}"')
+        return conn
+
+    def _deliver(self, payload: Dict[str, Any]) -> None:
+        try:
+            self.dispatch(payload)
+        except Exception:
+            logger.exception(f"Falló el despacho del aviso {payload}")
+
+    def _listen(self, conn) -> None:
+        while not self._stop.is_set():
+            listos, _, _ = select.select([conn], [], [], CHANGE_FEED_POLL_S)
+            if not listos:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                continue
+            conn.poll()
+            while conn.notifies:
+                aviso = conn.notifies.pop(0)
+                try:
+                    payload = json.loads(aviso.payload)
+                except ValueError:
+                    logger.warning(f"Aviso con payload inválido en {self.channel}: {aviso.payload!r}")
+                    continue
+                self.stats["notificaciones"] += 1
+                self._deliver(payload)
+
+    def _run(self) -> None:
+        espera = 1.0
+        primera = True
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = self._connect()
+                self.connected = True
+                espera = 1.0
+                if not primera:
+                    self.stats["reconexiones"] += 1
+                    logger.info(f"Listener de {self.channel} reconectado; invalidando todo")
+                    self._deliver(dict(RESYNC))
+                primera = False
+                self._listen(conn)
+            except Exception as e:
+                self.stats["errores"] += 1
+                logger.warning(f"Listener de {self.channel} desconectado: {e}; reintento en {espera:.0f}s")
+            finally:
+                self.connected = False
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            self._stop.wait(espera)
+            espera = min(espera * 2, CHANGE_FEED_RECONNECT_MAX_S)
+
+    def start(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name=f"listen-{self.channel}", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"canal": self.channel, "conectado": self.connected, **self.stats}
@@ -0,0 +1,191 @@
+# app/executor.py
+from __future__ import annotations
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable
+
+from .metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_WORKERS = int(os.getenv("ANALYTICS_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+ANALYTICS_QUEUE_MAX = int(os.getenv("ANALYTICS_QUEUE_MAX", "16"))
+ANALYTICS_TIMEOUT_S = float(os.getenv("ANALYTICS_TIMEOUT_S", "60"))
+ANALYTICS_RETRY_AFTER_S = int(os.getenv("ANALYTICS_RETRY_AFTER_S", "2"))
+ANALYTICS_START_METHOD = os.getenv("ANALYTICS_START_METHOD", "spawn")
+
+QUEUE_DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64)
+
+# Valor en la tabla de trabajos de uno que venció antes de que un worker lo tomara
+CANCELADO = -1
+
+
+class PoolSaturated(Exception):
+    """No hay cupo en el pool ni en la cola: el cliente debe reintentar."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Pool de analíticas saturado, reintente en {retry_after}s")
+        self.retry_after = retry_after
+
+
+class JobTimeout(Exception):
+    """El trabajo superó el tiempo máximo y fue cancelado."""
+
+
+def _timed_call(jobs, job: int, fn: Callable[..., Any], args: tuple, kwargs: dict) -> tuple[Any, float]:
+    # Corre dentro del proceso worker: registra su PID en la tabla de trabajos
+    # (para que un timeout termine solo este proceso) y mide solo la ejecución
+    pid = os.getpid()
+    if jobs.setdefault(job, pid) != pid:
+        jobs.pop(job, None)
+        return None, 0.0  # venció en la cola: nadie espera el resultado
+    t0 = time.perf_counter()
+    try:
+        result = fn(*args, **kwargs)
+    finally:
+        jobs.pop(job, None)
+    return result, time.perf_counter() - t0
+
+
+class AnalyticsPool:
+    """
+    Pool de procesos para las analíticas pesadas (pandas) fuera del proceso
+    de uvicorn, con control de admisión:
+
+      - como máximo `workers` trabajos corriendo y `queue_max` esperando;
+        por encima de eso `submit` lanza PoolSaturated (-> 429 + Retry-After)
+      - cada trabajo tiene un timeout; si vence y el trabajo ya estaba
+        corriendo, se termina solo el worker que lo corre (su PID queda en
+        una tabla compartida {trabajo: pid}) y el pool lo reemplaza; los
+        trabajos de los demás workers siguen. Si aún estaba en la cola se
+        marca CANCELADO y el worker que lo tome lo descarta.
+
+    Usa multiprocessing.Pool y no ProcessPoolExecutor: este último da por
+    roto todo el pool (y falla todos sus trabajos) cuando muere un worker.
+    """
+
+    def __init__(self, workers: int = ANALYTICS_WORKERS, queue_max: int = ANALYTICS_QUEUE_MAX,
+                 timeout_s: float = ANALYTICS_TIMEOUT_S):
+        self.workers = workers
+        self.queue_max = queue_max
+        self.timeout_s = timeout_s
+        self._pool = None
+        self._manager = None
+        self._jobs = None  # {trabajo: pid del worker | CANCELADO}, en el manager
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._inflight = 0
+
+    # ------------------------------------------------------------------
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                ctx = multiprocessing.get_context(ANALYTICS_START_METHOD)
+                self._manager = ctx.Manager()
+                self._jobs = self._manager.dict()
+                self._pool = ctx.Pool(processes=self.workers)
+            return self._pool, self._jobs
+
+    def _cancel(self, jobs, job: int) -> None:
+        """
+        Cancela un trabajo vencido. El setdefault es atómico en el manager:
+        o el trabajo no empezó (queda CANCELADO) o se obtiene el PID del
+        worker que lo corre, y se termina solo ese proceso.
+        """
+        pid = jobs.setdefault(job, CANCELADO)
+        if pid == CANCELADO:
+            return
+        jobs.pop(job, None)
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            # el worker ya no existía (OOM, señal externa)
+            raise BrokenProcessPool(f"El worker {pid} murió durante la analítica") from None
+        logger.warning(f"Trabajo de analítica excedió el timeout en ejecución; worker {pid} terminado")
+        METRICS.inc("analytics_worker_terminado")
+
+    def _admit(self) -> int:
+        with self._lock:
+            if self._inflight >= self.workers + self.queue_max:
+                METRICS.inc("analytics_rechazadas")
+                raise PoolSaturated(ANALYTICS_RETRY_AFTER_S)
+            self._inflight += 1
+            depth = max(0, self._inflight - self.workers)
+        METRICS.set_gauge("analytics_en_curso", self._inflight)
+        METRICS.set_gauge("analytics_cola", depth)
+        METRICS.observe("analytics_cola_al_admitir", depth, QUEUE_DEPTH_BUCKETS)
+        return depth
+
+    def _release(self) -> None:
+        with self._lock:
+            self._inflight -= 1
+            depth = max(0, self._inflight - self.workers)
+        METRICS.set_gauge("analytics_en_curso", self._inflight)
+        METRICS.set_gauge("analytics_cola", depth)
+
+    # ------------------------------------------------------------------
+    async def submit(self, fn: Callable[..., Any], *args: Any, timeout_s: float | None = None,
+                     **kwargs: Any) -> Any:
+        """Ejecuta fn(*args, **kwargs) en el pool y espera su resultado."""
+        self._admit()
+        t0 = time.perf_counter()
+        job = next(self._ids)
+        try:
+            pool, jobs = self._get_pool()
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+
+            def _deliver(setter, value):
+                if not future.done():
+                    setter(value)
+
+            # los callbacks corren en el hilo de resultados del pool
+            pool.apply_async(
+                _timed_call, (jobs, job, fn, args, kwargs),
+                callback=lambda r: loop.call_soon_threadsafe(_deliver, future.set_result, r),
+                error_callback=lambda e: loop.call_soon_threadsafe(_deliver, future.set_exception, e),
+            )
+            try:
+                result, exec_s = await asyncio.wait_for(future, timeout=timeout_s or self.timeout_s)
+            except asyncio.TimeoutError:
+                METRICS.inc("analytics_timeouts")
+                self._cancel(jobs, job)
+                raise JobTimeout(f"La analítica excedió {timeout_s or self.timeout_s}s")
+        finally:
+            self._release()
+
+        total_s = time.perf_counter() - t0
+        METRICS.inc("analytics_completadas")
+        METRICS.observe("analytics_ejecucion_s", exec_s)
+        METRICS.observe("analytics_espera_s", max(0.0, total_s - exec_s))
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            inflight = self._inflight
+        return {
+            "workers": self.workers,
+            "queue_max": self.queue_max,
+            "timeout_s": self.timeout_s,
+            "en_curso": inflight,
+            "cola": max(0, inflight - self.workers),
+        }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+            manager, self._manager, self._jobs = self._manager, None, None
+        if pool is not None:
+            pool.terminate()
+        if manager is not None:
+            manager.shutdown()
+
+
+ANALYTICS_POOL = AnalyticsPool()
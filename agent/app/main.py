@@ -1,20 +1,34 @@
 from __future__ import annotations
-from typing import Any, Dict, Optional, Literal
+from typing import Any, Dict, List, Optional, Literal
 from pydantic import BaseModel, Field
 import os
-import re
-import shutil
 from pathlib import Path
 from typing import Optional
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Query
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Query, Request
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy import text
 from agente import agente as run_llm_agent 
-from carga import cargar_archivo                     # módulo de carga genérico
+from carga import cargar_archivo, cargar_lote, ObjetoCarga  # módulo de carga genérico
 from etl.db import make_engine                      # conexión a Postgres
-from .minio_utils import get_minio, pick_object, download_object  # utilidades MinIO
-from analytics.results import generate_results
+from etl.events import DATASET_CHANGED, publish, subscribe
+from etl.sharded_upsert import ShardedUpsertRecovery
+from .minio_utils import (get_minio, pick_object, fetch_object,  # utilidades MinIO
+                          list_dataset_objects, infer_version_from_filename, download_cache_stats)
+from analytics.results import run_analytics_job, run_analytics_batch_job
+from analytics.bootstrap import interval_options
+from .executor import ANALYTICS_POOL, PoolSaturated, JobTimeout
+from .metrics import METRICS
+from .change_feed import CHANGE_FEED, ChangeFeedListener
+from .singleflight import SingleFlight
+from .uploads import MAX_UPLOAD_BYTES, UploadTooLarge, save_upload
+from analytics.cache import RESULT_CACHE
+from analytics.canonical import request_key
+from analytics.arrow_cache import invalidate_arrow_cache
+from analytics.catalog import invalidate_catalog
+from analytics.watermark import current_watermark, invalidate_watermark
 
 # -----------------------------------------------------------------------------
 # Config & App
@@ -33,8 +47,22 @@ app.add_middleware(
 UPLOAD_DIR = Path("/app/uploads")
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
+
+# Rechaza subidas que declaran un Content-Length mayor al máximo antes de
+# que FastAPI lea el cuerpo multipart (margen para encabezados y boundary)
+@app.middleware("http")
+async def limitar_subidas(request: Request, call_next):
+    largo = request.headers.get("content-length")
+    if (request.method == "POST" and request.url.path.startswith("/carga/")
+            and largo and largo.isdigit() and int(largo) > MAX_UPLOAD_BYTES + 64 * 1024):
+        return JSONResponse({"detail": str(UploadTooLarge(MAX_UPLOAD_BYTES))}, status_code=413)
+    return await call_next(request)
+
 MINIO_BUCKET = os.getenv("MINIO_BUCKET", "paaa")
 
+# Requests idénticos concurrentes comparten un solo cálculo
+RESULTADOS_FLIGHT = SingleFlight("resultados")
+
 # Add explicit OPTIONS handler for CORS preflight
 @app.options("/{full_path:path}")
 async def options_handler():
@@ -44,15 +72,24 @@ async def options_handler():
 # -----------------------------------------------------------------------------
 # Helpers
 # -----------------------------------------------------------------------------
-def infer_version_from_filename(name: str) -> str:
+def _invalidate_dataset_caches(dataset: str | None, watermark: int | None = None) -> None:
     """
-    Extrae una 'versión' del nombre si aparece algo tipo:
-      - v2, v2.0, v2025.10.13
-      - 2025-10-13, 20251013, 2025_10_13
-    Si no encuentra nada, retorna 'v1.0'.
+    Tras una carga (de este u otro proceso): descarta caches derivados del
+    dataset; con dataset None, los de todos. El cache Arrow conserva la
+    generación de `watermark`, que ya corresponde a la carga nueva.
     """
-    m = re.search(r'(v\d+(?:\.\d+)*|\d{4}[-_.]?\d{2}[-_.]?\d{2})', name.lower())
-    return m.group(1) if m else "v1.0"
+    invalidate_watermark(dataset)
+    invalidate_catalog(dataset)
+    RESULT_CACHE.invalidate_dataset(dataset)
+    invalidate_arrow_cache(dataset, keep=watermark)
+
+
+# SurveyETL.run emite DATASET_CHANGED en este proceso y el listener trae el
+# NOTIFY de cargas hechas por otros workers: ambos llegan aquí
+subscribe(DATASET_CHANGED, lambda evento: _invalidate_dataset_caches(evento.get("dataset"), evento.get("watermark")))
+CHANGE_LISTENER = ChangeFeedListener(lambda payload: publish(DATASET_CHANGED, payload))
+# Confirma shards de UPSERT repartidos huérfanos y publica su marca de agua
+UPSERT_RECOVERY = ShardedUpsertRecovery()
 
 
 def _normalize_dataset(ds: str) -> str:
@@ -80,6 +117,24 @@ class NarrativaResponse(BaseModel):
 
 
 
+@app.on_event("startup")
+def _start_change_feed():
+    if CHANGE_FEED:
+        CHANGE_LISTENER.start()
+
+
+@app.on_event("startup")
+def _start_upsert_recovery():
+    UPSERT_RECOVERY.start()
+
+
+@app.on_event("shutdown")
+def _shutdown_analytics_pool():
+    CHANGE_LISTENER.stop()
+    UPSERT_RECOVERY.stop()
+    ANALYTICS_POOL.shutdown()
+
+
 # -----------------------------------------------------------------------------
 # Endpoints
 # -----------------------------------------------------------------------------
@@ -88,12 +143,29 @@ def health():
     return {"status": "ok"}
 
 
+@app.get("/metricas")
+def metricas():
+    """
+    Métricas del proceso API: estado del pool de analíticas (en curso / cola),
+    contadores e histogramas de tiempo de ejecución y espera en cola.
+    """
+    return {
+        "pool": ANALYTICS_POOL.stats(),
+        "cache_resultados": RESULT_CACHE.snapshot(),
+        "singleflight_en_vuelo": RESULTADOS_FLIGHT.inflight(),
+        "change_feed": CHANGE_LISTENER.snapshot(),
+        "cache_descargas": download_cache_stats(),
+        **METRICS.snapshot(),
+    }
+
+
 @app.post("/carga/{dataset}")
 async def carga_dataset(
     dataset: str,
     programa: str = Form(..., description="Código del programa, p.ej. ATI, TURISMO"),
     version: str = Form("v1.0"),
     file: UploadFile = File(...),
+    incremental: Optional[bool] = Form(None, description="Solo respuestas nuevas (por defecto ETL_INCREMENTAL)"),
 ):
     """
     Sube un archivo vía HTTP y ejecuta el ETL:
@@ -108,13 +180,18 @@ async def carga_dataset(
 
     local_path = UPLOAD_DIR / f"{programa.lower()}_{ds}_{file.filename}"
     try:
-        with local_path.open("wb") as f:
-            shutil.copyfileobj(file.file, f)
+        tamano, sha256 = await save_upload(file, local_path)
+    except UploadTooLarge as e:
+        raise HTTPException(413, detail=str(e))
     except Exception as e:
         raise HTTPException(500, detail=f"No se pudo guardar el archivo: {e}")
 
     try:
-        result = cargar_archivo(programa=programa, dataset=ds, version=version, file_path=local_path)
+        result = await run_in_threadpool(
+            cargar_archivo, programa=programa, dataset=ds, version=version, file_path=local_path,
+            source_sha256=sha256, incremental=incremental,
+        )
+        result["bytes"] = tamano
         return JSONResponse(result, status_code=201)
     except Exception as e:
         raise HTTPException(400, detail=str(e))
@@ -126,6 +203,7 @@ def carga_desde_minio(
     programa: str = Form(..., description="Código del programa, p.ej. ATI, TURISMO"),
     version: Optional[str] = Form(None, description="Opcional: 'v2.0' o '2025-06-22'"),
     filename: Optional[str] = Form(None, description="Opcional: nombre exacto en MinIO"),
+    incremental: Optional[bool] = Form(None, description="Solo respuestas nuevas (por defecto ETL_INCREMENTAL)"),
 ):
     """
     Descarga un archivo desde MinIO (bucket configurado) y ejecuta el ETL.
@@ -145,22 +223,64 @@ def carga_desde_minio(
     except Exception as e:
         raise HTTPException(400, detail=f"Error listando objetos en MinIO: {e}")
 
-    local_path = UPLOAD_DIR / Path(object_name).name
     try:
-        download_object(client, MINIO_BUCKET, object_name, local_path)
+        # mismo objeto y ETag que una carga anterior: se reutiliza sin transferir
+        local_path, desde_cache = fetch_object(client, MINIO_BUCKET, object_name,
+                                               UPLOAD_DIR / Path(object_name).name)
     except Exception as e:
         raise HTTPException(400, detail=f"No se pudo descargar de MinIO: {e}")
 
     used_version = version or infer_version_from_filename(local_path.name)
 
     try:
-        result = cargar_archivo(programa=programa, dataset=ds, version=used_version, file_path=local_path)
-        result.update({"bucket": MINIO_BUCKET, "object_name": object_name})
+        result = cargar_archivo(programa=programa, dataset=ds, version=used_version, file_path=local_path,
+                                incremental=incremental)
+        result.update({"bucket": MINIO_BUCKET, "object_name": object_name, "desde_cache": desde_cache})
         return JSONResponse(result, status_code=201)
     except Exception as e:
         raise HTTPException(400, detail=str(e))
 
 
+class CargaLoteRequest(BaseModel):
+    prefix: Optional[str] = Field(None, description="Prefijo en MinIO, p.ej. 'ATI/egresados/2023'")
+    programas: Optional[List[str]] = Field(None, description="Programas a cargar completos (<programa>/<dataset>/)")
+    workers: Optional[int] = Field(None, ge=1, description="Procesos de descarga y parseo")
+    db_concurrencia: Optional[int] = Field(None, ge=1, description="Cargas simultáneas en la BD")
+
+
+@app.post("/carga/{dataset}/minio/batch")
+def carga_lote_desde_minio(dataset: str, req: CargaLoteRequest):
+    """
+    Ingesta todos los objetos CSV/Excel de un prefijo (o de varios programas)
+    siguiendo la convención s3://<BUCKET>/<PROGRAMA>/<DATASET>/**/<archivo>.
+
+    Descarga y parseo en un pool de procesos; escritura con concurrencia
+    limitada y una transacción por archivo. Responde 201 si todo cargó y 207
+    con el reporte consolidado si algún archivo falló.
+    """
+    ds = _normalize_dataset(dataset)
+    if not req.prefix and not req.programas:
+        raise HTTPException(400, detail="Indica 'prefix' o 'programas'")
+
+    try:
+        encontrados = list_dataset_objects(get_minio(), MINIO_BUCKET, ds,
+                                           prefix=req.prefix, programas=req.programas)
+    except Exception as e:
+        raise HTTPException(400, detail=f"Error listando objetos en MinIO: {e}")
+    if not encontrados:
+        raise HTTPException(404, detail=f"No hay objetos de '{ds}' bajo el prefijo indicado")
+
+    objetos = [
+        ObjetoCarga(programa=programa, object_name=obj.object_name,
+                    version=infer_version_from_filename(Path(obj.object_name).name))
+        for programa, obj in encontrados
+    ]
+    reporte = cargar_lote(ds, objetos, MINIO_BUCKET, UPLOAD_DIR / "batch",
+                          workers=req.workers, db_concurrency=req.db_concurrencia)
+    reporte["bucket"] = MINIO_BUCKET
+    return JSONResponse(reporte, status_code=201 if reporte["errores"] == 0 else 207)
+
+
 @app.get("/analisis/posgrados")
 def analisis_posgrados(
     programa: str = Query(..., description="Código del programa (ATI, TURISMO, ...)"),
@@ -212,8 +332,80 @@ def agente_redactar(payload: NarrativaRequest):
         raise HTTPException(status_code=400, detail=str(e))
     
 
+def _parse_resultados_payload(payload: dict) -> tuple[dict, list, Optional[str], dict]:
+    """
+    Valida y normaliza el body de /agente/resultados.
+    Devuelve (poblacion, distribuciones, tipo_analitica, opciones).
+    """
+    # Debug logging
+    import logging
+    logger = logging.getLogger(__name__)
+    logger.warning(f"Received payload: {payload}")
+    
+    poblacion = payload.get("poblacion")
+    if not poblacion:
+        raise HTTPException(status_code=400, detail="Falta 'poblacion' en el body")
+
+    distribuciones = payload.get("distribuciones") or []
+    logger.warning(f"Distribuciones parsed: {distribuciones}, type: {type(distribuciones)}")
+    
+    # CRITICAL FIX: Ensure distribuciones is always a list
+    if isinstance(distribuciones, str):
+        logger.warning(f"WARNING: distribuciones came as string '{distribuciones}', converting to list")
+        distribuciones = [distribuciones]
+    elif not isinstance(distribuciones, list):
+        logger.warning(f"WARNING: distribuciones came as {type(distribuciones)}, converting to empty list")
+        distribuciones = []
+        
+    logger.warning(f"Final distribuciones: {distribuciones}")
+    
+    tipo_analitica = payload.get("tipo_analitica")
+
+    opciones = payload.get("opciones") or {}
+    if not isinstance(opciones, dict):
+        raise HTTPException(status_code=400, detail="'opciones' debe ser un objeto")
+    try:
+        interval_options(opciones)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return poblacion, distribuciones, tipo_analitica, opciones
+
+
+async def _run_in_pool(fn, *args):
+    """Ejecuta una analítica en el pool de procesos traduciendo saturación/timeout a HTTP."""
+    try:
+        return await ANALYTICS_POOL.submit(fn, *args)
+    except PoolSaturated as e:
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except JobTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except BrokenProcessPool as e:
+        raise HTTPException(status_code=503, detail=f"Pool de analíticas reiniciado: {e}")
+
+
+def _cache_lookup(poblacion: dict, distribuciones: list, tipo_analitica: Optional[str],
+                  opciones: Optional[dict] = None, usar_cache: bool = True):
+    """
+    Lee la marca de agua del dataset y busca el request en la cache de resultados.
+
+    Devuelve (watermark, llave, valor, nivel); llave None si no se pudo leer
+    la marca o si `usar_cache` es False. La marca se pasa al trabajo del pool
+    para que calcule con los mismos datos que indica la llave.
+    """
+    watermark = current_watermark(poblacion.get("dataset"))
+    if watermark is None or not usar_cache:
+        return watermark, None, None, None
+    key = request_key(poblacion, distribuciones, tipo_analitica, watermark, opciones)
+    value, nivel = RESULT_CACHE.get(key)
+    return watermark, key, value, nivel
+
+
 @app.post("/agente/resultados")
-def agente_resultados(payload: dict):
+async def agente_resultados(payload: dict):
     """
     Construye la sección 'resultados' para el agente.
 
@@ -228,7 +420,8 @@ def agente_resultados(payload: dict):
           "sexo": "F"
         }
       },
-      "distribuciones": ["sexo", "anio_graduacion"]
+      "distribuciones": ["sexo", "anio_graduacion"],
+      "opciones": { "intervalos": { "replicas": 2000, "nivel": 0.95 } }   # opcional
     }
 
     Devuelve algo de esta forma:
@@ -242,38 +435,37 @@ def agente_resultados(payload: dict):
       }
     }
 
+    El cálculo corre en el pool de procesos de analíticas (ANALYTICS_WORKERS);
+    si el pool y su cola están llenos responde 429 con Retry-After, y 504 si
+    excede ANALYTICS_TIMEOUT_S.
+
+    Los resultados se cachean por request canónico + marca de agua del
+    dataset; la respuesta incluye "cache": {"hit": bool, "nivel": ...}.
+    Enviar "cache": false en el body fuerza el recálculo.
+
+    Requests idénticos que llegan mientras otro igual está en cálculo se
+    coalescen: esperan ese cálculo ("cache": {"hit": false, "coalescida": true}).
     """
     try:
-        # Debug logging
-        import logging
-        logger = logging.getLogger(__name__)
-        logger.warning(f"Received payload: {payload}")
-        
-        poblacion = payload.get("poblacion")
-        if not poblacion:
-            raise HTTPException(status_code=400, detail="Falta 'poblacion' en el body")
+        poblacion, distribuciones, tipo_analitica, opciones = _parse_resultados_payload(payload)
 
-        distribuciones = payload.get("distribuciones") or []
-        logger.warning(f"Distribuciones parsed: {distribuciones}, type: {type(distribuciones)}")
-        
-        # CRITICAL FIX: Ensure distribuciones is always a list
-        if isinstance(distribuciones, str):
-            logger.warning(f"WARNING: distribuciones came as string '{distribuciones}', converting to list")
-            distribuciones = [distribuciones]
-        elif not isinstance(distribuciones, list):
-            logger.warning(f"WARNING: distribuciones came as {type(distribuciones)}, converting to empty list")
-            distribuciones = []
-            
-        logger.warning(f"Final distribuciones: {distribuciones}")
-        
-        tipo_analitica = payload.get("tipo_analitica")
+        watermark, key, cached, nivel = await run_in_threadpool(
+            _cache_lookup, poblacion, distribuciones, tipo_analitica, opciones,
+            payload.get("cache", True) is not False,
+        )
+        if cached is not None:
+            return {**cached, "cache": {"hit": True, "nivel": nivel}}
 
-        resultados = generate_results(poblacion, distribuciones, tipo_analitica)
+        async def _calcular():
+            res = await _run_in_pool(run_analytics_job, poblacion, distribuciones, tipo_analitica, opciones,
+                                     watermark)
+            if key is not None:
+                await run_in_threadpool(RESULT_CACHE.set, key, res, poblacion.get("dataset", ""))
+            return res
 
-        return {
-            "poblacion": poblacion,
-            "resultados": resultados
-        }
+        flight_key = key or request_key(poblacion, distribuciones, tipo_analitica, opciones=opciones)
+        respuesta, coalescida = await RESULTADOS_FLIGHT.do(flight_key, _calcular)
+        return {**respuesta, "cache": {"hit": False, "coalescida": coalescida}}
 
     except HTTPException:
         raise
@@ -281,3 +473,64 @@ def agente_resultados(payload: dict):
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@app.post("/agente/resultados/batch")
+async def agente_resultados_batch(payload: dict):
+    """
+    Versión batch de /agente/resultados para el dashboard y el PDF.
+
+    Body:
+    {
+      "specs": [
+        { "poblacion": {...}, "distribuciones": [...], "tipo_analitica": "detalle_pregunta" },
+        ...
+      ]
+    }
+
+    Las specs con la misma población (dataset + programa + filtros) comparten
+    una sola carga y un solo filtrado del dataset. Devuelve
+    { "resultados": [ {poblacion, resultados} | {poblacion, error}, ... ] }
+    en el mismo orden que las specs. Las specs ya presentes en la cache de
+    resultados no se recalculan.
+    """
+    specs_in = payload.get("specs")
+    if not isinstance(specs_in, list) or not specs_in:
+        raise HTTPException(status_code=400, detail="Falta 'specs' (lista no vacía) en el body")
+
+    try:
+        specs = []
+        for spec in specs_in:
+            poblacion, distribuciones, tipo_analitica, opciones = _parse_resultados_payload(spec)
+            specs.append({
+                "poblacion": poblacion,
+                "distribuciones": distribuciones,
+                "tipo_analitica": tipo_analitica,
+                "opciones": opciones,
+            })
+
+        usar_cache = payload.get("cache", True) is not False
+        resultados: list = [None] * len(specs)
+        llaves: list = [None] * len(specs)
+        pendientes: list = []
+        for i, spec in enumerate(specs):
+            spec["watermark"], llaves[i], cached, nivel = await run_in_threadpool(
+                _cache_lookup, spec["poblacion"], spec["distribuciones"], spec["tipo_analitica"],
+                spec["opciones"], usar_cache,
+            )
+            if cached is not None:
+                resultados[i] = {**cached, "cache": {"hit": True, "nivel": nivel}}
+                continue
+            pendientes.append(i)
+
+        if pendientes:
+            calculados = await _run_in_pool(run_analytics_batch_job, [specs[i] for i in pendientes])
+            for i, res in zip(pendientes, calculados):
+                if llaves[i] is not None and "error" not in res:
+                    await run_in_threadpool(RESULT_CACHE.set, llaves[i], res, specs[i]["poblacion"].get("dataset", ""))
+                resultados[i] = {**res, "cache": {"hit": False}}
+
+        return {"resultados": resultados}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
@@ -1,10 +1,35 @@
 # app/minio_utils.py
 from __future__ import annotations
+import fcntl
+import hashlib
+import logging
 import os
+import re
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 from minio import Minio
 
+logger = logging.getLogger(__name__)
+
+# Índice de objetos por (bucket, prefijo): dentro del TTL no se lista MinIO;
+# vencido, se listan solo los nombres posteriores al último visto (start_after)
+# y cada MINIO_INDEX_FULL_REFRESH_S se relista todo (borrados / sobrescrituras).
+# Elegir "el más reciente" relista todo al vencer el TTL (ver pick_object)
+MINIO_INDEX_TTL_S = float(os.getenv("MINIO_INDEX_TTL_S", "30"))
+MINIO_INDEX_FULL_REFRESH_S = float(os.getenv("MINIO_INDEX_FULL_REFRESH_S", "600"))
+
+# Cache local de descargas por (bucket, objeto, ETag), compartido por los
+# procesos del contenedor; se desalojan las entradas menos usadas (LRU)
+# cuando se supera la cuota
+MINIO_CACHE = os.getenv("MINIO_CACHE", "true").lower() == "true"
+MINIO_CACHE_DIR = Path(os.getenv("MINIO_CACHE_DIR", "/app/uploads/.minio-cache"))
+MINIO_CACHE_MAX_BYTES = int(os.getenv("MINIO_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+
 def get_minio() -> Minio:
     endpoint = os.getenv("MINIO_ENDPOINT", "minio:9000")
     access   = os.getenv("MINIO_ACCESS_KEY", "minioadmin")
@@ -12,39 +37,272 @@ def get_minio() -> Minio:
     secure   = os.getenv("MINIO_SECURE", "false").lower() == "true"
     return Minio(endpoint, access_key=access, secret_key=secret, secure=secure)
 
+def infer_version_from_filename(name: str) -> str:
+    """
+    Extrae una 'versión' del nombre si aparece algo tipo:
+      - v2, v2.0, v2025.10.13
+      - 2025-10-13, 20251013, 2025_10_13
+    Si no encuentra nada, retorna 'v1.0'.
+    """
+    m = re.search(r'(v\d+(?:\.\d+)*|\d{4}[-_.]?\d{2}[-_.]?\d{2})', name.lower())
+    return m.group(1) if m else "v1.0"
+
+
+@dataclass
+class ObjectIndex:
+    """
+    Objetos bajo un prefijo, con la versión de cada archivo ya resuelta:
+    `por_version[v]` y `por_nombre[basename]` van ordenados del más reciente
+    al más antiguo, así que elegir un objeto es un acceso a dict.
+    """
+    bucket: str
+    prefix: str
+    objetos: Dict[str, Tuple[object, str]] = field(default_factory=dict)  # name -> (last_modified, version)
+    por_version: Dict[str, List[str]] = field(default_factory=dict)
+    por_nombre: Dict[str, List[str]] = field(default_factory=dict)
+    ultimo: Optional[str] = None       # mayor object_name visto (S3 lista en orden lexicográfico)
+    listado_en: float = 0.0
+    completo_en: float = 0.0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def _agregar(self, nombre: str, last_modified) -> None:
+        base = Path(nombre).name
+        version = infer_version_from_filename(base)
+        self.objetos[nombre] = (last_modified, version)
+        for indice, clave in ((self.por_version, version), (self.por_nombre, base)):
+            nombres = [n for n in indice.get(clave, []) if n != nombre]
+            nombres.append(nombre)
+            nombres.sort(key=lambda n: self.objetos[n][0], reverse=True)
+            indice[clave] = nombres
+        if self.ultimo is None or nombre > self.ultimo:
+            self.ultimo = nombre
+
+    def refresh(self, client: Minio, completo: bool = False) -> None:
+        ahora = time.monotonic()
+        if completo:
+            self.objetos.clear()
+            self.por_version.clear()
+            self.por_nombre.clear()
+            self.ultimo = None
+        start_after = None if completo else self.ultimo
+        for obj in client.list_objects(self.bucket, prefix=self.prefix, recursive=True,
+                                       start_after=start_after):
+            if not obj.is_dir:
+                self._agregar(obj.object_name, obj.last_modified)
+        self.listado_en = ahora
+        if completo:
+            self.completo_en = ahora
+
+    def ensure_fresh(self, client: Minio, full_refresh_s: float = MINIO_INDEX_FULL_REFRESH_S) -> None:
+        ahora = time.monotonic()
+        if not self.completo_en or ahora - self.completo_en > full_refresh_s:
+            self.refresh(client, completo=True)
+        elif ahora - self.listado_en > MINIO_INDEX_TTL_S:
+            self.refresh(client)
+
+    def mas_reciente(self, nombres) -> Optional[str]:
+        return max(nombres, key=lambda n: self.objetos[n][0], default=None)
+
+    def find(self, version: Optional[str] = None, filename: Optional[str] = None) -> Optional[str]:
+        if filename:
+            nombres = self.por_nombre.get(Path(filename).name)
+            if nombres:
+                return nombres[0]
+            # `filename` con parte de la ruta: coincidencia por sufijo
+            return self.mas_reciente(n for n in self.objetos if n.endswith(filename))
+        if version:
+            nombres = self.por_version.get(version.lower())
+            if nombres:
+                return nombres[0]
+            # versión que no sale de infer_version_from_filename (p.ej. "2023")
+            encontrado = self.mas_reciente(n for n in self.objetos if version in n)
+            if encontrado:
+                return encontrado
+        return self.mas_reciente(self.objetos)
+
+
+_INDEXES: Dict[Tuple[str, str], ObjectIndex] = {}
+_INDEXES_LOCK = threading.Lock()
+
+
+def object_index(bucket: str, prefix: str) -> ObjectIndex:
+    with _INDEXES_LOCK:
+        indice = _INDEXES.get((bucket, prefix))
+        if indice is None:
+            indice = _INDEXES[(bucket, prefix)] = ObjectIndex(bucket, prefix)
+        return indice
+
+
+def invalidate_object_index(bucket: Optional[str] = None, prefix: Optional[str] = None) -> None:
+    """Olvida los índices de `bucket`/`prefix` (o todos); el próximo uso relista completo."""
+    with _INDEXES_LOCK:
+        for clave in list(_INDEXES):
+            if (bucket is None or clave[0] == bucket) and (prefix is None or clave[1] == prefix):
+                del _INDEXES[clave]
+
+
 def pick_object(client: Minio, bucket: str, prefix: str,
                 version: Optional[str] = None,
                 filename: Optional[str] = None) -> str:
     """
     Devuelve el object_name a descargar:
       - si filename, busca match exacto
-      - si version, busca objetos que contengan "version" en el nombre y elige el más reciente
+      - si version, busca objetos de esa versión (o que la contengan en el nombre) y elige el más reciente
       - si nada, elige el más reciente por last_modified
-    """
-    candidates = list(client.list_objects(bucket, prefix=prefix, recursive=True))
-    if not candidates:
-        raise FileNotFoundError(f"No hay objetos bajo s3://{bucket}/{prefix}")
 
-    # filename exacto
-    if filename:
-        for obj in candidates:
-            name = obj.object_name
-            if name.endswith(filename) or Path(name).name == filename:
-                return obj.object_name
-        raise FileNotFoundError(f"No se encontró filename '{filename}' bajo {prefix}")
+    Usa el índice cacheado de (bucket, prefix); si no encuentra lo pedido,
+    relista completo una vez antes de fallar (un objeto subido con un nombre
+    menor al último visto no aparece en el listado incremental).
 
-    # filtrar por version en el nombre
-    if version:
-        vers = [o for o in candidates if version in o.object_name]
-        if vers:
-            vers.sort(key=lambda o: o.last_modified, reverse=True)
-            return vers[0].object_name
+    Para "el más reciente" (sin filename) el listado incremental no basta:
+    no ve objetos nuevos con nombre menor al último visto (p.ej. dd-mm-yyyy)
+    ni re-subidas con el mismo nombre, y elegiría un archivo viejo. En ese
+    caso el índice se relista completo cada MINIO_INDEX_TTL_S.
+    """
+    indice = object_index(bucket, prefix)
+    with indice.lock:
+        indice.ensure_fresh(client, MINIO_INDEX_FULL_REFRESH_S if filename else MINIO_INDEX_TTL_S)
+        encontrado = indice.find(version, filename)
+        # con `version` sin coincidencias, find cae al más reciente: no cuenta como hallado
+        exacto = encontrado is not None and (
+            filename or not version or version.lower() == indice.objetos[encontrado][1]
+            or version in encontrado
+        )
+        if not exacto and time.monotonic() - indice.completo_en > MINIO_INDEX_TTL_S:
+            indice.refresh(client, completo=True)
+            encontrado = indice.find(version, filename)
 
-    # más reciente
-    candidates.sort(key=lambda o: o.last_modified, reverse=True)
-    return candidates[0].object_name
+    if not indice.objetos:
+        raise FileNotFoundError(f"No hay objetos bajo s3://{bucket}/{prefix}")
+    if encontrado is None:
+        raise FileNotFoundError(f"No se encontró filename '{filename}' bajo {prefix}")
+    return encontrado
 
 def download_object(client: Minio, bucket: str, object_name: str, dest: Path) -> Path:
     dest.parent.mkdir(parents=True, exist_ok=True)
     client.fget_object(bucket, object_name, str(dest))
     return dest
+
+
+# -----------------------------------------------------------------------------
+# Cache de descargas
+# -----------------------------------------------------------------------------
+DOWNLOAD_CACHE_STATS = {"aciertos": 0, "fallos": 0, "desalojos": 0, "bytes_descargados": 0}
+
+
+@contextmanager
+def _cache_lock():
+    """Lock de archivo: una sola inserción/desalojo a la vez entre procesos."""
+    MINIO_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    with (MINIO_CACHE_DIR / ".lock").open("a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _cache_entry(bucket: str, object_name: str, etag: str) -> Path:
+    """Un directorio por (bucket, objeto, ETag) con el archivo bajo su nombre original."""
+    clave = hashlib.sha1(f"{bucket}\0{object_name}\0{etag}".encode()).hexdigest()
+    return MINIO_CACHE_DIR / clave / Path(object_name).name
+
+
+def _evict(conservar: Path) -> None:
+    """Borra entradas por fecha de último uso (mtime) hasta quedar bajo la cuota."""
+    entradas = []
+    total = 0
+    for d in MINIO_CACHE_DIR.iterdir():
+        if not d.is_dir() or d.name.startswith("."):
+            continue
+        tam = sum(f.stat().st_size for f in d.iterdir() if f.is_file())
+        entradas.append((d.stat().st_mtime, tam, d))
+        total += tam
+    entradas.sort()
+    for _, tam, d in entradas:
+        if total <= MINIO_CACHE_MAX_BYTES:
+            break
+        if d == conservar:
+            continue
+        # un lector con el archivo ya abierto lo sigue leyendo tras el unlink
+        shutil.rmtree(d, ignore_errors=True)
+        total -= tam
+        DOWNLOAD_CACHE_STATS["desalojos"] += 1
+
+
+def fetch_object(client: Minio, bucket: str, object_name: str, dest: Path) -> Tuple[Path, bool]:
+    """
+    Ruta local de `object_name` y si salió del cache.
+
+    Revalida solo con stat_object: si la entrada del ETag vigente existe, se
+    usa sin transferir nada. Si no, se descarga con If-Match sobre ese ETag
+    (un objeto reemplazado entre el stat y el GET no queda guardado con el
+    ETag viejo) y se publica con un rename atómico. Con MINIO_CACHE=false
+    descarga en `dest` como download_object.
+    """
+    if not MINIO_CACHE:
+        return download_object(client, bucket, object_name, dest), False
+
+    for intento in range(2):
+        etag = client.stat_object(bucket, object_name).etag
+        entrada = _cache_entry(bucket, object_name, etag)
+        if entrada.is_file():
+            os.utime(entrada.parent)
+            DOWNLOAD_CACHE_STATS["aciertos"] += 1
+            return entrada, True
+
+        tmp = MINIO_CACHE_DIR / f".tmp-{os.getpid()}-{threading.get_ident()}"
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        try:
+            client.fget_object(bucket, object_name, str(tmp / entrada.name),
+                               request_headers={"If-Match": etag})
+        except Exception as e:
+            shutil.rmtree(tmp, ignore_errors=True)
+            if intento == 0 and getattr(e, "code", None) == "PreconditionFailed":
+                continue
+            raise
+        DOWNLOAD_CACHE_STATS["fallos"] += 1
+        DOWNLOAD_CACHE_STATS["bytes_descargados"] += (tmp / entrada.name).stat().st_size
+        with _cache_lock():
+            try:
+                os.rename(tmp, entrada.parent)
+            except OSError:
+                # otro proceso publicó la misma entrada
+                shutil.rmtree(tmp, ignore_errors=True)
+            _evict(conservar=entrada.parent)
+        return entrada, False
+    raise RuntimeError(f"s3://{bucket}/{object_name} cambió durante la descarga")
+
+
+def download_cache_stats() -> Dict[str, object]:
+    return {**DOWNLOAD_CACHE_STATS, "activo": MINIO_CACHE, "cuota_bytes": MINIO_CACHE_MAX_BYTES}
+
+LOADABLE_SUFFIXES = (".csv", ".xlsx", ".xlsm", ".xls")
+
+def list_dataset_objects(client: Minio, bucket: str, dataset: str,
+                         prefix: Optional[str] = None,
+                         programas: Optional[List[str]] = None) -> List[Tuple[str, object]]:
+    """
+    Objetos cargables (CSV/Excel) de un dataset según la convención
+    <PROGRAMA>/<DATASET>/**/<archivo>, como [(programa, objeto)] ordenados por
+    programa y last_modified (el más reciente al final).
+
+      - con `programas`: lista bajo <programa>/<dataset>/ de cada uno
+      - con `prefix`: lista bajo ese prefijo y se queda con lo que sigue la convención
+      - sin ninguno: todo el bucket
+    """
+    prefijos = [f"{p}/{dataset}/" for p in programas] if programas else [prefix or ""]
+    encontrados = []
+    vistos = set()
+    for pref in prefijos:
+        for obj in client.list_objects(bucket, prefix=pref, recursive=True):
+            partes = obj.object_name.split("/")
+            if len(partes) < 3 or partes[1].lower() != dataset or obj.object_name in vistos:
+                continue
+            if not obj.object_name.lower().endswith(LOADABLE_SUFFIXES):
+                continue
+            vistos.add(obj.object_name)
+            encontrados.append((partes[0], obj))
+    encontrados.sort(key=lambda po: (po[0], po[1].last_modified, po[1].object_name))
+    return encontrados
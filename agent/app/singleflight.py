@@ -0,0 +1,46 @@
+# app/singleflight.py
+from __future__ import annotations
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from .metrics import METRICS
+
+
+class SingleFlight:
+    """
+    Coalescencia de requests concurrentes idénticos (patrón single-flight).
+
+    La primera llamada con una llave ejecuta `fn`; las que llegan mientras
+    está en vuelo esperan ese mismo resultado (o excepción) en lugar de
+    lanzar su propio cálculo. Pensado para un único event loop (uvicorn),
+    por eso no usa locks.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Devuelve (resultado, coalescida)."""
+        fut = self._inflight.get(key)
+        if fut is not None:
+            METRICS.inc(f"singleflight_{self.name}_coalescidas")
+            return await asyncio.shield(fut), True
+
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        METRICS.inc(f"singleflight_{self.name}_ejecutadas")
+        try:
+            result = await fn()
+        except BaseException as e:
+            fut.set_exception(e)
+            fut.exception()  # marcada como consumida aunque no haya seguidores
+            raise
+        else:
+            fut.set_result(result)
+            return result, False
+        finally:
+            self._inflight.pop(key, None)
+
+    def inflight(self) -> int:
+        return len(self._inflight)
@@ -0,0 +1,54 @@
+# app/uploads.py
+from __future__ import annotations
+import hashlib
+import os
+from pathlib import Path
+from typing import Tuple
+
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+
+# Subidas HTTP: se escriben por bloques sin bloquear el event loop
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(200 * 1024 ** 2)))
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1024 ** 2)))
+
+
+class UploadTooLarge(Exception):
+    """El archivo supera MAX_UPLOAD_BYTES (la API responde 413)."""
+
+    def __init__(self, limite: int):
+        super().__init__(f"El archivo supera el máximo permitido de {limite} bytes")
+        self.limite = limite
+
+
+async def save_upload(file: UploadFile, dest: Path, max_bytes: int = MAX_UPLOAD_BYTES) -> Tuple[int, str]:
+    """
+    Copia `file` a `dest` por bloques de UPLOAD_CHUNK_BYTES y devuelve
+    (bytes, sha256 hex) calculados mientras se escribe, sin releer el archivo.
+
+    Las escrituras a disco van al threadpool; si el tamaño declarado o el
+    acumulado supera `max_bytes` se corta, se borra lo escrito y se lanza
+    UploadTooLarge.
+    """
+    if file.size is not None and file.size > max_bytes:
+        raise UploadTooLarge(max_bytes)
+
+    digest = hashlib.sha256()
+    total = 0
+    f = await run_in_threadpool(dest.open, "wb")
+    try:
+        while True:
+            bloque = await file.read(UPLOAD_CHUNK_BYTES)
+            if not bloque:
+                break
+            total += len(bloque)
+            if total > max_bytes:
+                raise UploadTooLarge(max_bytes)
+            digest.update(bloque)
+            await run_in_threadpool(f.write, bloque)
+    except BaseException:
+        await run_in_threadpool(f.close)
+        dest.unlink(missing_ok=True)
+        raise
+    await run_in_threadpool(f.close)
+    return total, digest.hexdigest()
@@ -0,0 +1,86 @@
+"""
+Benchmark de los intervalos bootstrap (analytics.bootstrap).
+
+Uso (desde agent/):
+    python -m benchmarks.bootstrap_ci --n 50000 --replicas 10000 --slo-ms 2000
+
+Mide, con una población sintética de `n` respuestas, los dos caminos de
+remuestreo:
+  - satisfacción 1–5 y NPS (pocos valores distintos -> multinomial)
+  - una variable continua (matriz de índices)
+
+Cada caso se corre sin límite de tiempo (costo real de las `replicas`) y con
+el presupuesto de producción (BOOTSTRAP_BUDGET_S, o --presupuesto-s): se
+informa si cabe en el presupuesto o con cuántas réplicas queda truncado.
+Falla (exit 1) si alguna corrida con presupuesto supera el SLO.
+
+Medición de referencia (2026-10-19, 1 vCPU, valores por defecto): la
+multinomial tarda < 15 ms; la matriz de índices necesita ~3,9 s para las
+10.000 réplicas, así que con 2 s queda truncada a 5.360 réplicas
+(~1,98 s, IC prácticamente igual al completo).
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from analytics import bootstrap
+from analytics.bootstrap import bootstrap_mean_ci, nps_scores
+
+
+def _medir(valores: np.ndarray, replicas: int, repeticiones: int, presupuesto_s: float) -> dict:
+    tiempos = []
+    ic = None
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        ic = bootstrap_mean_ci(valores, replicas=replicas, semilla=0, presupuesto_s=presupuesto_s)
+        tiempos.append((time.perf_counter() - t0) * 1000)
+    return {
+        "metodo": ic["metodo"],
+        "replicas": ic["replicas"],
+        "truncado": ic["truncado"],
+        "ic": (round(ic["inferior"], 4), round(ic["superior"], 4)),
+        "ms_mediana": round(float(np.median(tiempos)), 1),
+        "ms_max": round(float(np.max(tiempos)), 1),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=50_000, help="respuestas por población")
+    parser.add_argument("--replicas", type=int, default=10_000)
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--slo-ms", type=float, default=2000.0)
+    parser.add_argument("--presupuesto-s", type=float, default=bootstrap.BOOTSTRAP_BUDGET_S)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(42)
+    satisfaccion = rng.choice([1, 2, 3, 4, 5], size=args.n, p=[0.05, 0.1, 0.25, 0.35, 0.25]).astype(float)
+    casos = [
+        ("satisfaccion_media", satisfaccion),
+        ("nps", nps_scores(satisfaccion, 2, 4)),
+        ("continua", rng.normal(size=args.n)),
+    ]
+
+    print(f"n={args.n} replicas={args.replicas} bloque={bootstrap.BOOTSTRAP_BLOCK_ELEMS} elems "
+          f"presupuesto={args.presupuesto_s}s")
+    ok = True
+    for nombre, valores in casos:
+        libre = _medir(valores, args.replicas, args.repeticiones, 3600)
+        acotado = _medir(valores, args.replicas, args.repeticiones, args.presupuesto_s)
+        dentro = acotado["ms_max"] <= args.slo_ms
+        ok &= dentro
+        presupuesto = (f"truncado a {acotado['replicas']}/{args.replicas} réplicas ic={acotado['ic']}"
+                       if acotado["truncado"] else "cabe en el presupuesto")
+        print(f"  {nombre:<20} {libre['metodo']:<12} ic={libre['ic']} "
+              f"sin límite: mediana={libre['ms_mediana']}ms max={libre['ms_max']}ms")
+        print(f"  {'':<33} con presupuesto: max={acotado['ms_max']}ms {presupuesto} "
+              f"{'OK' if dentro else 'FUERA DE SLO'}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
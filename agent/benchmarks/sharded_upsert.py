@@ -0,0 +1,118 @@
+"""
+Benchmark del UPSERT repartido a core (etl.sharded_upsert).
+
+Uso (desde agent/, con PG_DSN apuntando a una base de pruebas):
+    python -m benchmarks.sharded_upsert --n 200000 --columnas 60 --shards 1 2 4 8
+
+Para cada número de shards crea una tabla sintética con `n` filas y mide el
+UPSERT de `n` filas más (la mitad actualiza llaves existentes, la otra mitad
+inserta nuevas). Con 1 shard usa upsert_dataframe tal cual. Requiere
+max_prepared_transactions >= shards en el servidor.
+
+Medición de referencia (2026-10-19; PostgreSQL 16.2 local con
+max_prepared_transactions=16, 1 vCPU y 5 GB de RAM compartidos entre
+cliente y servidor; --n 200000 --columnas 60):
+
+    shards=1     289.25s         691 filas/s  x1.00
+    shards=2     290.93s         687 filas/s  x0.99
+    shards=4     315.59s         634 filas/s  x0.92
+    shards=8     321.40s         622 filas/s  x0.90
+
+En esa máquina repartir no acelera: ~37 de los 41 minutos de la corrida
+son CPU del proceso Python, casi todo en el volcado a la temporal
+(to_sql con method="multi"), que los hilos de los shards no paralelizan
+por el GIL, y con un solo núcleo los backends tampoco corren en paralelo.
+Cada shard más agrega su temporal y su PREPARE. Antes de subir
+CORE_UPSERT_SHARDS hay que medir en el host de producción.
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from etl.db import make_engine, upsert_dataframe
+from etl.sharded_upsert import ShardedUpsert, max_prepared_transactions
+
+SCHEMA = "bench"
+KEYS = ["programa", "email"]
+
+
+def _frame(n: int, columnas: int, desde: int, rng: np.random.Generator) -> pd.DataFrame:
+    datos = {
+        "programa": rng.choice(["ATI", "TUR", "ADM", "DER"], size=n),
+        "email": [f"r{i}@ejemplo.cl" for i in range(desde, desde + n)],
+    }
+    for j in range(columnas):
+        if j % 3 == 0:
+            datos[f"p{j:03d}"] = rng.choice(["Muy de acuerdo", "De acuerdo", "En desacuerdo"], size=n)
+        else:
+            datos[f"p{j:03d}"] = rng.integers(1, 6, size=n).astype(float)
+    return pd.DataFrame(datos).drop_duplicates(KEYS)
+
+
+def _medir(engine, shards: int, base: pd.DataFrame, carga: pd.DataFrame) -> float:
+    tabla = f"upsert_{shards}"
+    with engine.begin() as conn:
+        conn.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{SCHEMA}"'))
+        conn.execute(text(f'DROP TABLE IF EXISTS "{SCHEMA}"."{tabla}"'))
+        upsert_dataframe(conn, base, SCHEMA, tabla, KEYS)
+
+    t0 = time.perf_counter()
+    if shards == 1:
+        with engine.begin() as conn:
+            upsert_dataframe(conn, carga, SCHEMA, tabla, KEYS)
+    else:
+        repartido = ShardedUpsert(engine, SCHEMA, tabla, KEYS, shards)
+        try:
+            with engine.begin() as conn:
+                repartido.prepare(carga)
+                repartido.record(conn)
+        except Exception:
+            repartido.rollback()
+            raise
+        repartido.commit()
+    segundos = time.perf_counter() - t0
+
+    with engine.begin() as conn:
+        total = conn.execute(text(f'SELECT count(*) FROM "{SCHEMA}"."{tabla}"')).scalar()
+        conn.execute(text(f'DROP TABLE "{SCHEMA}"."{tabla}"'))
+    esperado = len(pd.concat([base[KEYS], carga[KEYS]]).drop_duplicates())
+    if total != esperado:
+        raise AssertionError(f"{shards} shards: {total} filas, se esperaban {esperado}")
+    return segundos
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=200_000, help="filas por carga")
+    parser.add_argument("--columnas", type=int, default=60)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--dsn", default=None, help="por defecto PG_DSN")
+    args = parser.parse_args(argv)
+
+    engine = make_engine(args.dsn)
+    disponibles = max_prepared_transactions(engine)
+    if max(args.shards) > 1 and disponibles < max(args.shards):
+        print(f"max_prepared_transactions={disponibles}: súbelo a >= {max(args.shards)} para medir con shards")
+        return 1
+
+    rng = np.random.default_rng(42)
+    base = _frame(args.n, args.columnas, 0, rng)
+    carga = _frame(args.n, args.columnas, args.n // 2, rng)
+
+    print(f"n={args.n} columnas={args.columnas} (la mitad actualiza, la mitad inserta)")
+    referencia = None
+    for shards in args.shards:
+        s = _medir(engine, shards, base, carga)
+        referencia = referencia or s
+        print(f"  shards={shards:<3} {s:8.2f}s  {len(carga) / s:>10,.0f} filas/s  x{referencia / s:.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,30 @@
 # carga.py
 from __future__ import annotations
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
 from typing import Dict, List, Tuple
+import logging
+import multiprocessing
 import os
+import time
+
+import pandas as pd
 
 from etl import SurveyETL
+from etl.db import _table_exists, make_engine
+from etl.events import DATASET_CHANGED, publish
 from etl.io import read_dataframe
+from etl.maintenance import ETL_MAINTENANCE, run_post_load
+from etl.raw_layer import RAW_LAYER_MODE
 from etl.utils import normalize_columns, rename_aliases
+from etl.watermarks import read_watermark
+
+logger = logging.getLogger(__name__)
+
+# Carga por lotes: procesos para descargar+parsear, hilos para escribir en la BD
+CARGA_BATCH_WORKERS = int(os.getenv("CARGA_BATCH_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+CARGA_DB_CONCURRENCY = int(os.getenv("CARGA_DB_CONCURRENCY", "2"))
 
 # Prioridad de llaves por dataset
 KEY_CANDIDATES: Dict[str, List[str]] = {
@@ -20,30 +38,53 @@ DTYPES_BASE: Dict[str, Dict[str, str]] = {
     "profesores": {"programa": "string", "email": "string", "id_id_de_respuesta": "string", "version": "string"},
 }
 
-def preflight_and_choose_key(src: Path, dataset: str) -> Tuple[str, list[str]]:
-    df0 = read_dataframe(str(src)).head(0)
-    df0 = df0.rename(columns=normalize_columns)
-    df0 = rename_aliases(df0)
-    cols = list(df0.columns)
+def _normalized_columns(df: pd.DataFrame) -> list[str]:
+    df0 = df.head(0).rename(columns=normalize_columns)
+    return list(rename_aliases(df0).columns)
 
+def choose_key(cols: list[str], dataset: str) -> str:
     for k in KEY_CANDIDATES[dataset]:
-        if k in df0.columns:
-            return k, cols
-
+        if k in cols:
+            return k
     raise KeyError(f"[{dataset}] No se encontró llave entre {KEY_CANDIDATES[dataset]} | cols: {cols}")
 
-def cargar_archivo(programa: str, dataset: str, version: str, file_path: Path) -> dict:
-    """
-    Carga un archivo XLSX/CSV a la BD ETL:
-      - añade columnas estáticas (programa, version)
-      - normaliza encabezados y alias
-      - hace UPSERT a core.<dataset> y append a raw.<dataset>
-    """
+def preflight_and_choose_key(src: Path, dataset: str) -> Tuple[str, list[str]]:
+    cols = _normalized_columns(read_dataframe(str(src)))
+    return choose_key(cols, dataset), cols
+
+def _check_dataset(dataset: str) -> str:
     dataset = dataset.lower().strip()
     if dataset not in ("egresados", "profesores"):
         raise ValueError("dataset debe ser 'egresados' o 'profesores'")
+    return dataset
 
-    key_col, _ = preflight_and_choose_key(file_path, dataset)
+
+# -----------------------------------------------------------------------------
+# Etapas: preparar (sin BD, CPU) -> escribir (BD, una transacción por archivo)
+# -----------------------------------------------------------------------------
+@dataclass
+class CargaPreparada:
+    """Archivo leído y transformado, listo para escribirse (se puede enviar entre procesos)."""
+    programa: str
+    dataset: str
+    version: str
+    key_col: str
+    source: str
+    etl: SurveyETL
+    df_raw: pd.DataFrame
+    df_core: pd.DataFrame
+
+def preparar_carga(programa: str, dataset: str, version: str, file_path: Path,
+                   **etl_kwargs) -> CargaPreparada:
+    """
+    Lee el archivo una sola vez, elige la llave y corre el transform del ETL
+    (headers, tipos, validaciones, dedupe, perfiles). No escribe en la BD;
+    en modo incremental sí lee la marca de etl.ingest_watermarks para
+    descartar lo ya cargado (ver SurveyETL.drop_loaded).
+    """
+    dataset = _check_dataset(dataset)
+    df = read_dataframe(str(file_path))
+    key_col = choose_key(_normalized_columns(df), dataset)
 
     etl = SurveyETL(
         source=str(file_path),
@@ -53,13 +94,179 @@ def cargar_archivo(programa: str, dataset: str, version: str, file_path: Path) -
         dtypes=DTYPES_BASE.get(dataset, {}),
         static_columns={"programa": programa, "version": version},
         write_raw=True,
+        **etl_kwargs,
     )
-    etl.run()
+    df = etl.drop_loaded(df)   # modo incremental: solo respuestas nuevas
+    df_t = etl.transform(df)
+    return CargaPreparada(programa, dataset, version, key_col, str(file_path), etl, df, df_t)
+
+def escribir_carga(prep: CargaPreparada) -> dict:
+    """UPSERT a core, append a raw, snapshot y post-carga (ver SurveyETL.persist)."""
+    prep.etl.persist(prep.df_raw, prep.df_core)
     return {
-        "programa": programa,
-        "dataset": dataset,
-        "version": version,
-        "key": ["programa", key_col],
-        "source": str(file_path),
+        "programa": prep.programa,
+        "dataset": prep.dataset,
+        "version": prep.version,
+        "key": ["programa", prep.key_col],
+        "source": prep.source,
+        "sha256": prep.etl.source_sha256,
+        "raw": prep.etl.raw_object,
+        "incremental": prep.etl.incremental_report,
         "status": "ok",
+        "mantenimiento": prep.etl.maintenance_report,
+    }
+
+def cargar_archivo(programa: str, dataset: str, version: str, file_path: Path,
+                   source_sha256: str | None = None, incremental: bool | None = None) -> dict:
+    """
+    Carga un archivo XLSX/CSV a la BD ETL:
+      - añade columnas estáticas (programa, version)
+      - normaliza encabezados y alias
+      - hace UPSERT a core.<dataset> y append a raw.<dataset> (o un Parquet
+        en MinIO catalogado en etl.raw_objects, con RAW_LAYER_MODE=parquet)
+
+    `source_sha256` es la huella del archivo calculada al recibirlo (se
+    registra con la marca de agua de la carga). `incremental` fuerza o
+    desactiva el modo incremental (por defecto ETL_INCREMENTAL).
+    """
+    return escribir_carga(preparar_carga(programa, dataset, version, file_path,
+                                         source_sha256=source_sha256, incremental=incremental))
+
+
+# -----------------------------------------------------------------------------
+# Carga por lotes desde MinIO
+# -----------------------------------------------------------------------------
+@dataclass
+class ObjetoCarga:
+    programa: str
+    object_name: str
+    version: str
+
+def _descargar_y_preparar(bucket: str, obj: ObjetoCarga, dataset: str, dest_dir: str,
+                          write_snapshot: bool) -> Tuple[CargaPreparada, float]:
+    """Corre en un proceso del pool: descarga el objeto y lo prepara."""
+    from app.minio_utils import get_minio, fetch_object
+
+    t0 = time.perf_counter()
+    local_path, _ = fetch_object(get_minio(), bucket, obj.object_name,
+                                 Path(dest_dir) / obj.object_name.replace("/", "__"))
+    prep = preparar_carga(obj.programa, dataset, obj.version, local_path,
+                          maintenance=False, write_snapshot=write_snapshot)
+    return prep, time.perf_counter() - t0
+
+def cargar_lote(dataset: str, objetos: List[ObjetoCarga], bucket: str, dest_dir: Path,
+                workers: int | None = None, db_concurrency: int | None = None) -> dict:
+    """
+    Ingesta de muchos objetos de MinIO:
+
+      1) descarga + parseo + transform en un pool de procesos (`workers`)
+      2) escritura con a lo sumo `db_concurrency` cargas simultáneas en la BD;
+         cada archivo en su propia transacción (un error no afecta a los demás)
+      3) un solo mantenimiento post-carga (ANALYZE / matviews) al final
+
+    Los archivos de un mismo programa se escriben en serie y en el orden de
+    `objetos` (el más reciente al final gana en el UPSERT); programas
+    distintos van en paralelo. En modo incremental todos se preparan contra
+    la misma marca guardada, así que cada archivo se filtra además con la
+    marca del anterior de su programa (SurveyETL.chain_ingest_mark). Si core.<dataset> no existe, el primer archivo
+    se escribe solo para que cree la tabla y su índice único.
+
+    Devuelve un reporte consolidado con el resultado y los tiempos por archivo.
+    """
+    dataset = _check_dataset(dataset)
+    workers = workers or CARGA_BATCH_WORKERS
+    db_concurrency = db_concurrency or CARGA_DB_CONCURRENCY
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    t_inicio = time.perf_counter()
+
+    por_programa: Dict[str, List[int]] = {}
+    for i, obj in enumerate(objetos):
+        por_programa.setdefault(obj.programa, []).append(i)
+    # solo el último archivo de cada programa exporta el snapshot Parquet
+    ultimos = {indices[-1] for indices in por_programa.values()}
+
+    reporte: List[dict | None] = [None] * len(objetos)
+
+    def _base(i: int) -> dict:
+        obj = objetos[i]
+        return {"programa": obj.programa, "object_name": obj.object_name, "version": obj.version}
+
+    def _escribir(i: int, futuro: Future, marca: tuple | None = None) -> tuple | None:
+        """Escribe el archivo `i`; devuelve la marca incremental vigente para el siguiente del programa."""
+        try:
+            prep, t_prep = futuro.result()
+        except Exception as e:
+            reporte[i] = {**_base(i), "status": "error", "etapa": "descarga", "error": str(e)}
+            return marca
+        t0 = time.perf_counter()
+        try:
+            prep.df_raw, prep.df_core = prep.etl.chain_ingest_mark(marca, prep.df_raw, prep.df_core)
+            escribir_carga(prep)
+            reporte[i] = {
+                **_base(i),
+                "status": "ok",
+                "filas": len(prep.df_core),
+                "watermark": prep.etl.watermark,
+                "segundos_preparacion": round(t_prep, 3),
+                "segundos_escritura": round(time.perf_counter() - t0, 3),
+            }
+        except Exception as e:
+            logger.warning(f"Falló la carga de {objetos[i].object_name}: {e}")
+            reporte[i] = {**_base(i), "status": "error", "etapa": "escritura", "error": str(e),
+                          "segundos_preparacion": round(t_prep, 3)}
+            return marca
+        return prep.etl.ingest_mark or marca
+
+    ctx = multiprocessing.get_context(os.getenv("CARGA_BATCH_START_METHOD", "spawn"))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as procesos:
+        futuros = [
+            procesos.submit(_descargar_y_preparar, bucket, obj, dataset, str(dest_dir), i in ultimos)
+            for i, obj in enumerate(objetos)
+        ]
+
+        cadenas = [(indices, None) for indices in por_programa.values()]
+        with make_engine().connect() as conn:
+            existe = _table_exists(conn, "core", dataset)
+        if not existe and cadenas:
+            indices, _ = cadenas[0]
+            cadenas[0] = (indices[1:], _escribir(indices[0], futuros[indices[0]]))
+
+        def _cadena(cadena: Tuple[List[int], tuple | None]) -> None:
+            indices, marca = cadena
+            for i in indices:
+                marca = _escribir(i, futuros[i], marca)
+
+        with ThreadPoolExecutor(max_workers=db_concurrency) as escritores:
+            list(escritores.map(_cadena, cadenas))
+
+    ok = [r for r in reporte if r and r["status"] == "ok"]
+    mantenimiento = None
+    if ok:
+        if ETL_MAINTENANCE:
+            try:
+                tablas = [("core", dataset)] if RAW_LAYER_MODE == "parquet" else [("raw", dataset), ("core", dataset)]
+                mantenimiento = run_post_load(make_engine(), dataset, tablas)
+            except Exception as e:
+                logger.warning(f"Falló el mantenimiento post-carga del lote de {dataset}: {e}")
+        # marca del dataset ya con todas las cargas del lote confirmadas
+        try:
+            with make_engine().connect() as conn:
+                watermark = read_watermark(conn, dataset)
+        except Exception as e:
+            logger.warning(f"No se pudo leer la marca de agua de {dataset}: {e}")
+            watermark = None
+        publish(DATASET_CHANGED, {"dataset": dataset, "programa": None, "version": None,
+                                  "watermark": watermark})
+
+    return {
+        "dataset": dataset,
+        "archivos": len(objetos),
+        "ok": len(ok),
+        "errores": len(objetos) - len(ok),
+        "programas": sorted(por_programa),
+        "workers": workers,
+        "db_concurrencia": db_concurrency,
+        "segundos": round(time.perf_counter() - t_inicio, 3),
+        "mantenimiento": mantenimiento,
+        "resultados": reporte,
     }
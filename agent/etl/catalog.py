@@ -0,0 +1,161 @@
+# etl/catalog.py
+from __future__ import annotations
+
+import re
+from typing import Dict
+
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from .db import ensure_schema, upsert_dataframe
+from .utils import normalize_columns
+
+# Prefijo de código de pregunta de LimeSurvey ya normalizado: ig01_1, ep07_18, ipg03_5 ...
+QUESTION_CODE_RE = re.compile(r"^([a-z]+\d+_\d+)(?:_|$)")
+
+# Columnas técnicas que no son preguntas de la encuesta
+NON_QUESTION_COLUMNS = {"id_id_de_respuesta", "programa", "version", "submitdate_fecha_de_envio"}
+
+STOPWORDS = {
+    "de", "del", "la", "las", "el", "los", "en", "su", "sus", "que", "con", "por",
+    "para", "una", "uno", "un", "al", "lo", "se", "es", "usted", "cual", "como",
+}
+
+
+def keywords_for(columna: str, encabezado: str) -> list[str]:
+    tokens = normalize_columns(columna).split("_") + normalize_columns(encabezado).split("_")
+    vistos: Dict[str, None] = {}
+    for t in tokens:
+        if len(t) >= 3 and t not in STOPWORDS and not t.isdigit():
+            vistos.setdefault(t, None)
+    return list(vistos)
+
+
+def build_question_catalog(
+    df: pd.DataFrame,
+    headers: Dict[str, str],
+    perfiles: pd.DataFrame | None = None,
+) -> pd.DataFrame:
+    """
+    Construye el catálogo de preguntas del dataset transformado.
+
+    Por columna: nombre normalizado, código de pregunta, encabezado original,
+    tipo/escala detectados y palabras clave (insumo del índice invertido).
+    Reutiliza los perfiles de columnas si están disponibles.
+    """
+    columnas = [str(c) for c in df.columns]
+    tipos = (
+        perfiles.set_index("columna")["tipo_detectado"].to_dict()
+        if perfiles is not None and not perfiles.empty
+        else {}
+    )
+    cardinalidad = (
+        perfiles.set_index("columna")["cardinalidad"].to_dict()
+        if perfiles is not None and not perfiles.empty
+        else {}
+    )
+
+    # Rango de las columnas numéricas en una sola conversión
+    num_cols = [c for c in columnas if tipos.get(c) == "numerico"]
+    rangos = pd.DataFrame(index=["min", "max"])
+    if num_cols:
+        rangos = df[num_cols].apply(pd.to_numeric, errors="coerce").agg(["min", "max"])
+
+    filas = []
+    for pos, col in enumerate(columnas, start=1):
+        m = QUESTION_CODE_RE.match(col)
+        tipo = tipos.get(col, "texto")
+        escala = None
+        if tipo == "numerico" and col in rangos.columns:
+            lo, hi = rangos.at["min", col], rangos.at["max", col]
+            if pd.notna(lo) and pd.notna(hi):
+                escala = f"{lo:g}-{hi:g}"
+                if float(lo).is_integer() and float(hi).is_integer() and hi - lo <= 10:
+                    tipo = "likert"
+        elif tipo == "categorico" and col in cardinalidad:
+            escala = f"{int(cardinalidad[col])} categorias"
+
+        encabezado = headers.get(col, col)
+        filas.append(
+            {
+                "columna": col,
+                "posicion": pos,
+                "codigo": m.group(1) if m else None,
+                "encabezado": encabezado,
+                "tipo_detectado": tipo,
+                "escala": escala,
+                "es_pregunta": col not in NON_QUESTION_COLUMNS and bool(m),
+                "palabras_clave": " ".join(keywords_for(col, encabezado)),
+            }
+        )
+    return pd.DataFrame(filas)
+
+
+def save_question_catalog(
+    conn: Connection,
+    catalogo: pd.DataFrame,
+    dataset: str,
+    core_schema: str = "core",
+    schema: str = "etl",
+) -> None:
+    """
+    Persiste el catálogo en <schema>.question_catalog y el índice invertido
+    (palabra -> columna) en <schema>.question_keywords.
+
+    core.<dataset> es una sola tabla para todos los programas y cada archivo
+    trae solo sus columnas: se actualizan las filas de las columnas de este
+    archivo, se conservan las que trajeron otros programas y se borran solo
+    las que ya no existen en core. `posicion` es la de la columna en core.
+    """
+    if catalogo.empty:
+        return
+    df = catalogo.copy()
+
+    # Tipo SQL y posición de cada columna en core.<dataset> (evita information_schema en cada request)
+    core_cols = conn.execute(
+        text(
+            "SELECT column_name, data_type, ordinal_position FROM information_schema.columns "
+            "WHERE table_schema = :schema AND table_name = :table"
+        ),
+        {"schema": core_schema, "table": dataset},
+    ).all()
+    tipos_sql = {c: t for c, t, _ in core_cols}
+    posiciones = {c: int(p) for c, _, p in core_cols}
+    df["tipo_sql"] = df["columna"].map(tipos_sql)
+    df["posicion"] = df["columna"].map(posiciones).fillna(df["posicion"]).astype(int)
+    df.insert(0, "dataset", dataset)
+
+    ensure_schema(conn, schema)
+    vigentes = sorted(set(tipos_sql) | set(df["columna"]))
+    params = {"dataset": dataset, "vigentes": vigentes, "cargadas": list(df["columna"])}
+    for tabla, sobra in (("question_catalog", "columna <> ALL(:vigentes)"),
+                         ("question_keywords", "(columna <> ALL(:vigentes) OR columna = ANY(:cargadas))")):
+        if conn.execute(text("SELECT to_regclass(:fq)"), {"fq": f'"{schema}"."{tabla}"'}).scalar():
+            conn.execute(text(f'DELETE FROM "{schema}"."{tabla}" WHERE dataset = :dataset AND {sobra}'), params)
+    upsert_dataframe(conn, df, schema=schema, table="question_catalog", key_columns=("dataset", "columna"))
+
+    indice = (
+        df[["dataset", "columna", "palabras_clave"]]
+        .assign(palabra=df["palabras_clave"].str.split(" "))
+        .explode("palabra")
+        .query("palabra != '' and palabra == palabra")[["dataset", "palabra", "columna"]]
+        .drop_duplicates()
+    )
+    upsert_dataframe(
+        conn, indice, schema=schema, table="question_keywords", key_columns=("dataset", "palabra", "columna")
+    )
+
+
+def load_question_catalog(conn: Connection, dataset: str, schema: str = "etl") -> pd.DataFrame:
+    """
+    Lee el catálogo de un dataset ordenado por posición.
+    Devuelve un DataFrame vacío si la tabla aún no existe.
+    """
+    if not conn.execute(text("SELECT to_regclass(:fq)"), {"fq": f'"{schema}"."question_catalog"'}).scalar():
+        return pd.DataFrame()
+    return pd.read_sql_query(
+        text(f'SELECT * FROM "{schema}"."question_catalog" WHERE dataset = :dataset ORDER BY posicion'),
+        conn,
+        params={"dataset": dataset},
+    )
@@ -2,13 +2,19 @@
 from __future__ import annotations
 
 import os
+import threading
 from hashlib import sha1
-from typing import Iterable
+from typing import Dict, Iterable
 
 import pandas as pd
 from sqlalchemy import create_engine, text
 from sqlalchemy.engine import Engine, Connection
 
+# Estado DDL ya confirmado en la base (esquemas, tablas, índices UNIQUE
+# válidos), recordado por proceso para no repetir consultas ni DDL en cada carga
+_DDL_KNOWN: set[tuple] = set()
+_DDL_LOCK = threading.Lock()
+
 
 # -------------------------------------------------------------------
 # Conexión
@@ -32,21 +38,90 @@ def make_engine(pg_dsn: str | None = None) -> Engine:
     return create_engine(dsn, future=True)
 
 
+# -------------------------------------------------------------------
+# Estado DDL conocido (cache por proceso)
+# -------------------------------------------------------------------
+def _ddl_key(conn: Connection, *partes: object) -> tuple:
+    return (conn.engine.url.render_as_string(hide_password=True), *partes)
+
+
+def _ddl_known(key: tuple) -> bool:
+    with _DDL_LOCK:
+        return key in _DDL_KNOWN
+
+
+def _ddl_remember(key: tuple) -> None:
+    with _DDL_LOCK:
+        _DDL_KNOWN.add(key)
+
+
+def invalidate_ddl_cache() -> None:
+    """
+    Olvida el estado DDL recordado (p.ej. tras un rollback de una carga que
+    creó objetos, o si se borraron tablas a mano); se vuelve a consultar.
+    """
+    with _DDL_LOCK:
+        _DDL_KNOWN.clear()
+
+
 # -------------------------------------------------------------------
 # Schemas / utilidades
 # -------------------------------------------------------------------
 def ensure_schema(conn: Connection, schema: str) -> None:
+    """
+    Crea el esquema si falta. Solo se recuerda si ya existía: uno creado en
+    esta transacción podría deshacerse con un rollback.
+    """
+    key = _ddl_key(conn, "schema", schema)
+    if _ddl_known(key):
+        return
+    if conn.execute(text("SELECT 1 FROM pg_namespace WHERE nspname = :schema"), {"schema": schema}).scalar():
+        _ddl_remember(key)
+        return
     conn.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{schema}"'))
 
 
 def _table_exists(conn: Connection, schema: str, table: str) -> bool:
+    key = _ddl_key(conn, "table", schema, table)
+    if _ddl_known(key):
+        return True
     sql = """
     SELECT 1
     FROM information_schema.tables
     WHERE table_schema = :schema AND table_name = :table
     """
-    res = conn.execute(text(sql), {"schema": schema, "table": table}).scalar()
-    return bool(res)
+    res = bool(conn.execute(text(sql), {"schema": schema, "table": table}).scalar())
+    if res:
+        _ddl_remember(key)
+    return res
+
+
+def ensure_table(conn: Connection, schema: str, table: str, create_sql: str,
+                 columns: Dict[str, str] | None = None) -> None:
+    """
+    CREATE TABLE de una tabla de control del ETL solo si hace falta. Si la
+    tabla ya existe, `columns` ({columna: tipo}) agrega las que falten
+    (tablas creadas por versiones anteriores) sin ALTER en cada carga.
+    """
+    key = _ddl_key(conn, "ddl", schema, table, tuple(sorted(columns or {})))
+    if _ddl_known(key):
+        return
+    ensure_schema(conn, schema)
+    if not _table_exists(conn, schema, table):
+        conn.execute(text(create_sql))
+        return
+    if columns:
+        presentes = {c for (c,) in conn.execute(
+            text("SELECT column_name FROM information_schema.columns "
+                 "WHERE table_schema = :schema AND table_name = :table"),
+            {"schema": schema, "table": table},
+        ).all()}
+        faltantes = {c: t for c, t in columns.items() if c not in presentes}
+        for col, tipo in faltantes.items():
+            conn.execute(text(f'ALTER TABLE "{schema}"."{table}" ADD COLUMN IF NOT EXISTS "{col}" {tipo}'))
+        if faltantes:
+            return
+    _ddl_remember(key)
 
 
 def _safe_index_name(schema: str, table: str, cols: list[str]) -> str:
@@ -57,19 +132,100 @@ def _safe_index_name(schema: str, table: str, cols: list[str]) -> str:
     return base if len(base) <= 60 else f'ux_{schema}_{table}_{sha1(base.encode()).hexdigest()[:8]}'
 
 
+def unique_index_state(conn: Connection, schema: str, table: str,
+                       key_columns: list[str]) -> tuple[bool, str] | None:
+    """
+    (válido, nombre) del índice UNIQUE de `table` exactamente sobre
+    `key_columns` (en cualquier orden, sin predicado ni expresiones), según
+    pg_index; None si no hay. Un CREATE INDEX CONCURRENTLY fallido deja el
+    índice con indisvalid = false.
+    """
+    sql = """
+    SELECT i.indisvalid AND i.indisready, c.relname
+    FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indexrelid
+    WHERE i.indrelid = to_regclass(:fq)
+      AND i.indisunique
+      AND i.indpred IS NULL
+      AND i.indexprs IS NULL
+      AND i.indnkeyatts = :n
+      AND (SELECT array_agg(a.attname::text ORDER BY a.attname::text)
+           FROM pg_attribute a
+           WHERE a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)) = CAST(:cols AS text[])
+    ORDER BY 1 DESC
+    LIMIT 1
+    """
+    fila = conn.execute(text(sql), {
+        "fq": f'"{schema}"."{table}"', "n": len(key_columns), "cols": sorted(key_columns),
+    }).first()
+    return None if fila is None else (bool(fila[0]), fila[1])
+
+
 def ensure_unique_index(conn: Connection, schema: str, table: str, key_columns: list[str]) -> None:
     """
     Crea un índice UNIQUE en (key_columns) si no existe.
     Requisito para que ON CONFLICT (...) funcione.
+
+    Dentro de la transacción de carga: si pg_index ya tiene uno válido no se
+    emite DDL. El CREATE de aquí toma un lock SHARE sobre la tabla, así que
+    sobre tablas existentes las cargas llaman antes a
+    ensure_unique_index_concurrently; este camino queda para tablas recién
+    creadas en la misma transacción.
     """
     if not key_columns:
         raise ValueError("key_columns no puede ser vacío.")
+    key = _ddl_key(conn, "unique", schema, table, tuple(sorted(key_columns)))
+    if _ddl_known(key):
+        return
+    estado = unique_index_state(conn, schema, table, key_columns)
+    if estado is not None and estado[0]:
+        _ddl_remember(key)
+        return
+    if estado is not None:
+        conn.execute(text(f'DROP INDEX IF EXISTS "{schema}"."{estado[1]}"'))
     idx_name = _safe_index_name(schema, table, key_columns)
     cols_csv = ", ".join(f'"{c}"' for c in key_columns)
     sql = f'CREATE UNIQUE INDEX IF NOT EXISTS "{idx_name}" ON "{schema}"."{table}" ({cols_csv})'
     conn.execute(text(sql))
 
 
+def ensure_unique_index_concurrently(engine: Engine, schema: str, table: str,
+                                     key_columns: Iterable[str]) -> bool:
+    """
+    Garantiza, fuera de cualquier transacción, un índice UNIQUE válido sobre
+    `key_columns` de una tabla existente, con CREATE UNIQUE INDEX
+    CONCURRENTLY (no bloquea a otros escritores). Un índice inválido de un
+    intento anterior se borra con DROP INDEX CONCURRENTLY y se reconstruye.
+
+    Debe correr antes de abrir la transacción de carga: CONCURRENTLY espera
+    a que terminen las transacciones con snapshot abierto, incluida la
+    propia. Devuelve False si la tabla todavía no existe.
+    """
+    key_columns = list(key_columns)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        key = _ddl_key(conn, "unique", schema, table, tuple(sorted(key_columns)))
+        if _ddl_known(key):
+            return True
+        if not _table_exists(conn, schema, table):
+            return False
+        estado = unique_index_state(conn, schema, table, key_columns)
+        if estado is not None and estado[0]:
+            _ddl_remember(key)
+            return True
+        if estado is not None:
+            conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{schema}"."{estado[1]}"'))
+        idx_name = _safe_index_name(schema, table, key_columns)
+        cols_csv = ", ".join(f'"{c}"' for c in key_columns)
+        conn.execute(text(
+            f'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS "{idx_name}" ON "{schema}"."{table}" ({cols_csv})'
+        ))
+        estado = unique_index_state(conn, schema, table, key_columns)
+        if estado is None or not estado[0]:
+            raise RuntimeError(f'El índice UNIQUE de "{schema}"."{table}" ({cols_csv}) quedó inválido')
+        _ddl_remember(key)
+        return True
+
+
 def _create_table_from_dataframe(conn: Connection, df: pd.DataFrame, schema: str, table: str) -> None:
     """
     Crea la tabla destino con el layout del DataFrame (sin constraints).
@@ -100,8 +256,6 @@ def upsert_dataframe(
       4) INSERT ... SELECT ... ON CONFLICT (keys) DO UPDATE / DO NOTHING
       5) DROP TABLE temp
     """
-    from uuid import uuid4
-
     key_columns = list(key_columns)
     if not key_columns:
         raise ValueError("key_columns no puede ser vacío.")
@@ -115,6 +269,25 @@ def upsert_dataframe(
     # 2) índice UNIQUE para ON CONFLICT
     ensure_unique_index(conn, schema, table, key_columns)
 
+    # 3-5) temporal + INSERT ... ON CONFLICT + limpieza
+    stage_and_upsert(conn, df, schema, table, key_columns, chunksize)
+
+
+def stage_and_upsert(
+    conn: Connection,
+    df: pd.DataFrame,
+    schema: str,
+    table: str,
+    key_columns: list[str],
+    chunksize: int | None = 5000,
+) -> None:
+    """
+    Pasos 3-5 de upsert_dataframe sobre una tabla que ya existe con su índice
+    UNIQUE: vuelca df a una temporal, hace el UPSERT y la borra. Lo usan
+    también los shards de etl.sharded_upsert, cada uno en su conexión.
+    """
+    from uuid import uuid4
+
     # 3) escribir DataFrame en temporal
     tmp = f"_tmp_{table}_{uuid4().hex[:8]}"
     df.to_sql(
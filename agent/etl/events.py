@@ -0,0 +1,73 @@
+# etl/events.py
+from __future__ import annotations
+
+from collections import defaultdict
+from typing import Any, Callable, Dict, List
+import json
+import logging
+import threading
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+logger = logging.getLogger(__name__)
+
+# Evento emitido al terminar una carga (después del commit y del mantenimiento).
+# Payload: {"dataset", "programa", "version", "watermark"} (watermark: la del dataset)
+DATASET_CHANGED = "dataset_changed"
+
+# Canal de Postgres por el que se anuncia el mismo evento a otros procesos
+# (workers del agente y del backend): ver app/change_feed.py
+CHANGE_CHANNEL = "etl_dataset_changed"
+
+Handler = Callable[[Dict[str, Any]], None]
+
+_HANDLERS: Dict[str, List[Handler]] = defaultdict(list)
+_LOCK = threading.Lock()
+
+
+def subscribe(event: str, handler: Handler) -> None:
+    """Registra `handler` para `event` (una sola vez aunque se llame de nuevo)."""
+    with _LOCK:
+        if handler not in _HANDLERS[event]:
+            _HANDLERS[event].append(handler)
+
+
+def unsubscribe(event: str, handler: Handler) -> None:
+    with _LOCK:
+        if handler in _HANDLERS.get(event, []):
+            _HANDLERS[event].remove(handler)
+
+
+def publish(event: str, payload: Dict[str, Any]) -> int:
+    """
+    Entrega `payload` a los handlers de `event` en este proceso, en orden de
+    registro. Un handler que falla se registra en el log y no corta a los
+    demás. Devuelve cuántos handlers terminaron bien.
+    """
+    with _LOCK:
+        handlers = list(_HANDLERS.get(event, []))
+    ok = 0
+    for handler in handlers:
+        try:
+            handler(payload)
+            ok += 1
+        except Exception:
+            logger.exception(f"Falló un handler de '{event}' con {payload}")
+    return ok
+
+
+def notify_dataset_changed(conn: Connection, dataset: str, programa: object, version: object,
+                           watermark: int | None) -> None:
+    """
+    pg_notify(CHANGE_CHANNEL, payload JSON) dentro de la transacción de carga:
+    Postgres solo entrega la notificación al hacer commit (y nunca si hay
+    rollback), así que los listeners no ven cargas a medias.
+    """
+    payload = json.dumps({
+        "dataset": dataset,
+        "programa": None if programa is None else str(programa),
+        "version": None if version is None else str(version),
+        "watermark": watermark,
+    })
+    conn.execute(text("SELECT pg_notify(:canal, :payload)"), {"canal": CHANGE_CHANNEL, "payload": payload})
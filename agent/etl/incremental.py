@@ -0,0 +1,137 @@
+# etl/incremental.py
+from __future__ import annotations
+
+from typing import Any, Dict, Tuple
+import os
+
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from .db import ensure_table
+from .utils import normalize_columns, rename_aliases
+
+# Carga incremental: los exports de LimeSurvey son acumulativos, así que se
+# descartan (antes del transform) las respuestas ya cargadas según una marca
+# por (dataset, programa) sobre la fecha de envío o, si no está, el id
+ETL_INCREMENTAL = os.getenv("ETL_INCREMENTAL", "false").lower() == "true"
+
+# columna normalizada -> cómo se compara
+INCREMENTAL_COLUMNS: Dict[str, str] = {
+    "submitdate_fecha_de_envio": "fecha",
+    "id_id_de_respuesta": "numero",
+}
+
+
+def mark_per_version(columna: str) -> bool:
+    """
+    True si la marca solo vale dentro de una versión: el id de respuesta lo
+    numera cada encuesta de LimeSurvey desde 1, así que el de una versión
+    nueva no es comparable con la marca de la anterior (la fecha sí).
+    """
+    return INCREMENTAL_COLUMNS[columna] == "numero"
+
+
+def incremental_column(df: pd.DataFrame) -> Tuple[str, str] | None:
+    """(columna original, columna normalizada) que sirve de marca, o None si no hay ninguna."""
+    normalizadas = rename_aliases(df.head(0).rename(columns=normalize_columns)).columns
+    originales = dict(zip(normalizadas, df.columns))
+    for columna in INCREMENTAL_COLUMNS:
+        if columna in originales:
+            return originales[columna], columna
+    return None
+
+
+def incremental_values(serie: pd.Series, columna: str) -> pd.Series:
+    """Valores comparables de la columna marca (NaT/NaN si no se pueden interpretar)."""
+    if INCREMENTAL_COLUMNS[columna] == "fecha":
+        return pd.to_datetime(serie, errors="coerce")
+    return pd.to_numeric(serie, errors="coerce")
+
+
+def _to_text(valor: Any, columna: str) -> str:
+    if INCREMENTAL_COLUMNS[columna] == "fecha":
+        return pd.Timestamp(valor).isoformat()
+    return repr(float(valor))
+
+
+def _from_text(valor: str, columna: str) -> Any:
+    if INCREMENTAL_COLUMNS[columna] == "fecha":
+        return pd.Timestamp(valor)
+    return float(valor)
+
+
+def _ensure_ingest_watermarks_table(conn: Connection, schema: str) -> None:
+    ensure_table(conn, schema, "ingest_watermarks", f'''
+        CREATE TABLE IF NOT EXISTS "{schema}"."ingest_watermarks" (
+            dataset         TEXT NOT NULL,
+            programa        TEXT NOT NULL,
+            columna         TEXT NOT NULL,
+            valor           TEXT NOT NULL,
+            version         TEXT,
+            actualizado_en  TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (dataset, programa)
+        )
+    ''', columns={"version": "TEXT"})
+
+
+def read_ingest_watermark(conn: Connection, dataset: str, programa: object, version: object = None,
+                          schema: str = "etl") -> Tuple[str, Any] | None:
+    """
+    (columna, valor) de la última respuesta cargada de (dataset, programa),
+    o None. Una marca por id de otra `version` no aplica (mark_per_version).
+    """
+    if not conn.execute(text("SELECT to_regclass(:fq)"), {"fq": f'"{schema}"."ingest_watermarks"'}).scalar():
+        return None
+    # to_jsonb: tablas previas aún sin columna version (la agrega el primer save)
+    fila = conn.execute(
+        text(f'SELECT columna, valor, to_jsonb(w) ->> \'version\' FROM "{schema}"."ingest_watermarks" w '
+             'WHERE dataset = :dataset AND programa = :programa'),
+        {"dataset": dataset, "programa": str(programa)},
+    ).first()
+    if fila is None or fila[0] not in INCREMENTAL_COLUMNS:
+        return None
+    if mark_per_version(fila[0]) and fila[2] != (None if version is None else str(version)):
+        return None
+    return fila[0], _from_text(fila[1], fila[0])
+
+
+def save_ingest_watermark(conn: Connection, dataset: str, programa: object, columna: str, valor: Any,
+                          version: object = None, schema: str = "etl") -> bool:
+    """
+    Registra la marca dentro de la transacción de carga: solo avanza si la
+    carga hace commit, y nunca retrocede. Las cargas de un lote se preparan
+    en paralelo contra la misma marca vieja y pueden confirmar en cualquier
+    orden, así que la vigente se compara ya tipada (`valor` es texto) bajo
+    un lock de fila. Una marca por id de otra versión se reemplaza (no se
+    compara). Devuelve True si la marca cambió.
+    """
+    _ensure_ingest_watermarks_table(conn, schema)
+    tabla = f'"{schema}"."ingest_watermarks"'
+    params = {"dataset": dataset, "programa": str(programa), "columna": columna,
+              "valor": _to_text(valor, columna), "version": None if version is None else str(version)}
+    # la fila tiene que existir para poder bloquearla
+    if conn.execute(text(f'''
+        INSERT INTO {tabla} (dataset, programa, columna, valor, version)
+        VALUES (:dataset, :programa, :columna, :valor, :version)
+        ON CONFLICT (dataset, programa) DO NOTHING
+        RETURNING 1
+    '''), params).first() is not None:
+        return True
+
+    actual = conn.execute(
+        text(f"SELECT columna, valor, version FROM {tabla} "
+             "WHERE dataset = :dataset AND programa = :programa FOR UPDATE"),
+        params,
+    ).first()
+    vigente = None
+    if actual is not None and actual[0] == columna:
+        if not mark_per_version(columna) or actual[2] == params["version"]:
+            vigente = _from_text(actual[1], columna)
+    if vigente is not None and vigente >= _from_text(params["valor"], columna):
+        return False
+    conn.execute(text(f'''
+        UPDATE {tabla} SET columna = :columna, valor = :valor, version = :version, actualizado_en = now()
+        WHERE dataset = :dataset AND programa = :programa
+    '''), params)
+    return True
@@ -13,23 +13,26 @@ def _read_local(path: str) -> pd.DataFrame:
         return pd.read_excel(path)
     raise ValueError(f"Extensión no soportada para '{path}'")
 
-def _read_minio(url: str) -> pd.DataFrame:
-    """Lectura sencilla desde MinIO/S3 usando credenciales de entorno."""
+def minio_client():
+    """Cliente MinIO/S3 con las credenciales de entorno (MINIO_*)."""
     try:
         from minio import Minio
     except Exception as e:
-        raise RuntimeError("Para leer minio:// necesitas instalar 'minio' en Poetry") from e
-
-    u = urlparse(url)
-    bucket = u.netloc
-    key = u.path.lstrip("/")
+        raise RuntimeError("Para usar MinIO necesitas instalar 'minio' en Poetry") from e
 
     endpoint = os.getenv("MINIO_ENDPOINT", "minio:9000")
     access = os.getenv("MINIO_ACCESS_KEY")
     secret = os.getenv("MINIO_SECRET_KEY")
     secure = os.getenv("MINIO_SECURE", "false").lower() == "true"
+    return Minio(endpoint, access_key=access, secret_key=secret, secure=secure)
+
+def _read_minio(url: str) -> pd.DataFrame:
+    """Lectura sencilla desde MinIO/S3 usando credenciales de entorno."""
+    u = urlparse(url)
+    bucket = u.netloc
+    key = u.path.lstrip("/")
 
-    client = Minio(endpoint, access_key=access, secret_key=secret, secure=secure)
+    client = minio_client()
     resp = client.get_object(bucket, key)
     data = resp.read()  # bytes
 
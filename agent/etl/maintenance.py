@@ -0,0 +1,171 @@
+# etl/maintenance.py
+from __future__ import annotations
+
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Tuple
+import logging
+import os
+import time
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from .db import ensure_table
+
+logger = logging.getLogger(__name__)
+
+# Etapa post-carga: ANALYZE de las tablas tocadas y refresh de vistas materializadas
+ETL_MAINTENANCE = os.getenv("ETL_MAINTENANCE", "true").lower() == "true"
+ETL_REFRESH_MATVIEWS = os.getenv("ETL_REFRESH_MATVIEWS", "true").lower() == "true"
+ETL_MAINTENANCE_LOG = os.getenv("ETL_MAINTENANCE_LOG", "true").lower() == "true"
+
+# Tablas de agregados por dataset: fn(conn, dataset, programa) las recalcula
+AggregateHook = Callable[[Connection, str, object], None]
+_AGGREGATE_HOOKS: Dict[str, List[Tuple[str, AggregateHook]]] = defaultdict(list)
+
+
+def register_aggregate(dataset: str, nombre: str, hook: AggregateHook) -> None:
+    """Registra el refresco de una tabla de agregados derivada de core.<dataset>."""
+    if all(n != nombre for n, _ in _AGGREGATE_HOOKS[dataset]):
+        _AGGREGATE_HOOKS[dataset].append((nombre, hook))
+
+
+def _fq(schema: str, name: str) -> str:
+    return f'"{schema}"."{name}"'
+
+
+def dependent_matviews(conn: Connection, schema: str, table: str) -> List[Tuple[str, str, bool, bool]]:
+    """
+    Vistas materializadas que dependen (directa o transitivamente, también a
+    través de vistas comunes) de schema.table, según pg_depend/pg_rewrite.
+
+    Devuelve [(schema, nombre, poblada, tiene_indice_unico)] en orden de
+    dependencia: una vista aparece después de las que lee.
+    """
+    sql = '''
+        WITH RECURSIVE deps(oid, nivel) AS (
+            SELECT DISTINCT r.ev_class, 1
+            FROM pg_depend d
+            JOIN pg_rewrite r ON r.oid = d.objid
+            WHERE d.classid = 'pg_rewrite'::regclass
+              AND d.refobjid = to_regclass(:fq)
+              AND r.ev_class <> d.refobjid
+            UNION
+            SELECT r.ev_class, deps.nivel + 1
+            FROM deps
+            JOIN pg_depend d ON d.refobjid = deps.oid AND d.classid = 'pg_rewrite'::regclass
+            JOIN pg_rewrite r ON r.oid = d.objid
+            WHERE r.ev_class <> deps.oid
+        )
+        SELECT n.nspname, c.relname, c.relispopulated,
+               EXISTS (
+                   SELECT 1 FROM pg_index i
+                   WHERE i.indrelid = c.oid AND i.indisunique AND i.indpred IS NULL
+               ) AS tiene_unico
+        FROM deps
+        JOIN pg_class c ON c.oid = deps.oid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.relkind = 'm'
+        GROUP BY n.nspname, c.relname, c.relispopulated, c.oid
+        ORDER BY MAX(deps.nivel), n.nspname, c.relname
+    '''
+    rows = conn.execute(text(sql), {"fq": _fq(schema, table)}).all()
+    return [(s, n, bool(p), bool(u)) for s, n, p, u in rows]
+
+
+def _log_steps(conn: Connection, schema: str, dataset: str, programa: object,
+               watermark: int | None, pasos: List[dict]) -> None:
+    ensure_table(conn, schema, "load_maintenance", f'''
+        CREATE TABLE IF NOT EXISTS "{schema}"."load_maintenance" (
+            id            BIGSERIAL PRIMARY KEY,
+            dataset       TEXT NOT NULL,
+            programa      TEXT,
+            watermark     BIGINT,
+            paso          TEXT NOT NULL,
+            objeto        TEXT,
+            segundos      DOUBLE PRECISION NOT NULL,
+            ok            BOOLEAN NOT NULL,
+            error         TEXT,
+            ejecutado_en  TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    ''')
+    conn.execute(
+        text(f'''
+            INSERT INTO "{schema}"."load_maintenance"
+                (dataset, programa, watermark, paso, objeto, segundos, ok, error)
+            VALUES (:dataset, :programa, :watermark, :paso, :objeto, :segundos, :ok, :error)
+        '''),
+        [
+            {
+                "dataset": dataset,
+                "programa": None if programa is None else str(programa),
+                "watermark": watermark,
+                "paso": p["paso"],
+                "objeto": p.get("objeto"),
+                "segundos": p["segundos"],
+                "ok": p["ok"],
+                "error": p.get("error"),
+            }
+            for p in pasos
+        ],
+    )
+
+
+def run_post_load(engine: Engine, dataset: str, tables: Iterable[Tuple[str, str]],
+                  programa: object = None, watermark: int | None = None,
+                  core_schema: str = "core", etl_schema: str = "etl") -> dict:
+    """
+    Mantenimiento después del commit de una carga (nunca alarga su transacción):
+
+      1) ANALYZE de cada tabla tocada (`tables` = [(schema, tabla)]), para que
+         el planner no use estadísticas viejas hasta que pase autovacuum
+      2) REFRESH MATERIALIZED VIEW de las vistas que dependen de
+         core.<dataset> (CONCURRENTLY si tiene índice único y ya está poblada)
+      3) hooks de tablas de agregados registrados para el dataset
+
+    Corre en autocommit (REFRESH ... CONCURRENTLY no admite un bloque de
+    transacción). Cada paso se mide y un fallo no detiene a los siguientes.
+    Los tiempos se guardan en etl.load_maintenance y se devuelven:
+    {"pasos": [{paso, objeto, segundos, ok, error?}], "segundos": total}
+    """
+    pasos: List[dict] = []
+    t_total = time.perf_counter()
+
+    def _paso(paso: str, objeto: str, fn: Callable[[], None]) -> None:
+        t0 = time.perf_counter()
+        registro = {"paso": paso, "objeto": objeto, "ok": True}
+        try:
+            fn()
+        except Exception as e:
+            logger.warning(f"Mantenimiento post-carga: falló {paso} {objeto}: {e}")
+            registro.update(ok=False, error=str(e))
+        registro["segundos"] = round(time.perf_counter() - t0, 4)
+        pasos.append(registro)
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for schema, table in dict.fromkeys(tables):
+            _paso("analyze", f"{schema}.{table}", lambda s=schema, t=table: conn.execute(text(f"ANALYZE {_fq(s, t)}")))
+
+        if ETL_REFRESH_MATVIEWS:
+            try:
+                vistas = dependent_matviews(conn, core_schema, dataset)
+            except Exception as e:
+                logger.warning(f"No se pudieron listar las vistas materializadas de {dataset}: {e}")
+                vistas = []
+            for schema, nombre, poblada, unico in vistas:
+                modo = "CONCURRENTLY " if poblada and unico else ""
+                sql = f"REFRESH MATERIALIZED VIEW {modo}{_fq(schema, nombre)}"
+                _paso("refresh_matview", f"{schema}.{nombre}", lambda q=sql: conn.execute(text(q)))
+
+        for nombre, hook in list(_AGGREGATE_HOOKS.get(dataset, [])):
+            _paso("aggregate", nombre, lambda h=hook: h(conn, dataset, programa))
+
+        resultado = {"pasos": pasos, "segundos": round(time.perf_counter() - t_total, 4)}
+        if ETL_MAINTENANCE_LOG and pasos:
+            try:
+                _log_steps(conn, etl_schema, dataset, programa, watermark, pasos)
+            except Exception as e:
+                logger.warning(f"No se pudieron registrar los tiempos de mantenimiento de {dataset}: {e}")
+
+    logger.info(f"Mantenimiento post-carga de {dataset}: {resultado}")
+    return resultado
@@ -0,0 +1,127 @@
+# etl/profiles.py
+from __future__ import annotations
+
+import json
+
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from .db import ensure_schema, upsert_dataframe
+
+# Valores que, tras la limpieza de strings del ETL (astype(str)), representan nulos
+NULL_TOKENS = {"", "nan", "none", "nat", "<na>", "null"}
+
+PROFILE_KEYS = ("dataset", "programa", "version", "columna")
+
+
+def compute_column_profiles(df: pd.DataFrame, top_n: int = 5) -> pd.DataFrame:
+    """
+    Calcula el perfil de cada columna del DataFrame en una sola pasada vectorizada.
+
+    El frame se lleva a formato largo (columna, valor) una única vez y de ahí
+    salen todas las métricas con groupby:
+      - n_total, n_nulos, pct_nulos
+      - cardinalidad (valores distintos no nulos)
+      - top_valores (JSON: [{"valor": ..., "total": n}, ...])
+      - pct_numerico (conformidad con tipo numérico sobre los no nulos)
+      - tipo_detectado: fecha | numerico | categorico | texto
+    """
+    n = len(df)
+    columnas = pd.Index(df.columns.astype(str))
+    cols_cat = pd.CategoricalDtype(categories=columnas.unique())
+
+    largo = df.astype("string").melt(var_name="columna", value_name="valor")
+    largo["columna"] = largo["columna"].astype(str).astype(cols_cat)
+    valor = largo["valor"].str.strip()
+    nulo = (valor.isna() | valor.str.lower().isin(NULL_TOKENS)).to_numpy(dtype=bool)
+
+    n_nulos = pd.Series(nulo).groupby(largo["columna"].to_numpy(), observed=False).sum()
+    n_nulos = n_nulos.reindex(cols_cat.categories, fill_value=0)
+
+    validos = pd.DataFrame({"columna": largo["columna"][~nulo], "valor": valor[~nulo]})
+    conteos = validos.groupby(["columna", "valor"], observed=True).size()
+    cardinalidad = conteos.groupby(level=0, observed=False).size().reindex(cols_cat.categories, fill_value=0)
+    top = conteos.sort_values(ascending=False, kind="stable").groupby(level=0, observed=True).head(top_n)
+
+    es_num = pd.to_numeric(validos["valor"], errors="coerce").notna()
+    pct_numerico = es_num.groupby(validos["columna"], observed=False).mean().reindex(cols_cat.categories)
+
+    top_por_col: dict[str, list[dict]] = {}
+    for (col, val), total in top.items():
+        top_por_col.setdefault(col, []).append({"valor": val, "total": int(total)})
+
+    dtypes = pd.Series(df.dtypes.astype(str).to_numpy(), index=columnas)
+    dtypes = dtypes[~dtypes.index.duplicated()]
+
+    perfiles = pd.DataFrame({
+        "columna": cols_cat.categories.astype(str),
+        "dtype": dtypes.reindex(cols_cat.categories).to_numpy(),
+        "n_total": n,
+        "n_nulos": n_nulos.astype(int).to_numpy(),
+        "cardinalidad": cardinalidad.astype(int).to_numpy(),
+        "pct_numerico": pct_numerico.fillna(0.0).round(4).to_numpy(),
+    })
+    perfiles["pct_nulos"] = (perfiles["n_nulos"] * 100.0 / n).round(2) if n else 0.0
+    perfiles["top_valores"] = [
+        json.dumps(top_por_col.get(c, []), ensure_ascii=False) for c in perfiles["columna"]
+    ]
+    perfiles["tipo_detectado"] = _detect_types(perfiles)
+    return perfiles
+
+
+def _detect_types(perfiles: pd.DataFrame) -> pd.Series:
+    tipo = pd.Series("texto", index=perfiles.index)
+    tipo[perfiles["cardinalidad"] <= 20] = "categorico"
+    tipo[perfiles["pct_numerico"] >= 0.95] = "numerico"
+    tipo[perfiles["dtype"].str.startswith("datetime")] = "fecha"
+    return tipo
+
+
+def save_column_profiles(
+    conn: Connection,
+    perfiles: pd.DataFrame,
+    dataset: str,
+    programa: object,
+    version: object,
+    schema: str = "etl",
+    table: str = "column_profiles",
+) -> None:
+    """
+    Persiste los perfiles en <schema>.<table> (UPSERT por dataset/programa/version/columna).
+    """
+    if perfiles.empty:
+        return
+    df = perfiles.copy()
+    df.insert(0, "version", str(version))
+    df.insert(0, "programa", str(programa))
+    df.insert(0, "dataset", dataset)
+    df["calculado_en"] = pd.Timestamp.now(tz="UTC")
+
+    ensure_schema(conn, schema)
+    upsert_dataframe(conn, df, schema=schema, table=table, key_columns=PROFILE_KEYS)
+
+
+def load_column_profiles(
+    conn: Connection,
+    dataset: str,
+    programa: str | None = None,
+    schema: str = "etl",
+    table: str = "column_profiles",
+) -> pd.DataFrame:
+    """
+    Lee los perfiles guardados para un dataset (y opcionalmente un programa).
+    Devuelve un DataFrame vacío si la tabla aún no existe.
+    """
+    exists = conn.execute(
+        text("SELECT to_regclass(:fq)"), {"fq": f'"{schema}"."{table}"'}
+    ).scalar()
+    if not exists:
+        return pd.DataFrame()
+
+    sql = f'SELECT * FROM "{schema}"."{table}" WHERE dataset = :dataset'
+    params: dict = {"dataset": dataset}
+    if programa is not None:
+        sql += " AND programa = :programa"
+        params["programa"] = programa
+    return pd.read_sql_query(text(sql), conn, params=params)
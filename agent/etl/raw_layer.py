@@ -0,0 +1,158 @@
+# etl/raw_layer.py
+from __future__ import annotations
+
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+from urllib.parse import quote
+from uuid import uuid4
+import io
+import logging
+import os
+
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from .db import ensure_table
+from .io import minio_client
+
+logger = logging.getLogger(__name__)
+
+# Capa raw: "postgres" = copia de filas en raw.<dataset> (append-only);
+# "parquet" = un objeto Parquet inmutable por ingesta en MinIO + catálogo
+# en etl.raw_objects. Es opt-in (RAW_LAYER_MODE=parquet): las ingestas
+# anteriores quedan en raw.<dataset> y las nuevas solo en el catálogo
+# (list_raw_objects / read_raw)
+RAW_LAYER_MODE = os.getenv("RAW_LAYER_MODE", "postgres").lower()
+RAW_LAYER_BUCKET = os.getenv("RAW_LAYER_BUCKET", "raw")
+RAW_LAYER_COMPRESSION = os.getenv("RAW_LAYER_COMPRESSION", "zstd")
+
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except Exception as e:
+        raise RuntimeError("Para la capa raw en Parquet necesitas instalar 'pyarrow' en Poetry") from e
+    return pa, pq
+
+
+def raw_object_key(dataset: str, programa: object, ingesta: str) -> str:
+    """Misma convención que las fuentes en MinIO: <PROGRAMA>/<DATASET>/..."""
+    return f"{quote(str(programa), safe='')}/{dataset}/ingesta={ingesta}.parquet"
+
+
+def write_raw_object(df: pd.DataFrame, dataset: str, programa: object, version: object,
+                     source: str, source_sha256: str | None = None) -> Dict[str, Any]:
+    """
+    Sube `df` tal como se leyó (encabezados originales, valores como texto)
+    como un Parquet comprimido nuevo; nunca se sobrescribe. Devuelve la
+    entrada para el catálogo (ver register_raw_object).
+    """
+    pa, pq = _pyarrow()
+    ingesta = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{uuid4().hex[:8]}"
+    # texto como en raw.<dataset>: un export puede mezclar tipos en una columna
+    tabla = pa.Table.from_pandas(
+        df.rename(columns=str).astype("string"), preserve_index=False
+    ).replace_schema_metadata({
+        "dataset": dataset,
+        "programa": str(programa),
+        "version": str(version),
+        "source": source,
+        "source_sha256": source_sha256 or "",
+    })
+    buffer = io.BytesIO()
+    pq.write_table(tabla, buffer, compression=RAW_LAYER_COMPRESSION)
+    tamano = buffer.tell()
+    buffer.seek(0)
+
+    client = minio_client()
+    if not client.bucket_exists(RAW_LAYER_BUCKET):
+        client.make_bucket(RAW_LAYER_BUCKET)
+    key = raw_object_key(dataset, programa, ingesta)
+    client.put_object(RAW_LAYER_BUCKET, key, buffer, length=tamano,
+                      content_type="application/vnd.apache.parquet")
+    return {
+        "ingesta": ingesta,
+        "dataset": dataset,
+        "programa": str(programa),
+        "version": str(version),
+        "bucket": RAW_LAYER_BUCKET,
+        "object_name": key,
+        "filas": len(df),
+        "columnas": len(df.columns),
+        "bytes": tamano,
+        "source": source,
+        "source_sha256": source_sha256,
+    }
+
+
+def delete_raw_object(entrada: Dict[str, Any]) -> None:
+    """Borra el objeto de una carga que no llegó a commit (no quedó en el catálogo)."""
+    try:
+        minio_client().remove_object(entrada["bucket"], entrada["object_name"])
+    except Exception as e:
+        logger.warning(f"No se pudo borrar el raw huérfano {entrada['object_name']}: {e}")
+
+
+def _ensure_raw_objects_table(conn: Connection, schema: str) -> None:
+    ensure_table(conn, schema, "raw_objects", f'''
+        CREATE TABLE IF NOT EXISTS "{schema}"."raw_objects" (
+            ingesta        TEXT PRIMARY KEY,
+            dataset        TEXT NOT NULL,
+            programa       TEXT NOT NULL,
+            version        TEXT,
+            bucket         TEXT NOT NULL,
+            object_name    TEXT NOT NULL,
+            filas          INT NOT NULL,
+            columnas       INT NOT NULL,
+            bytes          BIGINT NOT NULL,
+            source         TEXT,
+            source_sha256  TEXT,
+            cargado_en     TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    ''')
+
+
+def register_raw_object(conn: Connection, entrada: Dict[str, Any], schema: str = "etl") -> None:
+    """Registra el objeto en <schema>.raw_objects dentro de la transacción de carga."""
+    _ensure_raw_objects_table(conn, schema)
+    conn.execute(text(f'''
+        INSERT INTO "{schema}"."raw_objects"
+            (ingesta, dataset, programa, version, bucket, object_name, filas, columnas, bytes,
+             source, source_sha256)
+        VALUES (:ingesta, :dataset, :programa, :version, :bucket, :object_name, :filas, :columnas,
+                :bytes, :source, :source_sha256)
+    '''), entrada)
+
+
+def list_raw_objects(conn: Connection, dataset: str, programa: str | None = None,
+                     schema: str = "etl") -> List[Dict[str, Any]]:
+    """Entradas del catálogo raw de `dataset` (o de un programa), de la más antigua a la más nueva."""
+    if not conn.execute(text("SELECT to_regclass(:fq)"), {"fq": f'"{schema}"."raw_objects"'}).scalar():
+        return []
+    sql = f'SELECT * FROM "{schema}"."raw_objects" WHERE dataset = :dataset'
+    params: dict = {"dataset": dataset}
+    if programa is not None:
+        sql += " AND programa = :programa"
+        params["programa"] = programa
+    return [dict(r) for r in conn.execute(text(sql + " ORDER BY cargado_en"), params).mappings().all()]
+
+
+def read_raw(entradas: List[Dict[str, Any]]) -> pd.DataFrame:
+    """
+    Reconstruye las filas raw de las entradas del catálogo (para reprocesar
+    o auditar), con `programa`, `version` e `ingesta` de cada objeto.
+    """
+    _, pq = _pyarrow()
+    client = minio_client()
+    partes = []
+    for e in entradas:
+        resp = client.get_object(e["bucket"], e["object_name"])
+        try:
+            df = pq.read_table(io.BytesIO(resp.read())).to_pandas()
+        finally:
+            resp.close()
+            resp.release_conn()
+        partes.append(df.assign(programa=e["programa"], version=e["version"], ingesta=e["ingesta"]))
+    return pd.concat(partes, ignore_index=True) if partes else pd.DataFrame()
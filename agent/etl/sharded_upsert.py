@@ -0,0 +1,324 @@
+# etl/sharded_upsert.py
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List
+from uuid import uuid4
+import logging
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from .db import ensure_table, ensure_unique_index_concurrently, stage_and_upsert
+from .events import notify_dataset_changed
+from .watermarks import bump_watermark, read_watermark
+
+logger = logging.getLogger(__name__)
+
+# UPSERT a core repartido por hash de la llave en N conexiones concurrentes
+# (cada una en su backend de Postgres). 1 = UPSERT único de siempre.
+CORE_UPSERT_SHARDS = int(os.getenv("CORE_UPSERT_SHARDS", "1"))
+CORE_UPSERT_SHARD_MIN_ROWS = int(os.getenv("CORE_UPSERT_SHARD_MIN_ROWS", "20000"))
+# Transacciones preparadas más viejas que esto son de un coordinador caído:
+# la recuperación las confirma o deshace según la decisión registrada
+CORE_UPSERT_ORPHAN_S = int(os.getenv("CORE_UPSERT_ORPHAN_S", "600"))
+# Cada cuánto la API corre la recuperación (además de al arrancar); 0 = solo al arrancar
+CORE_UPSERT_RECOVERY_S = float(os.getenv("CORE_UPSERT_RECOVERY_S", "60"))
+
+GID_PREFIX = "paaa_upsert"
+
+
+def shard_ids(df: pd.DataFrame, key_columns: Iterable[str], shards: int) -> np.ndarray:
+    """Shard de cada fila (hash estable de las llaves): llaves iguales caen en el mismo shard."""
+    hashes = pd.util.hash_pandas_object(df[list(key_columns)], index=False).to_numpy()
+    return (hashes % np.uint64(shards)).astype(np.int64)
+
+
+def _ensure_decisions_table(conn: Connection, schema: str) -> None:
+    ensure_table(conn, schema, "sharded_upsert_commits", f'''
+        CREATE TABLE IF NOT EXISTS "{schema}"."sharded_upsert_commits" (
+            grupo       TEXT PRIMARY KEY,
+            tabla       TEXT NOT NULL,
+            shards      INT NOT NULL,
+            programa    TEXT,
+            version     TEXT,
+            source_sha256 TEXT,
+            creado_en   TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    ''', columns={"programa": "TEXT", "version": "TEXT", "source_sha256": "TEXT"})
+
+
+def _autocommit(engine: Engine):
+    return engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+
+
+def max_prepared_transactions(engine: Engine) -> int:
+    with engine.connect() as conn:
+        return int(conn.execute(text("SHOW max_prepared_transactions")).scalar() or 0)
+
+
+def release_decision(conn: Connection, grupo: str, etl_schema: str = "etl") -> int | None:
+    """
+    Borra la decisión de un grupo cuyos shards ya están todos confirmados y,
+    en la misma transacción, avanza la marca de agua de su (dataset,
+    programa) y avisa del cambio. Devuelve la marca nueva del programa, o
+    None si no había nada que publicar (otro proceso ya la liberó): quien
+    borra la fila es quien publica, así que la marca sube una sola vez y
+    nunca antes de que core tenga todas las filas.
+    """
+    fila = conn.execute(
+        text(f'DELETE FROM "{etl_schema}"."sharded_upsert_commits" WHERE grupo = :grupo '
+             'RETURNING tabla, programa, version, source_sha256'),
+        {"grupo": grupo},
+    ).first()
+    if fila is None:
+        return None
+    tabla, programa, version, sha256 = fila
+    if programa is None and version is None:
+        # decisión registrada por una versión anterior, que ya publicó la marca
+        return None
+    dataset = tabla.split(".", 1)[-1]
+    marca = bump_watermark(conn, dataset, programa=programa, version=version, schema=etl_schema,
+                           source_sha256=sha256)
+    notify_dataset_changed(conn, dataset, programa=programa, version=version,
+                           watermark=read_watermark(conn, dataset, schema=etl_schema))
+    return marca
+
+
+def recover_sharded_upserts(engine: Engine, etl_schema: str = "etl") -> dict:
+    """
+    Termina los UPSERT repartidos que quedaron a medias (coordinador caído o
+    COMMIT PREPARED fallido). Solo toca lo más viejo que CORE_UPSERT_ORPHAN_S,
+    para no competir con un coordinador vivo: las transacciones preparadas
+    con decisión registrada se confirman y las demás se deshacen; las
+    decisiones sin shards pendientes se liberan (release_decision), lo que
+    publica la marca de agua que el coordinador no llegó a publicar.
+    """
+    reporte = {"confirmadas": 0, "deshechas": 0, "publicadas": 0}
+    with _autocommit(engine) as conn:
+        preparadas = conn.execute(text(
+            "SELECT gid, prepared < now() - make_interval(secs => :edad) FROM pg_prepared_xacts "
+            "WHERE database = current_database() AND gid LIKE :prefijo"
+        ), {"prefijo": f"{GID_PREFIX}:%", "edad": CORE_UPSERT_ORPHAN_S}).all()
+        decididos = set()
+        if conn.execute(text("SELECT to_regclass(:fq)"),
+                        {"fq": f'"{etl_schema}"."sharded_upsert_commits"'}).scalar():
+            decididos = {g for (g,) in conn.execute(text(
+                f'SELECT grupo FROM "{etl_schema}"."sharded_upsert_commits" '
+                'WHERE creado_en < now() - make_interval(secs => :edad)'),
+                {"edad": CORE_UPSERT_ORPHAN_S}).all()}
+        vivos = set()
+        for gid, huerfana in preparadas:
+            grupo = gid.split(":")[1]
+            if not huerfana:
+                vivos.add(grupo)
+            elif grupo in decididos:
+                conn.execute(text(f"COMMIT PREPARED '{gid}'"))
+                reporte["confirmadas"] += 1
+            else:
+                conn.execute(text(f"ROLLBACK PREPARED '{gid}'"))
+                reporte["deshechas"] += 1
+    for grupo in sorted(decididos - vivos):
+        with engine.begin() as conn:
+            reporte["publicadas"] += int(release_decision(conn, grupo, etl_schema) is not None)
+    if any(reporte.values()):
+        logger.warning(f"Recuperación de UPSERT repartidos: {reporte}")
+    return reporte
+
+
+class ShardedUpsertRecovery:
+    """
+    Hilo de fondo de la API que corre recover_sharded_upserts al arrancar y
+    luego cada CORE_UPSERT_RECOVERY_S: los shards de una carga cuyo
+    coordinador murió (o cuyo COMMIT PREPARED falló) no esperan a la
+    próxima carga repartida para confirmarse ni para publicar su marca.
+    """
+
+    def __init__(self, dsn: str | None = None, etl_schema: str = "etl",
+                 interval_s: float = CORE_UPSERT_RECOVERY_S):
+        self.dsn = dsn
+        self.etl_schema = etl_schema
+        self.interval_s = interval_s
+        self.stats = {"corridas": 0, "errores": 0}
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def run_once(self) -> dict | None:
+        from .db import make_engine
+
+        try:
+            reporte = recover_sharded_upserts(make_engine(self.dsn), self.etl_schema)
+        except Exception as e:
+            self.stats["errores"] += 1
+            logger.warning(f"Falló la recuperación de UPSERT repartidos: {e}")
+            return None
+        self.stats["corridas"] += 1
+        return reporte
+
+    def _run(self) -> None:
+        self.run_once()
+        while self.interval_s > 0 and not self._stop.wait(self.interval_s):
+            self.run_once()
+
+    def start(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="upsert-recovery", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+class ShardedUpsert:
+    """
+    UPSERT de un DataFrame repartido en `shards` conexiones, todo o nada:
+
+      1) prepare(): cada shard (filas con hash(llave) % N == i) vuelca su
+         temporal y hace su INSERT ... ON CONFLICT en su propia conexión, en
+         paralelo, y termina con PREPARE TRANSACTION. Los conjuntos de llaves
+         son disjuntos, así que no se bloquean entre sí. Si un shard falla,
+         se deshacen todos.
+      2) record(conn): registra la decisión (grupo) dentro de la transacción
+         principal de la carga; el commit de esa transacción es el punto de
+         no retorno.
+      3) commit(): COMMIT PREPARED de cada shard; devuelve cuántos quedaron
+         pendientes. Con 0, release(conn) borra la decisión y publica la
+         marca de agua; si no (o si el proceso muere antes),
+         recover_sharded_upserts termina el trabajo y publica.
+      rollback(): ROLLBACK PREPARED de todos (la carga principal falló).
+
+    La tabla y su índice UNIQUE deben existir y estar confirmados: el DDL
+    tomaría locks que bloquearían a los shards.
+    """
+
+    def __init__(self, engine: Engine, schema: str, table: str, key_columns: Iterable[str],
+                 shards: int, etl_schema: str = "etl", chunksize: int | None = 5000):
+        self.engine = engine
+        self.schema = schema
+        self.table = table
+        self.key_columns = list(key_columns)
+        self.shards = shards
+        self.etl_schema = etl_schema
+        self.chunksize = chunksize
+        self.grupo = uuid4().hex
+        self._preparadas: List[tuple] = []  # (conn, twophase)
+
+    def _gid(self, i: int) -> str:
+        return f"{GID_PREFIX}:{self.grupo}:{i}"
+
+    def _shard(self, i: int, parte: pd.DataFrame) -> tuple:
+        conn = self.engine.connect()
+        try:
+            tx = conn.begin_twophase(self._gid(i))
+            stage_and_upsert(conn, parte, self.schema, self.table, self.key_columns, self.chunksize)
+            tx.prepare()
+        except Exception:
+            conn.close()
+            raise
+        return conn, tx
+
+    def prepare(self, df: pd.DataFrame) -> None:
+        ids = shard_ids(df, self.key_columns, self.shards)
+        partes = [(i, df[ids == i]) for i in range(self.shards)]
+        partes = [(i, p) for i, p in partes if not p.empty]
+        with ThreadPoolExecutor(max_workers=len(partes) or 1, thread_name_prefix="upsert-shard") as pool:
+            futuros = [pool.submit(self._shard, i, p) for i, p in partes]
+            errores = []
+            for f in futuros:
+                try:
+                    self._preparadas.append(f.result())
+                except Exception as e:
+                    errores.append(e)
+        if errores:
+            self.rollback()
+            raise errores[0]
+
+    def record(self, conn: Connection, programa: object = None, version: object = None,
+               source_sha256: str | None = None) -> None:
+        """Registra la decisión con el (programa, version) cuya marca se publicará al liberarla."""
+        _ensure_decisions_table(conn, self.etl_schema)
+        conn.execute(
+            text(f'INSERT INTO "{self.etl_schema}"."sharded_upsert_commits" '
+                 '(grupo, tabla, shards, programa, version, source_sha256) '
+                 'VALUES (:grupo, :tabla, :shards, :programa, :version, :sha256)'),
+            {"grupo": self.grupo, "tabla": f"{self.schema}.{self.table}", "shards": len(self._preparadas),
+             "programa": None if programa is None else str(programa),
+             "version": None if version is None else str(version), "sha256": source_sha256},
+        )
+
+    def _commit_again(self, gid: str) -> bool:
+        try:
+            with _autocommit(self.engine) as conn:
+                conn.execute(text(f"COMMIT PREPARED '{gid}'"))
+            return True
+        except Exception as e:
+            logger.warning(f"COMMIT PREPARED '{gid}' volvió a fallar: {e}")
+            return False
+
+    def commit(self) -> int:
+        """
+        COMMIT PREPARED de cada shard. Devuelve cuántos quedaron sin
+        confirmar: la decisión ya está registrada, así que esos los termina
+        recover_sharded_upserts (y la marca de agua no debe publicarse aún).
+        """
+        pendientes = 0
+        for conn, tx in self._preparadas:
+            gid = tx.xid
+            try:
+                tx.commit()
+                conn.close()
+            except Exception as e:
+                # se descarta la conexión sin ROLLBACK PREPARED y se reintenta
+                # una vez desde otra; si tampoco, queda para la recuperación
+                logger.warning(f"COMMIT PREPARED falló en {self.schema}.{self.table} ({self.grupo}): {e}")
+                conn.invalidate()
+                if not self._commit_again(gid):
+                    pendientes += 1
+        self._preparadas = []
+        return pendientes
+
+    def release(self, conn: Connection) -> int | None:
+        """release_decision de este grupo (todos sus shards ya confirmados)."""
+        return release_decision(conn, self.grupo, self.etl_schema)
+
+    def rollback(self) -> None:
+        for conn, tx in self._preparadas:
+            try:
+                tx.rollback()
+            except Exception as e:
+                logger.warning(f"No se pudo deshacer un shard de {self.schema}.{self.table}: {e}")
+            finally:
+                conn.close()
+        self._preparadas = []
+
+
+def plan_sharded_upsert(engine: Engine, df: pd.DataFrame, schema: str, table: str,
+                        key_columns: Iterable[str], shards: int | None = None,
+                        etl_schema: str = "etl") -> ShardedUpsert | None:
+    """
+    ShardedUpsert para esta carga, o None si conviene el UPSERT único:
+    un solo shard, pocas filas, tabla aún inexistente (la crea la carga) o
+    Postgres sin transacciones preparadas (max_prepared_transactions = 0).
+    Deja el índice UNIQUE confirmado antes de arrancar los shards.
+    """
+    shards = CORE_UPSERT_SHARDS if shards is None else shards
+    if shards <= 1 or len(df) < CORE_UPSERT_SHARD_MIN_ROWS:
+        return None
+    key_columns = list(key_columns)
+    try:
+        disponibles = max_prepared_transactions(engine)
+        if disponibles < shards:
+            logger.info(f"max_prepared_transactions={disponibles} < {shards} shards; UPSERT único")
+            return None
+        if not ensure_unique_index_concurrently(engine, schema, table, key_columns):
+            return None
+        recover_sharded_upserts(engine, etl_schema)
+    except Exception as e:
+        logger.warning(f"No se pudo preparar el UPSERT repartido de {schema}.{table}: {e}; UPSERT único")
+        return None
+    return ShardedUpsert(engine, schema, table, key_columns, shards, etl_schema=etl_schema)
@@ -0,0 +1,283 @@
+# etl/snapshots.py
+from __future__ import annotations
+
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Iterable, List
+from urllib.parse import quote
+
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from .io import minio_client
+
+logger = logging.getLogger(__name__)
+
+# Exportar core.<dataset>/programa a Parquet al terminar cada carga
+CORE_SNAPSHOTS = os.getenv("CORE_SNAPSHOTS", "false").lower() == "true"
+SNAPSHOT_DIR = Path(os.getenv("CORE_SNAPSHOT_DIR", "/app/snapshots"))
+SNAPSHOT_BUCKET = os.getenv("CORE_SNAPSHOT_BUCKET", "snapshots")
+SNAPSHOT_UPLOAD = os.getenv("CORE_SNAPSHOT_UPLOAD", "true").lower() == "true"
+SNAPSHOT_ROW_GROUP = int(os.getenv("CORE_SNAPSHOT_ROW_GROUP", "20000"))
+SNAPSHOT_COMPRESSION = os.getenv("CORE_SNAPSHOT_COMPRESSION", "zstd")
+
+# Columnas que nunca se podan (filtros con pushdown)
+_PARTITION_COLUMNS = ("programa", "version")
+
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+        import pyarrow.parquet as pq
+    except Exception as e:
+        raise RuntimeError("Para los snapshots Parquet necesitas instalar 'pyarrow' en Poetry") from e
+    return pa, ds, pq
+
+
+def snapshot_key(dataset: str, programa: object) -> str:
+    """Llave del snapshot (igual en MinIO y en el cache local)."""
+    return f"core/{dataset}/programa={quote(str(programa), safe='')}.parquet"
+
+
+def local_snapshot_path(dataset: str, programa: object) -> Path:
+    return SNAPSHOT_DIR / snapshot_key(dataset, programa)
+
+
+def _arrow_types(conn: Connection, schema: str, table: str) -> Dict[str, object]:
+    """Tipo Arrow de cada columna según Postgres (estable entre programas), en orden de tabla."""
+    pa, _, _ = _pyarrow()
+    mapa = {
+        "smallint": pa.int64(), "integer": pa.int64(), "bigint": pa.int64(),
+        "real": pa.float64(), "double precision": pa.float64(), "numeric": pa.float64(),
+        "boolean": pa.bool_(), "date": pa.date32(),
+        "timestamp without time zone": pa.timestamp("us"),
+        "timestamp with time zone": pa.timestamp("us", tz="UTC"),
+    }
+    rows = conn.execute(
+        text(
+            "SELECT column_name, data_type FROM information_schema.columns "
+            "WHERE table_schema = :schema AND table_name = :table ORDER BY ordinal_position"
+        ),
+        {"schema": schema, "table": table},
+    ).all()
+    return {c: mapa.get(t, pa.string()) for c, t in rows}
+
+
+def _write_atomic(table, path: Path) -> None:
+    _, _, pq = _pyarrow()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    pq.write_table(
+        table,
+        tmp,
+        compression=SNAPSHOT_COMPRESSION,
+        row_group_size=SNAPSHOT_ROW_GROUP,
+        write_statistics=True,
+    )
+    os.replace(tmp, path)
+
+
+def export_snapshot(conn: Connection, dataset: str, programa: object, watermark: int,
+                    core_schema: str = "core") -> dict:
+    """
+    Exporta la partición `programa` de core.<dataset> como Parquet comprimido.
+
+      - ordenado por version: las estadísticas por row group permiten
+        descartar versiones sin leerlas (predicate pushdown)
+      - se podan las columnas sin ningún valor en la partición
+      - la marca de agua de la carga queda en la metadata del archivo
+
+    Se escribe de forma atómica al cache local y, si CORE_SNAPSHOT_UPLOAD,
+    se sube a MinIO (bucket CORE_SNAPSHOT_BUCKET) con la misma llave.
+    """
+    pa, _, _ = _pyarrow()
+    tipos = _arrow_types(conn, core_schema, dataset)
+    df = pd.read_sql_query(
+        text(f'SELECT * FROM "{core_schema}"."{dataset}" WHERE programa = :programa ORDER BY version'),
+        conn,
+        params={"programa": str(programa)},
+    )
+
+    podadas = [c for c in df.columns if c not in _PARTITION_COLUMNS and df[c].isna().all()]
+    df = df.drop(columns=podadas)
+    esquema = pa.schema([pa.field(c, tipos.get(c, pa.string())) for c in df.columns])
+    metadata = {
+        "watermark": str(watermark),
+        "dataset": dataset,
+        "programa": str(programa),
+        "columnas": json.dumps(list(tipos)),
+    }
+    tabla = pa.Table.from_pandas(df, schema=esquema, preserve_index=False).replace_schema_metadata(metadata)
+
+    path = local_snapshot_path(dataset, programa)
+    _write_atomic(tabla, path)
+
+    subido = False
+    if SNAPSHOT_UPLOAD:
+        client = minio_client()
+        if not client.bucket_exists(SNAPSHOT_BUCKET):
+            client.make_bucket(SNAPSHOT_BUCKET)
+        client.fput_object(
+            SNAPSHOT_BUCKET,
+            snapshot_key(dataset, programa),
+            str(path),
+            content_type="application/vnd.apache.parquet",
+            metadata={"watermark": str(watermark)},
+        )
+        subido = True
+
+    return {
+        "path": str(path),
+        "filas": len(df),
+        "columnas": len(df.columns),
+        "podadas": len(podadas),
+        "bytes": path.stat().st_size,
+        "subido": subido,
+        "watermark": watermark,
+    }
+
+
+def snapshot_watermark(path: Path) -> int | None:
+    """Marca de agua guardada en el snapshot local (None si no existe o es ilegible)."""
+    _, _, pq = _pyarrow()
+    try:
+        meta = pq.read_schema(path).metadata or {}
+        return int(meta[b"watermark"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def sync_snapshot(dataset: str, programa: str, watermark: int) -> Path | None:
+    """
+    Snapshot local de (dataset, programa) con marca >= `watermark`; si el
+    local falta o está atrasado lo baja de MinIO. None si no hay uno vigente.
+    """
+    path = local_snapshot_path(dataset, programa)
+    local = snapshot_watermark(path) if path.exists() else None
+    if local is not None and local >= watermark:
+        return path
+    if not SNAPSHOT_UPLOAD:
+        return None
+    try:
+        client = minio_client()
+        key = snapshot_key(dataset, programa)
+        stat = client.stat_object(SNAPSHOT_BUCKET, key)
+        remoto = int((stat.metadata or {}).get("x-amz-meta-watermark", 0))
+        if remoto < watermark:
+            return None
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        client.fget_object(SNAPSHOT_BUCKET, key, str(tmp))
+        os.replace(tmp, path)
+        return path
+    except Exception as e:
+        logger.warning(f"No se pudo sincronizar el snapshot {dataset}/{programa}: {e}")
+        return None
+
+
+_CORE_PROGRAMAS: Dict[tuple, frozenset] = {}
+
+
+def _core_programas(conn: Connection, dataset: str, core_schema: str) -> frozenset:
+    if not conn.execute(text("SELECT to_regclass(:fq)"), {"fq": f'"{core_schema}"."{dataset}"'}).scalar():
+        return frozenset()
+    return frozenset(str(p) for (p,) in conn.execute(
+        text(f'SELECT DISTINCT programa FROM "{core_schema}"."{dataset}" WHERE programa IS NOT NULL')
+    ).all())
+
+
+def snapshot_watermarks(conn: Connection, dataset: str, etl_schema: str = "etl",
+                        core_schema: str = "core") -> Dict[str, int]:
+    """
+    {programa: marca que debe tener su snapshot} para todos los programas
+    de core.<dataset>, no solo los que tienen fila en etl.dataset_watermarks:
+    los cargados antes de que existieran las marcas quedan con 0 (sirve
+    cualquier snapshot suyo; una carga nueva ya les registraría marca).
+    Así ningún programa de core se omite en silencio al leer snapshots.
+
+    Los programas de core solo cambian con una carga, que cambia las marcas:
+    el DISTINCT se cachea por ese estado.
+    """
+    from .watermarks import read_watermarks_by_programa
+
+    marcas = read_watermarks_by_programa(conn, dataset, schema=etl_schema)
+    llave = (core_schema, dataset, tuple(sorted(marcas.items())))
+    programas = _CORE_PROGRAMAS.get(llave)
+    if programas is None:
+        programas = _core_programas(conn, dataset, core_schema)
+        if len(_CORE_PROGRAMAS) >= 64:
+            _CORE_PROGRAMAS.clear()
+        _CORE_PROGRAMAS[llave] = programas
+    return {**{p: 0 for p in programas}, **marcas}
+
+
+def snapshot_files(dataset: str, watermarks: Dict[str, int],
+                   programas: Iterable[str] | None = None) -> List[str] | None:
+    """
+    Rutas locales de los snapshots vigentes de `dataset` (solo `programas`
+    si se indican), sincronizando desde MinIO lo que falte. None si falta
+    alguno o no hay ninguno.
+    """
+    pedidos = None if programas is None else {str(p) for p in programas}
+    archivos: List[str] = []
+    for programa in watermarks:
+        if pedidos is not None and programa not in pedidos:
+            continue
+        path = sync_snapshot(dataset, programa, watermarks[programa])
+        if path is None:
+            return None
+        archivos.append(str(path))
+    return archivos or None
+
+
+def read_snapshot(dataset: str, watermarks: Dict[str, int],
+                  columns: Iterable[str] | None = None,
+                  programas: Iterable[str] | None = None,
+                  versiones: Iterable[str] | None = None) -> pd.DataFrame | None:
+    """
+    Lee core.<dataset> desde los snapshots Parquet.
+
+    `watermarks` es {programa: marca vigente} de todos los programas de core
+    (snapshot_watermarks): solo se usan snapshots al día. Con `programas` se leen solo esos archivos; con
+    `versiones` el filtro se empuja a los row groups; `columns` proyecta.
+
+    Devuelve None si falta algún snapshot vigente (el llamador debe leer de
+    Postgres).
+    """
+    pa, ds, pq = _pyarrow()
+    archivos = snapshot_files(dataset, watermarks, programas)
+    if archivos is None:
+        return None
+
+    esquemas = [pq.read_schema(a) for a in archivos]
+    orden = json.loads((esquemas[0].metadata or {}).get(b"columnas", b"[]"))
+    unificado = pa.unify_schemas([e.remove_metadata() for e in esquemas])
+    orden = [c for c in orden if c in unificado.names] + [c for c in unificado.names if c not in orden]
+    unificado = pa.schema([unificado.field(c) for c in orden])
+
+    filtro = None
+    if versiones is not None:
+        filtro = ds.field("version").isin([str(v) for v in versiones])
+    cols = [c for c in orden if c in set(columns)] if columns is not None else None
+
+    tabla = ds.dataset(archivos, schema=unificado, format="parquet").to_table(columns=cols, filter=filtro)
+    return tabla.to_pandas()
+
+
+if __name__ == "__main__":
+    # Backfill: python -m etl.snapshots <dataset> [<dataset> ...]
+    import sys
+
+    from .db import make_engine
+
+    logging.basicConfig(level=logging.INFO)
+    etl_schema = os.getenv("ETL_SCHEMA", "etl")
+    core_schema = os.getenv("CORE_SCHEMA", "core")
+    with make_engine().connect() as conn:
+        for ds_name in sys.argv[1:]:
+            for prog, wm in snapshot_watermarks(conn, ds_name, etl_schema, core_schema).items():
+                logger.info(f"{ds_name}/{prog}: {export_snapshot(conn, ds_name, prog, wm, core_schema)}")
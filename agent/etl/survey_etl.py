@@ -1,12 +1,26 @@
 # etl/survey_etl.py
 from __future__ import annotations
 from typing import Dict, Iterable, Tuple
+import logging
 import pandas as pd
 
 from .io import read_dataframe
 from .utils import normalize_columns, rename_aliases, coerce_types, drop_duplicates_by_keys
 from .validators import assert_not_null, validate_email_column
-from .db import make_engine, ensure_schemas, write_raw_dataframe, upsert_dataframe
+from .db import (make_engine, ensure_schemas, write_raw_dataframe, upsert_dataframe,
+                 ensure_unique_index_concurrently, invalidate_ddl_cache)
+from .sharded_upsert import plan_sharded_upsert
+from .raw_layer import RAW_LAYER_MODE, delete_raw_object, register_raw_object, write_raw_object
+from .profiles import compute_column_profiles, save_column_profiles
+from .catalog import build_question_catalog, save_question_catalog
+from .watermarks import bump_watermark, read_watermark
+from .snapshots import CORE_SNAPSHOTS, export_snapshot
+from .maintenance import ETL_MAINTENANCE, run_post_load
+from .events import DATASET_CHANGED, notify_dataset_changed, publish
+from .incremental import (ETL_INCREMENTAL, incremental_column, incremental_values, mark_per_version,
+                          read_ingest_watermark, save_ingest_watermark)
+
+logger = logging.getLogger(__name__)
 
 class SurveyETL:
     def __init__(
@@ -20,7 +34,14 @@ class SurveyETL:
         write_raw: bool = True,
         raw_schema: str = "raw",
         core_schema: str = "core",
+        etl_schema: str = "etl",
+        write_profiles: bool = True,
+        write_snapshot: bool | None = None,
+        maintenance: bool | None = None,
         pg_dsn: str | None = None,
+        source_sha256: str | None = None,
+        incremental: bool | None = None,
+        raw_layer: str | None = None,
     ):
         self.source = source
         self.dataset_name = dataset_name
@@ -29,19 +50,130 @@ class SurveyETL:
         self.dtypes = dtypes or {}
         self.static_columns = static_columns or {}
         self.write_raw = write_raw
+        self.raw_layer = (raw_layer or RAW_LAYER_MODE).lower()   # "postgres" | "parquet"
+        self.raw_object: dict | None = None
         self.raw_schema = raw_schema
         self.core_schema = core_schema
+        self.etl_schema = etl_schema
+        self.write_profiles = write_profiles
+        self.write_snapshot = CORE_SNAPSHOTS if write_snapshot is None else write_snapshot
+        self.maintenance = ETL_MAINTENANCE if maintenance is None else maintenance
         self.pg_dsn = pg_dsn
+        self.source_sha256 = source_sha256  # huella del archivo de origen, si ya se calculó al recibirlo
+        self.column_profiles: pd.DataFrame | None = None
+        self.question_catalog: pd.DataFrame | None = None
+        self.headers: Dict[str, str] = {}
+        self.watermark: int | None = None
+        # marca del dataset (ver read_watermark): la que usan los caches
+        self.dataset_watermark: int | None = None
+        self.snapshot: dict | None = None
+        self.touched_tables: list[tuple[str, str]] = []
+        self.maintenance_report: dict | None = None
+        self.incremental = ETL_INCREMENTAL if incremental is None else incremental
+        self.incremental_report: dict | None = None
+        self._ingest_mark: tuple | None = None  # (columna, valor máximo del archivo) a guardar en el load
 
     # ------------------------- EXTRACT -------------------------
     def extract(self) -> pd.DataFrame:
         return read_dataframe(self.source)
 
+    # ----------------------- INCREMENTAL -----------------------
+    def drop_loaded(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Modo incremental: descarta las filas con fecha de envío (o id de
+        respuesta) menor o igual a la marca de (dataset, programa), antes de
+        cualquier transform. Las filas sin valor (respuestas incompletas) se
+        conservan. La marca nueva se guarda en el load, en la misma transacción.
+        Una marca por id solo se aplica a archivos de su misma versión.
+        """
+        if not self.incremental:
+            return df
+        programa = self.static_columns.get("programa")
+        version = self.static_columns.get("version")
+        marca_col = incremental_column(df)
+        if programa is None or marca_col is None:
+            logger.info(f"{self.source}: sin columna de marca incremental; se carga completo")
+            return df
+        original, columna = marca_col
+        valores = incremental_values(df[original], columna)
+        if valores.notna().any():
+            self._ingest_mark = (columna, valores.max())
+
+        with make_engine(self.pg_dsn).connect() as conn:
+            previa = read_ingest_watermark(conn, self.dataset_name, programa, version, schema=self.etl_schema)
+        if previa is not None and previa[0] != columna:
+            previa = None
+
+        if previa is None:
+            nuevas = pd.Series(True, index=df.index)
+        else:
+            nuevas = valores.isna() | (valores > previa[1])
+            if self._ingest_mark is not None and self._ingest_mark[1] <= previa[1]:
+                self._ingest_mark = None  # archivo más viejo que la marca: no retrocede
+
+        self.incremental_report = {
+            "columna": columna,
+            "marca_previa": None if previa is None else str(previa[1]),
+            "descartadas": int((~nuevas).sum()),
+            "nuevas": int(nuevas.sum()),
+        }
+        self._warn_all_dropped(len(df), self.incremental_report)
+        return df.loc[nuevas.to_numpy()]
+
+    def _warn_all_dropped(self, filas: int, reporte: dict) -> None:
+        if filas and not reporte["nuevas"]:
+            logger.warning(f"{self.source}: las {filas} filas ya estaban cargadas según la marca "
+                           f"{reporte['columna']}={reporte['marca_previa']}; el archivo no aporta nada")
+
+    @property
+    def ingest_mark(self) -> tuple | None:
+        """(columna, valor, version) que esta carga guarda como marca incremental, o None."""
+        if self._ingest_mark is None:
+            return None
+        return (*self._ingest_mark, self.static_columns.get("version"))
+
+    def chain_ingest_mark(self, previa: tuple | None, df_raw: pd.DataFrame,
+                          df_core: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Carga por lotes: los archivos de un programa se preparan en paralelo
+        contra la misma marca guardada, así que antes de escribir cada uno se
+        descartan también las filas que ya cubrió el archivo anterior del
+        programa (`previa` = su marca, (columna, valor, version)). Devuelve
+        los DataFrames raw y core filtrados.
+        """
+        if not self.incremental or previa is None:
+            return df_raw, df_core
+        columna, marca, version = previa
+        marca_col = incremental_column(df_raw)
+        if marca_col is None or marca_col[1] != columna or columna not in df_core.columns:
+            return df_raw, df_core
+        if mark_per_version(columna) and str(version) != str(self.static_columns.get("version")):
+            return df_raw, df_core
+
+        nuevas_raw = incremental_values(df_raw[marca_col[0]], columna)
+        nuevas_raw = nuevas_raw.isna() | (nuevas_raw > marca)
+        nuevas_core = incremental_values(df_core[columna], columna)
+        nuevas_core = nuevas_core.isna() | (nuevas_core > marca)
+        if self._ingest_mark is not None and self._ingest_mark[1] <= marca:
+            self._ingest_mark = None
+
+        previo = self.incremental_report or {"descartadas": 0}
+        self.incremental_report = {
+            "columna": columna,
+            "marca_previa": str(marca),
+            "descartadas": previo["descartadas"] + int((~nuevas_raw).sum()),
+            "nuevas": int(nuevas_raw.sum()),
+        }
+        self._warn_all_dropped(len(df_raw), self.incremental_report)
+        return df_raw.loc[nuevas_raw.to_numpy()], df_core.loc[nuevas_core.to_numpy()]
+
     # ------------------------ TRANSFORM ------------------------
     def transform(self, df: pd.DataFrame) -> pd.DataFrame:
-        # 1) headers
+        # 1) headers (se conserva el encabezado original para el catálogo)
+        originales = [str(c) for c in df.columns]
         df = df.rename(columns=normalize_columns)
         df = rename_aliases(df)
+        self.headers = dict(zip(df.columns, originales))
 
         # 2) columnas estáticas (programa, version, file_id, etc.)
         for k, v in self.static_columns.items():
@@ -68,29 +200,217 @@ class SurveyETL:
 
         # 7) dedupe por llave
         df = drop_duplicates_by_keys(df, list(self.key_columns))
+
+        # 8) perfiles por columna (insumo de 'calidad_datos'); con filas
+        #    descartadas por el modo incremental serían de un subconjunto, así
+        #    que se conservan los de la última carga completa
+        if self.write_profiles and not self._rows_dropped():
+            self.column_profiles = compute_column_profiles(df)
+            self.question_catalog = build_question_catalog(df, self.headers, self.column_profiles)
         return df
 
     # -------------------------- LOAD --------------------------
     def load(self, df_raw: pd.DataFrame, df_core: pd.DataFrame) -> None:
         engine = make_engine(self.pg_dsn)
+        # DDL fuera de la transacción: índice UNIQUE de core con CONCURRENTLY
+        # (si core aún no existe, la transacción crea tabla e índice juntos)
+        try:
+            ensure_unique_index_concurrently(engine, self.core_schema, self.dataset_name, self.key_columns)
+        except Exception as e:
+            logger.warning(f"No se pudo asegurar el índice UNIQUE de {self.core_schema}.{self.dataset_name} "
+                           f"fuera de la transacción: {e}")
+        # UPSERT a core repartido en varias conexiones (None = UPSERT único)
+        sharded = plan_sharded_upsert(engine, df_core, self.core_schema, self.dataset_name,
+                                      self.key_columns, etl_schema=self.etl_schema)
+        # RAW en Parquet: se sube antes de abrir la transacción (que solo lo cataloga)
+        if self.write_raw and self.raw_layer == "parquet":
+            self.raw_object = write_raw_object(
+                df_raw,
+                self.dataset_name,
+                programa=self.static_columns.get("programa"),
+                version=self.static_columns.get("version"),
+                source=self.source,
+                source_sha256=self.source_sha256,
+            )
+        try:
+            self._load(engine, df_raw, df_core, sharded)
+        except Exception:
+            if sharded is not None:
+                sharded.rollback()
+            if self.raw_object is not None:
+                delete_raw_object(self.raw_object)
+                self.raw_object = None
+            invalidate_ddl_cache()  # lo creado en la transacción se deshizo
+            raise
+        if sharded is not None:
+            pendientes = sharded.commit()
+            if pendientes:
+                # core aún no tiene todas las filas: la marca la publica
+                # recover_sharded_upserts cuando confirme esos shards
+                logger.warning(f"{pendientes} shard(s) de {self.core_schema}.{self.dataset_name} sin confirmar; "
+                               "la marca de agua se publicará al recuperarlos")
+            else:
+                # borrar la decisión publica la marca (y el aviso) en la misma transacción
+                with engine.begin() as conn:
+                    marca = sharded.release(conn)
+                    if marca is not None:
+                        self.watermark = marca
+                        self.dataset_watermark = read_watermark(conn, self.dataset_name, schema=self.etl_schema)
+
+    def _load(self, engine, df_raw: pd.DataFrame, df_core: pd.DataFrame, sharded) -> None:
+        """Transacción principal de la carga (raw, core, perfiles, catálogo, marcas, aviso)."""
         with engine.begin() as conn:
             ensure_schemas(conn, self.raw_schema, self.core_schema)
 
-            # RAW (append-only)
-            if self.write_raw:
+            # RAW (append-only): filas en raw.<dataset> o entrada del catálogo
+            # que apunta al Parquet ya subido
+            if self.raw_object is not None:
+                register_raw_object(conn, self.raw_object, schema=self.etl_schema)
+            elif self.write_raw:
                 write_raw_dataframe(conn, df_raw, self.raw_schema, self.dataset_name)
+                self.touched_tables.append((self.raw_schema, self.dataset_name))
 
-            # CORE (UPSERT por llaves)
-            upsert_dataframe(
-                conn,
-                df_core,
-                schema=self.core_schema,
-                table=self.dataset_name,
-                key_columns=self.key_columns,
-            )
+            # CORE (UPSERT por llaves); repartido: shards preparados (2PC) y la
+            # decisión se confirma con esta transacción
+            if sharded is not None:
+                sharded.prepare(df_core)
+                sharded.record(
+                    conn,
+                    programa=self.static_columns.get("programa"),
+                    version=self.static_columns.get("version"),
+                    source_sha256=self.source_sha256,
+                )
+            else:
+                upsert_dataframe(
+                    conn,
+                    df_core,
+                    schema=self.core_schema,
+                    table=self.dataset_name,
+                    key_columns=self.key_columns,
+                )
+            self.touched_tables.append((self.core_schema, self.dataset_name))
+
+            # PERFILES (por programa/version)
+            if self.write_profiles and self.column_profiles is not None:
+                save_column_profiles(
+                    conn,
+                    self.column_profiles,
+                    dataset=self.dataset_name,
+                    programa=self.static_columns.get("programa"),
+                    version=self.static_columns.get("version"),
+                    schema=self.etl_schema,
+                )
+
+            # CATÁLOGO DE PREGUNTAS (después del UPSERT: necesita la tabla core)
+            if self.question_catalog is not None:
+                save_question_catalog(
+                    conn,
+                    self.question_catalog,
+                    dataset=self.dataset_name,
+                    core_schema=self.core_schema,
+                    schema=self.etl_schema,
+                )
+
+            # MARCA INCREMENTAL (última respuesta cargada del programa)
+            if self._ingest_mark is not None:
+                save_ingest_watermark(
+                    conn,
+                    self.dataset_name,
+                    programa=self.static_columns.get("programa"),
+                    columna=self._ingest_mark[0],
+                    valor=self._ingest_mark[1],
+                    version=self.static_columns.get("version"),
+                    schema=self.etl_schema,
+                )
+
+            # MARCA DE AGUA + AVISO; con UPSERT repartido van después de los
+            # COMMIT PREPARED para que nadie cachee la marca nueva con core viejo
+            if sharded is None:
+                self._publish_watermark(conn)
+
+    def _publish_watermark(self, conn) -> None:
+        # MARCA DE AGUA (visible al commit; invalida caches de analíticas)
+        self.watermark = bump_watermark(
+            conn,
+            self.dataset_name,
+            programa=self.static_columns.get("programa"),
+            version=self.static_columns.get("version"),
+            schema=self.etl_schema,
+            source_sha256=self.source_sha256,
+        )
+        self.dataset_watermark = read_watermark(conn, self.dataset_name, schema=self.etl_schema)
+
+        # AVISO a otros procesos (LISTEN etl_dataset_changed); se entrega al commit
+        notify_dataset_changed(
+            conn,
+            self.dataset_name,
+            programa=self.static_columns.get("programa"),
+            version=self.static_columns.get("version"),
+            watermark=self.dataset_watermark,
+        )
+
+    # ------------------------ SNAPSHOT ------------------------
+    def export_snapshot(self) -> None:
+        """
+        Exporta la partición del programa cargado a Parquet (ver etl.snapshots).
+        Corre después del commit; si falla, la carga sigue siendo válida y las
+        analíticas leen de Postgres hasta que haya un snapshot al día.
+        """
+        programa = self.static_columns.get("programa")
+        if programa is None or self.watermark is None:
+            return
+        try:
+            engine = make_engine(self.pg_dsn)
+            with engine.connect() as conn:
+                self.snapshot = export_snapshot(
+                    conn, self.dataset_name, programa, self.watermark, core_schema=self.core_schema
+                )
+        except Exception as e:
+            logger.warning(f"No se pudo exportar el snapshot de {self.dataset_name}/{programa}: {e}")
+
+    # ------------------------ POST-LOAD -----------------------
+    def post_load(self) -> None:
+        """
+        Después del commit: ANALYZE de las tablas tocadas, refresh de vistas
+        materializadas y agregados (ver etl.maintenance) y, siempre, el
+        evento DATASET_CHANGED para que los caches se invaliden.
+        """
+        if self.maintenance and self.touched_tables:
+            try:
+                self.maintenance_report = run_post_load(
+                    make_engine(self.pg_dsn),
+                    self.dataset_name,
+                    self.touched_tables,
+                    programa=self.static_columns.get("programa"),
+                    watermark=self.watermark,
+                    core_schema=self.core_schema,
+                    etl_schema=self.etl_schema,
+                )
+            except Exception as e:
+                logger.warning(f"Falló el mantenimiento post-carga de {self.dataset_name}: {e}")
+
+        publish(DATASET_CHANGED, {
+            "dataset": self.dataset_name,
+            "programa": self.static_columns.get("programa"),
+            "version": self.static_columns.get("version"),
+            "watermark": self.dataset_watermark,
+        })
 
     # -------------------------- RUN ---------------------------
+    def _rows_dropped(self) -> bool:
+        return bool(self.incremental_report and self.incremental_report["descartadas"])
+
+    def persist(self, df_raw: pd.DataFrame, df_core: pd.DataFrame) -> None:
+        """Etapas con base de datos: load (una transacción), snapshot y post-carga."""
+        if df_core.empty and self._rows_dropped():
+            logger.info(f"{self.source}: sin respuestas nuevas para {self.dataset_name}; no se escribe nada")
+            return
+        self.load(df_raw, df_core)
+        if self.write_snapshot:
+            self.export_snapshot()
+        self.post_load()
+
     def run(self) -> None:
-        df = self.extract()
+        df = self.drop_loaded(self.extract())
         df_t = self.transform(df)
-        self.load(df, df_t)
+        self.persist(df, df_t)
@@ -0,0 +1,80 @@
+# etl/watermarks.py
+from __future__ import annotations
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from .db import ensure_table
+
+
+def _ensure_watermarks_table(conn: Connection, schema: str) -> None:
+    ensure_table(conn, schema, "dataset_watermarks", f'''
+        CREATE TABLE IF NOT EXISTS "{schema}"."dataset_watermarks" (
+            dataset        TEXT NOT NULL,
+            programa       TEXT NOT NULL,
+            version        TEXT,
+            watermark      BIGINT NOT NULL,
+            cargado_en     TIMESTAMPTZ NOT NULL DEFAULT now(),
+            source_sha256  TEXT,
+            PRIMARY KEY (dataset, programa)
+        )
+    ''', columns={"source_sha256": "TEXT"})
+
+
+def bump_watermark(conn: Connection, dataset: str, programa: object, version: object,
+                   schema: str = "etl", source_sha256: str | None = None) -> int:
+    """
+    Avanza la marca de agua de (dataset, programa) dentro de la transacción de carga.
+
+    La marca es monótona (microsegundos desde epoch, o +1 si el reloj no avanzó)
+    y solo se vuelve visible al hacer commit: los caches de analíticas la usan
+    como parte de su llave, así que una carga nueva invalida lo anterior.
+    Guarda también `source_sha256`, la huella del archivo que la produjo.
+    """
+    _ensure_watermarks_table(conn, schema)
+    sql = f'''
+        INSERT INTO "{schema}"."dataset_watermarks" AS w (dataset, programa, version, watermark, source_sha256)
+        VALUES (:dataset, :programa, :version, (extract(epoch FROM clock_timestamp()) * 1000000)::bigint, :sha256)
+        ON CONFLICT (dataset, programa) DO UPDATE
+        SET version = EXCLUDED.version,
+            watermark = GREATEST(w.watermark + 1, EXCLUDED.watermark),
+            source_sha256 = EXCLUDED.source_sha256,
+            cargado_en = now()
+        RETURNING watermark
+    '''
+    return int(conn.execute(
+        text(sql), {"dataset": dataset, "programa": str(programa), "version": str(version),
+                    "sha256": source_sha256}
+    ).scalar())
+
+
+def read_watermark(conn: Connection, dataset: str, programa: str | None = None,
+                   schema: str = "etl") -> int:
+    """
+    Marca de agua vigente de un dataset, o la del programa indicado.
+    Devuelve 0 si nunca se registró una carga.
+
+    La del dataset es la suma de las marcas de sus programas, no la máxima:
+    cada bump sube estrictamente la marca de su programa, así que la suma
+    cambia con cualquier carga confirmada, aunque las cargas concurrentes
+    de distintos programas hagan commit en otro orden que el de sus marcas.
+    """
+    if not conn.execute(text("SELECT to_regclass(:fq)"), {"fq": f'"{schema}"."dataset_watermarks"'}).scalar():
+        return 0
+    sql = f'SELECT COALESCE(SUM(watermark), 0) FROM "{schema}"."dataset_watermarks" WHERE dataset = :dataset'
+    params: dict = {"dataset": dataset}
+    if programa is not None:
+        sql += " AND programa = :programa"
+        params["programa"] = programa
+    return int(conn.execute(text(sql), params).scalar() or 0)
+
+
+def read_watermarks_by_programa(conn: Connection, dataset: str, schema: str = "etl") -> dict[str, int]:
+    """Marca de agua vigente de cada programa cargado del dataset."""
+    if not conn.execute(text("SELECT to_regclass(:fq)"), {"fq": f'"{schema}"."dataset_watermarks"'}).scalar():
+        return {}
+    rows = conn.execute(
+        text(f'SELECT programa, watermark FROM "{schema}"."dataset_watermarks" WHERE dataset = :dataset'),
+        {"dataset": dataset},
+    ).all()
+    return {str(p): int(w) for p, w in rows}
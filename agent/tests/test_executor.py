@@ -0,0 +1,46 @@
+# tests/test_executor.py
+# python -m unittest tests.test_executor  (desde agent/)
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+import unittest
+
+from app.executor import AnalyticsPool, JobTimeout
+
+
+def _dormir(segundos: float) -> int:
+    time.sleep(segundos)
+    return os.getpid()
+
+
+class TimeoutAisladoTest(unittest.TestCase):
+    """Un trabajo que vence no debe tumbar a otro que corre en otro worker."""
+
+    def setUp(self):
+        self.pool = AnalyticsPool(workers=2, queue_max=2, timeout_s=5)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def test_timeout_termina_solo_su_worker(self):
+        async def escenario():
+            # calienta ambos workers para que el timeout no cuente el arranque
+            await asyncio.gather(self.pool.submit(_dormir, 0.2), self.pool.submit(_dormir, 0.2))
+            largo = asyncio.ensure_future(self.pool.submit(_dormir, 2.0))
+            await asyncio.sleep(0.2)
+            with self.assertRaises(JobTimeout):
+                await self.pool.submit(_dormir, 30.0, timeout_s=0.5)
+            pid_largo = await largo
+            # el pool repuso el worker terminado y sigue atendiendo
+            pid_nuevo = await self.pool.submit(_dormir, 0.0)
+            return pid_largo, pid_nuevo
+
+        pid_largo, pid_nuevo = asyncio.run(escenario())
+        self.assertIsInstance(pid_largo, int)
+        self.assertIsInstance(pid_nuevo, int)
+
+
+if __name__ == "__main__":
+    unittest.main()
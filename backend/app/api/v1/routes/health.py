@@ -2,6 +2,8 @@ from fastapi import APIRouter, Depends
 from sqlalchemy.orm import Session
 from app.core.database import get_db_users, get_db_data
 from app.core.minio_client import get_minio_client
+from app.core.singleflight import singleflight_stats
+from app.core.change_feed import change_listener
 
 router = APIRouter(tags=["Health"])
 
@@ -28,3 +30,14 @@ def check_minio(minio=Depends(get_minio_client)):
         return {"status": "ok", "service": "minio"}
     except Exception as e:
         return {"status": "error", "service": "minio", "details": str(e)}
+
+@router.get("/singleflight", tags=["Health"])
+def check_singleflight():
+    """Executed vs. coalesced counts for the single-flight groups of the statistics routes."""
+    return {"status": "ok", "groups": singleflight_stats()}
+
+
+@router.get("/change_feed", tags=["Health"])
+def check_change_feed():
+    """State of the LISTEN connection that invalidates caches when the ETL loads data."""
+    return {"status": "ok" if change_listener.connected else "disconnected", **change_listener.snapshot()}
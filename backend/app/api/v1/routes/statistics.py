@@ -5,6 +5,8 @@ from typing import Optional, List, Dict, Any
 from datetime import date
 from app.core.database import get_db_data
 from app.core.security import get_current_user
+from app.services.question_catalog import get_catalog, is_question_column, search_questions
+from app.core.singleflight import get_singleflight
 
 router = APIRouter(tags=["Statistics"])
 
@@ -205,7 +207,7 @@ def get_question_analysis(
         ORDER BY count DESC
     """
     
-    try:
+    def run_analysis():
         result = db.execute(text(query), params)
         rows = result.fetchall()
         
@@ -230,6 +232,13 @@ def get_question_analysis(
             },
             "distribution": data
         }
+
+    # Concurrent identical requests (e.g. a whole school opening the dashboard
+    # right after a load) share a single scan
+    try:
+        return get_singleflight("question-analysis").do(
+            (dataset, question_column, programa, version), run_analysis
+        )
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error analyzing question: {str(e)}")
 
@@ -329,10 +338,33 @@ def get_available_columns(
     """
     Get list of all available columns in the dataset.
     Useful for frontend to know which questions can be analyzed.
+
+    Served from the question catalog built by the ETL (cached); falls back to
+    information_schema when the catalog has not been generated yet.
     """
     if dataset not in ["egresados", "profesores"]:
         raise HTTPException(status_code=400, detail="dataset must be 'egresados' or 'profesores'")
     
+    catalog = get_catalog(db, dataset)
+    if catalog:
+        columns = [
+            {
+                "column_name": row["columna"],
+                "data_type": row.get("tipo_sql"),
+                "is_question": bool(row["es_pregunta"]),
+                "question_code": row.get("codigo"),
+                "header": row.get("encabezado"),
+                "detected_type": row.get("tipo_detectado"),
+                "scale": row.get("escala"),
+            }
+            for row in catalog
+        ]
+        return {
+            "dataset": dataset,
+            "columns": columns,
+            "total_columns": len(columns)
+        }
+
     query = f"""
         SELECT column_name, data_type
         FROM information_schema.columns
@@ -347,7 +379,7 @@ def get_available_columns(
         {
             "column_name": row[0],
             "data_type": row[1],
-            "is_question": not row[0] in ["id_id_de_respuesta", "programa", "version", "submitdate_fecha_de_envio"]
+            "is_question": is_question_column(row[0])
         }
         for row in result
     ]
@@ -359,6 +391,35 @@ def get_available_columns(
     }
 
 
+@router.get("/questions/search")
+def search_question_catalog(
+    dataset: str = Query("egresados", description="Dataset: egresados or profesores"),
+    q: str = Query(..., description="Keywords separated by spaces (e.g. 'satisfaccion general')"),
+    db: Session = Depends(get_db_data),
+    current_user = Depends(get_current_user)
+):
+    """
+    Look up questions in the catalog by keyword (inverted index, cached).
+    """
+    if dataset not in ["egresados", "profesores"]:
+        raise HTTPException(status_code=400, detail="dataset must be 'egresados' or 'profesores'")
+
+    matches = search_questions(db, dataset, q)
+    return {
+        "dataset": dataset,
+        "query": q,
+        "results": [
+            {
+                "column_name": row["columna"],
+                "question_code": row.get("codigo"),
+                "header": row.get("encabezado"),
+                "detected_type": row.get("tipo_detectado"),
+            }
+            for row in matches
+        ],
+    }
+
+
 # ========================================
 # SATISFACTION ANALYSIS (Specific for satisfaction questions)
 # ========================================
@@ -412,30 +473,33 @@ def get_satisfaction_analysis(
         ORDER BY count DESC
     """
     
-    result = db.execute(text(query), params)
-    rows = result.fetchall()
-    
-    total = sum(row[1] for row in rows)
-    
-    data = [
-        {
-            "satisfaction_level": row[0],
-            "count": row[1],
-            "percentage": round((row[1] / total * 100), 2) if total > 0 else 0
+    def run_analysis():
+        result = db.execute(text(query), params)
+        rows = result.fetchall()
+        
+        total = sum(row[1] for row in rows)
+        
+        data = [
+            {
+                "satisfaction_level": row[0],
+                "count": row[1],
+                "percentage": round((row[1] / total * 100), 2) if total > 0 else 0
+            }
+            for row in rows
+        ]
+        
+        return {
+            "dataset": dataset,
+            "column": column,
+            "total_responses": total,
+            "filters": {
+                "programa": programa,
+                "version": version
+            },
+            "distribution": data
         }
-        for row in rows
-    ]
-    
-    return {
-        "dataset": dataset,
-        "column": column,
-        "total_responses": total,
-        "filters": {
-            "programa": programa,
-            "version": version
-        },
-        "distribution": data
-    }
+
+    return get_singleflight("satisfaction-analysis").do((dataset, programa, version), run_analysis)
 
 
 # ========================================
@@ -0,0 +1,144 @@
+import json
+import logging
+import os
+import select
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy.engine import make_url
+
+from app.core.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Channel the agent's ETL notifies (pg_notify) when a load commits
+CHANGE_CHANNEL = os.getenv("ETL_CHANGE_CHANNEL", "etl_dataset_changed")
+CHANGE_FEED_ENABLED = os.getenv("ETL_CHANGE_FEED", "true").lower() == "true"
+CHANGE_FEED_POLL_S = float(os.getenv("ETL_CHANGE_FEED_POLL_S", "30"))
+CHANGE_FEED_RECONNECT_MAX_S = float(os.getenv("ETL_CHANGE_FEED_RECONNECT_MAX_S", "30"))
+
+# name -> fn(dataset | None, payload); dataset None means "invalidate everything"
+Invalidator = Callable[[Optional[str], Dict[str, Any]], None]
+_regions: List[Tuple[str, Invalidator]] = []
+_regions_lock = threading.Lock()
+
+
+def register_region(name: str, invalidate: Invalidator) -> None:
+    """Register a cache region to be invalidated when a dataset changes."""
+    with _regions_lock:
+        if all(n != name for n, _ in _regions):
+            _regions.append((name, invalidate))
+
+
+def dispatch(payload: Dict[str, Any]) -> None:
+    """Invalidate every registered region; one failing region does not stop the rest."""
+    with _regions_lock:
+        regions = list(_regions)
+    for name, invalidate in regions:
+        try:
+            invalidate(payload.get("dataset"), payload)
+        except Exception:
+            logger.exception("Cache region %s failed to invalidate for %s", name, payload)
+
+
+class ChangeFeedListener:
+    """
+    Background thread holding a dedicated LISTEN connection on the ETL change channel.
+
+    Each notification (JSON payload {dataset, programa, version, watermark})
+    is handed to `dispatch`. Dropped connections are retried with exponential
+    backoff; after a reconnect a dataset=None payload is dispatched, since any
+    NOTIFY sent while disconnected was lost. When idle, a SELECT 1 every
+    CHANGE_FEED_POLL_S detects dead connections.
+    """
+
+    def __init__(self, dsn: str, on_change: Callable[[Dict[str, Any]], None] = dispatch,
+                 channel: str = CHANGE_CHANNEL):
+        # SQLAlchemy URL (postgresql+psycopg2://...) -> libpq URI
+        self.dsn = make_url(dsn).set(drivername="postgresql").render_as_string(hide_password=False)
+        self.on_change = on_change
+        self.channel = channel
+        self.connected = False
+        self.stats = {"notifications": 0, "reconnects": 0, "errors": 0}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _connect(self):
+        import psycopg2
+        import psycopg2.extensions
+
+        conn = psycopg2.connect(self.dsn)
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cur:
+            cur.execute(f'LISTEN "{self.channel}"')
+        return conn
+
+    def _deliver(self, payload: Dict[str, Any]) -> None:
+        try:
+            self.on_change(payload)
+        except Exception:
+            logger.exception("Change feed dispatch failed for %s", payload)
+
+    def _listen(self, conn) -> None:
+        while not self._stop.is_set():
+            ready, _, _ = select.select([conn], [], [], CHANGE_FEED_POLL_S)
+            if not ready:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                continue
+            conn.poll()
+            while conn.notifies:
+                notice = conn.notifies.pop(0)
+                try:
+                    payload = json.loads(notice.payload)
+                except ValueError:
+                    logger.warning("Invalid payload on %s: %r", self.channel, notice.payload)
+                    continue
+                self.stats["notifications"] += 1
+                self._deliver(payload)
+
+    def _run(self) -> None:
+        delay = 1.0
+        first = True
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = self._connect()
+                self.connected = True
+                delay = 1.0
+                if not first:
+                    self.stats["reconnects"] += 1
+                    logger.info("Listener on %s reconnected; invalidating all regions", self.channel)
+                    self._deliver({"dataset": None, "programa": None, "version": None, "watermark": None})
+                first = False
+                self._listen(conn)
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.warning("Listener on %s dropped: %s; retrying in %.0fs", self.channel, e, delay)
+            finally:
+                self.connected = False
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            self._stop.wait(delay)
+            delay = min(delay * 2, CHANGE_FEED_RECONNECT_MAX_S)
+
+    def start(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name=f"listen-{self.channel}", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with _regions_lock:
+            regions = [n for n, _ in _regions]
+        return {"channel": self.channel, "connected": self.connected, "regions": regions, **self.stats}
+
+
+# One listener per process on the data DB (the one the ETL writes to)
+change_listener = ChangeFeedListener(get_settings().database_url_data)
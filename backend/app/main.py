@@ -7,6 +7,8 @@ import os
 import logging
 
 from app.core.database import SessionUsers
+from app.core.change_feed import CHANGE_FEED_ENABLED, change_listener, register_region
+from app.services.question_catalog import invalidate_catalog
 from app.core.security import get_password_hash
 from app.models.user import User
  
@@ -80,6 +82,21 @@ app.include_router(
     tags=["Audit"]
 )
 
+# ============================ Change feed ============================
+# Cache regions invalidated when the ETL notifies a committed load
+register_region("question_catalog", lambda dataset, payload: invalidate_catalog(dataset))
+
+
+@app.on_event("startup")
+def start_change_feed():
+    if CHANGE_FEED_ENABLED and not settings.database_url_data.startswith("sqlite"):
+        change_listener.start()
+
+
+@app.on_event("shutdown")
+def stop_change_feed():
+    change_listener.stop()
+
 # ============================ Root Endpoint ============================
 @app.get("/")
 def read_root():
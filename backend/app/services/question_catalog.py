@@ -0,0 +1,120 @@
+import os
+import re
+import threading
+import time
+import unicodedata
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+# Catalog of survey questions written by the agent's ETL on every load
+# (etl.question_catalog + etl.question_keywords). Cached per dataset so
+# statistics routes don't hit the catalog on each request.
+CATALOG_SCHEMA = os.getenv("ETL_SCHEMA", "etl")
+CATALOG_TTL_S = float(os.getenv("QUESTION_CATALOG_TTL_S", "300"))
+
+# Same filters the ETL applies when building palabras_clave
+# (agent/etl/catalog.py keywords_for); queries must be tokenized alike.
+STOPWORDS = {
+    "de", "del", "la", "las", "el", "los", "en", "su", "sus", "que", "con", "por",
+    "para", "una", "uno", "un", "al", "lo", "se", "es", "usted", "cual", "como",
+}
+MIN_KEYWORD_LEN = 3
+
+# Same rule the ETL uses for es_pregunta (agent/etl/catalog.py), for when the
+# catalog has not been generated yet
+QUESTION_CODE_RE = re.compile(r"^([a-z]+\d+_\d+)(?:_|$)")
+NON_QUESTION_COLUMNS = {"id_id_de_respuesta", "programa", "version", "submitdate_fecha_de_envio"}
+
+_cache: Dict[str, tuple] = {}
+_lock = threading.Lock()
+
+
+def _read_catalog(db: Session, dataset: str) -> List[Dict[str, Any]]:
+    exists = db.execute(
+        text("SELECT to_regclass(:fq)"), {"fq": f'"{CATALOG_SCHEMA}"."question_catalog"'}
+    ).scalar()
+    if not exists:
+        return []
+    rows = db.execute(
+        text(
+            f'SELECT * FROM "{CATALOG_SCHEMA}"."question_catalog" '
+            "WHERE dataset = :dataset ORDER BY posicion"
+        ),
+        {"dataset": dataset},
+    )
+    return [dict(r._mapping) for r in rows]
+
+
+def get_catalog(db: Session, dataset: str) -> List[Dict[str, Any]]:
+    """Return the catalog rows for a dataset (ordered by column position), cached with a TTL."""
+    now = time.monotonic()
+    with _lock:
+        hit = _cache.get(dataset)
+        if hit and now - hit[0] < CATALOG_TTL_S:
+            return hit[1]
+
+    rows = _read_catalog(db, dataset)
+    if rows:
+        keyword_index: Dict[str, List[str]] = {}
+        for row in rows:
+            for word in (row.get("palabras_clave") or "").split():
+                keyword_index.setdefault(word, []).append(row["columna"])
+        with _lock:
+            _cache[dataset] = (now, rows, keyword_index)
+    return rows
+
+
+def get_keyword_index(db: Session, dataset: str) -> Dict[str, List[str]]:
+    """Inverted index keyword -> columns for a dataset."""
+    get_catalog(db, dataset)
+    with _lock:
+        hit = _cache.get(dataset)
+    return hit[2] if hit else {}
+
+
+def _normalize_keyword(kw: str) -> str:
+    kw = unicodedata.normalize("NFD", kw.strip().lower())
+    return "".join(c for c in kw if unicodedata.category(c) != "Mn")
+
+
+def is_question_column(column: str) -> bool:
+    """Whether a core column is a survey question (es_pregunta in the catalog)."""
+    return column not in NON_QUESTION_COLUMNS and bool(QUESTION_CODE_RE.match(column))
+
+
+def query_keywords(query: str) -> List[str]:
+    """
+    Tokenize a search query like the ETL tokenizes headers: strip accents,
+    split on non-word characters and drop stopwords, digits and short tokens.
+    """
+    seen: Dict[str, None] = {}
+    for token in re.split(r"[^\w]+|_", _normalize_keyword(query)):
+        if len(token) >= MIN_KEYWORD_LEN and token not in STOPWORDS and not token.isdigit():
+            seen.setdefault(token, None)
+    return list(seen)
+
+
+def search_questions(db: Session, dataset: str, query: str) -> List[Dict[str, Any]]:
+    """Catalog rows whose keywords contain every keyword of `query`, in column order."""
+    keywords = query_keywords(query)
+    if not keywords:
+        return []
+    rows = get_catalog(db, dataset)
+    index = get_keyword_index(db, dataset)
+    matches: Optional[set] = None
+    for kw in keywords:
+        hits = set(index.get(kw, []))
+        matches = hits if matches is None else matches & hits
+    if not matches:
+        return []
+    return [row for row in rows if row["columna"] in matches]
+
+
+def invalidate_catalog(dataset: Optional[str] = None) -> None:
+    with _lock:
+        if dataset is None:
+            _cache.clear()
+        else:
+            _cache.pop(dataset, None)